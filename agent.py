@@ -1,26 +1,140 @@
 import os
 import json
-import google.genai as genai
-from google.genai import types
+import asyncio
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from tools import rule_based_risk_analyzer
 from spam_detector import analyze_call_transcript
+import upi_guardian
 from upi_guardian import scan_and_verify_upi
-from PIL import Image
-from gtts import gTTS
-import uuid
+from cache import ResponseCache, hash_source, make_cache_key
+from policy import DecisionPolicy, TIER_CACHE, TIER_NEAR_DUPLICATE, TIER_LLM
+from gemini_client import GeminiClient, DeadlineExceeded
+from model_router import ModelRouter, GEMINI_MODELS
+from context_cache import ContextCache
+from metrics import timed, record_gemini_usage, gauge_callback, ANALYSIS_TIER, CACHE_LOOKUPS, PAYLOAD_BYTES
+from audio_store import AudioStore
+from image_prep import prepare_image
+from phash_index import get_phash_index, image_dhash, PHASH_LOOKUPS
+from audio_pipeline import (prepare_audio, merge_chunk_results, is_early_exit, format_timestamp,
+                            AudioTranscodeError, AUDIO_CHUNK_CONCURRENCY, TRANSCODED_MIME_TYPE)
 
 load_dotenv()
 
+# Upper bound on threads used to offload blocking stages (QR decode, image load, TTS)
+STAGE_EXECUTOR_WORKERS = int(os.getenv("STAGE_EXECUTOR_WORKERS", str(min(8, (os.cpu_count() or 1) + 2))))
+
+# Response cache for repeated forwards (size 0 disables it)
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "4096"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "21600"))
+RESPONSE_CACHE_DIR = os.getenv("RESPONSE_CACHE_DIR") # Optional on-disk tier
+RESPONSE_CACHE_DISK_MAX = int(os.getenv("RESPONSE_CACHE_DISK_MAX", "100000")) # Files kept on disk
+
+# When advice audio is synthesized: eager, background or lazy
+AUDIO_ADVICE_MODE = os.getenv("AUDIO_ADVICE_MODE", "background")
+
+AUDIO_MIME_TYPES = {
+    ".mp3": "audio/mp3",
+    ".wav": "audio/wav",
+    ".m4a": "audio/aac",
+    ".ogg": "audio/ogg",
+}
+
+def audio_mime_type(filename: str) -> str:
+    """
+    Guesses the audio MIME type from a file name, defaulting to mp3.
+    """
+    return AUDIO_MIME_TYPES.get(os.path.splitext(filename or "")[1].lower(), "audio/mp3")
+
+def _load_image_parts(image) -> list:
+    """
+    Prompt parts for an image or PDF (path or bytes), downscaled and
+    re-encoded to the image_prep budgets.
+    """
+    from google.genai import types
+    with timed("image_load"):
+        return [types.Part.from_bytes(data=data, mime_type=mime_type) for data, mime_type in prepare_image(image)]
+
+ANALYSIS_REQUIRED_FIELDS = ("risk_level", "score", "category", "reasons", "advice", "extracted_details")
+
+# JSON schema for structured output
+ANALYSIS_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "risk_level": {"type": "STRING", "enum": ["SAFE", "SUSPICIOUS", "SCAM", "CONFUSING"]},
+        "score": {"type": "INTEGER"},
+        "category": {"type": "STRING", "enum": ["upi", "loan", "insurance", "spam_call", "unknown"]},
+        "reasons": {"type": "ARRAY", "items": {"type": "STRING"}},
+        "advice": {"type": "STRING"},
+        "transcript": {"type": "STRING", "nullable": True},
+        "extracted_details": {
+            "type": "OBJECT",
+            "properties": {
+                "interest_rate": {"type": "STRING", "nullable": True},
+                "fees": {"type": "STRING", "nullable": True},
+                "tenure": {"type": "STRING", "nullable": True},
+                "exclusions": {"type": "STRING", "nullable": True},
+                "other_key_points": {"type": "ARRAY", "items": {"type": "STRING"}}
+            }
+        }
+    },
+    "required": list(ANALYSIS_REQUIRED_FIELDS)
+}
+
+def is_valid_analysis(response) -> bool:
+    """
+    True if a Gemini response is a JSON object with every required field.
+    """
+    try:
+        result = json.loads(response.text)
+    except (TypeError, ValueError):
+        return False
+    return isinstance(result, dict) and all(field in result for field in ANALYSIS_REQUIRED_FIELDS)
+
+def _payload_size(source) -> int:
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return len(source)
+    try:
+        return os.path.getsize(source)
+    except OSError:
+        return 0
+
+def _record_payload_sizes(text_input: str, image, audio):
+    if text_input:
+        PAYLOAD_BYTES.observe(len(text_input.encode("utf-8")), kind="text")
+    if image is not None:
+        PAYLOAD_BYTES.observe(_payload_size(image), kind="image")
+    if audio is not None:
+        PAYLOAD_BYTES.observe(_payload_size(audio), kind="audio")
+
 class FinancialSafetyNet:
     def __init__(self):
         api_key = os.getenv("GEMINI_API_KEY")
         if not api_key:
             raise ValueError("GEMINI_API_KEY not found in environment variables.")
         
-        self.client = genai.Client(api_key=api_key)
-        # Switching to gemini-1.5-flash for better stability/quota
-        self.model_name = "gemini-1.5-flash" 
+        self._api_key = api_key
+        self._base_url = os.getenv("GEMINI_BASE_URL") # e.g. a local fake_gemini.py server
+        # The google-genai SDK is slow to import, so the client is built on first use
+        self._gemini = None
+        self._gemini_lock = threading.Lock()
+        # Requests go to the fastest healthy model in GEMINI_MODELS
+        self.router = ModelRouter(GEMINI_MODELS)
+        self.model_name = self.router.models[0]
+        self._config = None
+        self._cached_configs = {} # model -> (cache name, config)
+        self._config_lock = threading.Lock() # Request threads share _config and _cached_configs
+        self.executor = ThreadPoolExecutor(max_workers=STAGE_EXECUTOR_WORKERS, thread_name_prefix="agent-stage")
+        self.audio_store = AudioStore()
+        self.policy = DecisionPolicy()
+        self.tier_counts = Counter() # Which tier answered each request
+        self._tier_lock = threading.Lock()
+        gauge_callback("fsn_response_cache_entries", "Entries in the in-memory response cache", [],
+                       lambda: {(): len(self.response_cache.memory)})
+        self.response_cache = ResponseCache(max_entries=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL, disk_dir=RESPONSE_CACHE_DIR,
+                                            disk_max_entries=RESPONSE_CACHE_DISK_MAX)
 
         self.system_instruction = """
 You are the "Financial Safety Net Agent" for India.
@@ -44,139 +158,632 @@ Follow these steps:
 Use the provided tools/context to enhance your reasoning.
 Always output valid JSON matching the schema provided in the user prompt.
 """
+        self.context_cache = ContextCache(self.system_instruction)
+
+    @property
+    def gemini(self) -> GeminiClient:
+        if self._gemini is None:
+            with self._gemini_lock:
+                if self._gemini is None:
+                    import google.genai as genai
+                    from google.genai import types
+                    http_options = types.HttpOptions(base_url=self._base_url) if self._base_url else None
+                    self._gemini = GeminiClient(genai.Client(api_key=self._api_key, http_options=http_options))
+        return self._gemini
+
+    @property
+    def client(self):
+        return self.gemini.client
 
-    def generate_audio_advice(self, text: str, output_dir: str = "static/audio"):
+    async def _ensure_gemini_async(self):
+        # The first use imports the SDK; keep that off the event loop
+        if self._gemini is None:
+            await asyncio.get_running_loop().run_in_executor(self.executor, lambda: self.gemini)
+
+    def warm_up(self):
+        """
+        Loads everything that is otherwise loaded on first use: the Gemini
+        client, PIL, the TTS backend, OpenCV and the QReader model.
         """
-        Generates an audio file from the advice text using gTTS.
+        with timed("warm_up"):
+            self.gemini
+            self._generation_config()
+            for model in self.router.models:
+                self.context_cache.get(self.client, model) # Created in the background
+            from PIL import Image
+            self.audio_store.backend.warm_up()
+            upi_guardian.warm_up()
+
+    def generate_audio_advice(self, text: str):
+        """
+        Returns the audio file name for the advice text.
+        In "eager" mode the clip is synthesized before returning; in "background"
+        mode it is queued on the TTS worker; in "lazy" mode it is synthesized on
+        the first GET under /static/audio.
         """
         try:
-            os.makedirs(output_dir, exist_ok=True)
-            filename = f"advice_{uuid.uuid4().hex}.mp3"
-            filepath = os.path.join(output_dir, filename)
-            
-            tts = gTTS(text=text, lang='en', tld='co.in') # Indian English accent
-            tts.save(filepath)
-            
-            return filename
+            if AUDIO_ADVICE_MODE == "eager":
+                return self.audio_store.get_or_create(text)
+            if AUDIO_ADVICE_MODE == "lazy":
+                return self.audio_store.register(text)
+            return self.audio_store.schedule(text)
         except Exception as e:
             print(f"TTS Generation failed: {e}")
             return None
 
-    def analyze(self, text_input: str = None, image_path: str = None, audio_path: str = None, category_hint: str = "unknown"):
+    def _cache_key(self, text_input: str, image, audio, category_hint: str):
         """
-        Main analysis function.
+        Content-addressed cache key for a request, or None if an input can't
+        be read or the request must not be cached.
+        """
+        # A QR verdict depends on the VPA reputation, which reloads; the phash
+        # index keys those by the verification status instead
+        if category_hint == "upi_qr":
+            return None
+        try:
+            image_hash = hash_source(image) if image is not None else None
+            audio_hash = hash_source(audio) if audio is not None else None
+        except OSError:
+            return None
+        return make_cache_key(text_input, category_hint, image_hash, audio_hash)
+
+    def _cache_lookup(self, text_input: str, image, audio, category_hint: str):
+        """
+        Records payload sizes and looks the request up in the response cache.
+        Returns (cache_key, cached_result_or_None).
+        """
+        with timed("cache_lookup"):
+            _record_payload_sizes(text_input, image, audio)
+            cache_key = self._cache_key(text_input, image, audio, category_hint)
+            cached = self.response_cache.get(cache_key) if cache_key else None
+        CACHE_LOOKUPS.inc(result="hit" if cached is not None else "miss")
+        return cache_key, cached
+
+    def _image_phash(self, image):
+        """
+        Perceptual hash of a QR image for the phash index, or None.
+        """
+        if get_phash_index() is None:
+            return None
+        with timed("phash"):
+            return image_dhash(image)
+
+    def _near_duplicate_lookup(self, text_input: str, category_hint: str, phash, upi_result: dict):
+        """
+        Looks a QR request up in the perceptual-hash index, so a resized or
+        re-compressed copy of an analyzed poster reuses its verdict.
+        Similar layout alone is not enough (same-template posters carry
+        different QR codes): the payload just decoded from this image must
+        match too. Returns (near_key, result_or_None); near_key is
+        (phash, scope), or None when the request cannot be indexed.
+        """
+        index = get_phash_index()
+        if index is None or phash is None or not upi_result.get("upi_string"):
+            return None, None
+        # Only requests with the same text, category, QR payload and VPA
+        # reputation share verdicts, so a newly reported VPA is analyzed again
+        status = upi_result["verification_result"]["status"]
+        near_key = (phash, make_cache_key(text_input, category_hint, upi_result["upi_string"], status))
+        hit = index.lookup(*near_key)
+        PHASH_LOOKUPS.inc(scope="analysis", result="hit" if hit else "miss")
+        if hit is None:
+            return near_key, None
+        result, distance = hit
+        result = json.loads(json.dumps(result))
+        result["near_duplicate_distance"] = distance
+        return near_key, result
+
+    def _record_tier(self, result: dict, tier: str) -> dict:
+        result["tier"] = tier
+        with self._tier_lock:
+            self.tier_counts[tier] += 1
+        ANALYSIS_TIER.inc(tier=tier)
+        return result
+
+    def _attach_audio_advice(self, result: dict) -> dict:
+        # Generate Audio Advice
+        if "advice" in result:
+            with timed("audio_advice"):
+                audio_file = self.generate_audio_advice(result["advice"])
+            if audio_file:
+                result["audio_advice_url"] = f"/static/audio/{audio_file}"
+        return result
+
+    async def _attach_audio_advice_async(self, result: dict) -> dict:
+        if AUDIO_ADVICE_MODE == "eager":
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, self._attach_audio_advice, result)
+        # Only registers or queues the clip, so it is cheap enough to run inline
+        return self._attach_audio_advice(result)
+
+    def _rule_pre_analysis(self, text_input: str, category_hint: str):
+        """
+        Runs the local rule engines over the text input.
+        Returns (rule_based_result, category_hint).
         """
-        
-        # 1. Rule-Based Pre-analysis (if text is available)
         rule_based_result = {}
         if text_input:
-            rule_based_result = rule_based_risk_analyzer(text_input, category_hint)
-            
-            # Check for spam patterns if it looks like a transcript
-            if category_hint == "spam_check" or "call" in text_input.lower():
-                spam_result = analyze_call_transcript(text_input)
-                # Merge results (prioritize high risk)
-                if spam_result["score"] > rule_based_result.get("score", 0):
-                    rule_based_result = spam_result
-                    category_hint = "spam_call"
+            with timed("rules"):
+                rule_based_result = rule_based_risk_analyzer(text_input, category_hint)
+                
+                # Check for spam patterns if it looks like a transcript
+                if category_hint == "spam_check" or "call" in text_input.lower():
+                    spam_result = analyze_call_transcript(text_input)
+                    # Merge results (prioritize high risk)
+                    if spam_result["score"] > rule_based_result.get("score", 0):
+                        rule_based_result = spam_result
+                        category_hint = "spam_call"
+        return rule_based_result, category_hint
 
-        # 2. UPI Guardian Check (if image is QR)
-        upi_result = {}
-        if image_path and category_hint == "upi_qr":
-             upi_result = scan_and_verify_upi(image_path)
-             if "error" not in upi_result:
-                 # Construct a text description for Gemini
-                 text_input = f"UPI QR Code detected. VPA: {upi_result['extracted_details'].get('pa')}. Verification Status: {upi_result['verification_result']['status']}."
-                 rule_based_result = {"risk_level": upi_result['verification_result']['risk_level'], "reasons": [upi_result['verification_result']['message']]}
+    def _apply_upi_result(self, upi_result: dict, text_input: str, rule_based_result: dict):
+        """
+        Folds a UPI QR verification into the text input and rule result sent to Gemini.
+        """
+        if "error" not in upi_result:
+            # Construct a text description for Gemini
+            text_input = f"UPI QR Code detected. VPA: {upi_result['extracted_details'].get('pa')}. Verification Status: {upi_result['verification_result']['status']}."
+            rule_based_result = {"risk_level": upi_result['verification_result']['risk_level'], "reasons": [upi_result['verification_result']['message']]}
+        return text_input, rule_based_result
 
-        # 3. Gemini Analysis
+    def _load_audio_part(self, audio, mime_type: str = None, prepared=None):
+        from google.genai import types
+        with timed("audio_load"):
+            if prepared is not None:
+                try:
+                    return types.Part.from_bytes(data=prepared.transcode(), mime_type=TRANSCODED_MIME_TYPE)
+                except AudioTranscodeError as e:
+                    print(f"Audio transcode failed, sending the original recording: {e}")
+            return self._read_audio_part(audio, mime_type)
+
+    def _read_audio_part(self, audio, mime_type: str = None):
+        from google.genai import types
+        if isinstance(audio, (bytes, bytearray, memoryview)):
+            return types.Part.from_bytes(data=bytes(audio), mime_type=mime_type or "audio/mp3")
+        # Read audio file as bytes
+        with open(audio, "rb") as f:
+            audio_bytes = f.read()
+        return types.Part.from_bytes(data=audio_bytes, mime_type=mime_type or audio_mime_type(audio))
+
+    def _build_prompt_parts(self, text_input, image_parts, audio_part, rule_based_result: dict, upi_result: dict,
+                            audio_note: str = None) -> list:
         prompt_parts = []
         
         if text_input:
             prompt_parts.append(f"User Input Text: {text_input}")
+        if image_parts:
+            prompt_parts.extend(image_parts)
+        if audio_part is not None:
+            prompt_parts.append(audio_part)
+            prompt_parts.append("Please transcribe this audio and analyze it for spam/scam risks.")
+            if audio_note:
+                prompt_parts.append(audio_note)
+
+        prompt_parts.append(f"Rule-Based Analysis Result: {json.dumps(rule_based_result)}")
+        prompt_parts.append(f"UPI Verification Result: {json.dumps(upi_result)}")
+        return prompt_parts
+
+    def _generation_config(self):
+        """
+        The request config with the system instruction inline. Built once;
+        the SDK only reads it, so every request shares the same object.
+        """
+        with self._config_lock:
+            if self._config is None:
+                from google.genai import types
+                self._config = types.GenerateContentConfig(
+                    system_instruction=self.system_instruction,
+                    response_mime_type="application/json",
+                    response_schema=ANALYSIS_SCHEMA
+                )
+            return self._config
+
+    def _request_config(self, model: str):
+        """
+        The config for one call to model: referring to the model's cached
+        system instruction when the context cache has one, else inline.
+        """
+        name = self.context_cache.get(self.client, model)
+        if name is None:
+            return self._generation_config()
+        config = self._generation_config()
+        with self._config_lock:
+            cached = self._cached_configs.get(model)
+            if cached is None or cached[0] != name:
+                # The instruction lives in the cache; sending it too is an error
+                cached = self._cached_configs[model] = (name, config.model_copy(update={"system_instruction": None, "cached_content": name}))
+            return cached[1]
+
+    def _generate(self, prompt_parts: list):
+        try:
+            return self.router.generate(self.gemini, contents=prompt_parts, config=self._request_config,
+                                        validate=is_valid_analysis)
+        except Exception as e:
+            if not self.context_cache.handle_error(e):
+                raise
+        # The cache expired or was deleted under us; send the instruction inline
+        return self.router.generate(self.gemini, contents=prompt_parts, config=self._generation_config(),
+                                    validate=is_valid_analysis)
+
+    async def _agenerate(self, prompt_parts: list):
+        try:
+            return await self.router.agenerate(self.gemini, contents=prompt_parts, config=self._request_config,
+                                               validate=is_valid_analysis)
+        except Exception as e:
+            if not self.context_cache.handle_error(e):
+                raise
+        return await self.router.agenerate(self.gemini, contents=prompt_parts, config=self._generation_config(),
+                                           validate=is_valid_analysis)
+
+    def _post_process(self, response_text: str) -> dict:
+        with timed("json_parse"):
+            result = json.loads(response_text)
+        
+        # Post-Analysis: Apply strict rules to the transcript if available
+        # This ensures that even if Gemini misses the context, our keyword list catches it.
+        if result.get("transcript"):
+            transcript_text = result["transcript"]
+            with timed("transcript_recheck"):
+                strict_check = rule_based_risk_analyzer(transcript_text, "spam_call")
             
-        if image_path:
+            if strict_check["score"] > result["score"]:
+                result["risk_level"] = strict_check["risk_level"]
+                result["score"] = strict_check["score"]
+                result["reasons"].extend(strict_check["reasons"])
+                result["advice"] += " " + " ".join([r for r in strict_check["reasons"] if "sensitive" in r.lower()])
+        return result
+
+    def _error_result(self, e: Exception) -> dict:
+        error_msg = str(e)
+        if isinstance(e, DeadlineExceeded):
+            return {
+                "error": "The AI model is busy right now. Please try again in a moment.",
+                "details": str(e)
+            }
+        if "429" in error_msg:
+            return {
+                "error": "Quota Exceeded. Please try again later or switch to a different model.",
+                "details": "The AI model is currently busy or you have hit your rate limit."
+            }
+        return {"error": f"Gemini Analysis Failed: {e}"}
+
+    def analyze(self, text_input: str = None, image_path: str = None, audio_path: str = None, category_hint: str = "unknown",
+                image_bytes: bytes = None, audio_bytes: bytes = None, audio_mime_type: str = None):
+        """
+        Main analysis function.
+        Images and audio may be given as file paths or as in-memory bytes.
+        """
+        image_source = image_bytes if image_bytes is not None else image_path
+        audio_source = audio_bytes if audio_bytes is not None else audio_path
+
+        cache_key, cached = self._cache_lookup(text_input, image_source, audio_source, category_hint)
+        if cached is not None:
+            return self._attach_audio_advice(self._record_tier(cached, TIER_CACHE))
+        
+        # 1. Rule-Based Pre-analysis (if text is available)
+        rule_based_result, category_hint = self._rule_pre_analysis(text_input, category_hint)
+
+        # 2. UPI Guardian Check (if image is QR)
+        upi_result = {}
+        near_key = None
+        if image_source is not None and category_hint == "upi_qr":
+            phash = self._image_phash(image_source)
+            with timed("upi_check"):
+                upi_result = scan_and_verify_upi(image_source, phash)
+            if audio_source is None:
+                near_key, near = self._near_duplicate_lookup(text_input, category_hint, phash, upi_result)
+                if near is not None:
+                    return self._attach_audio_advice(self._record_tier(near, TIER_NEAR_DUPLICATE))
+            text_input, rule_based_result = self._apply_upi_result(upi_result, text_input, rule_based_result)
+
+        # Short-circuit: certain verdicts are answered locally without the LLM
+        local_result = self.policy.decide(rule_based_result, upi_result, category_hint, has_audio=audio_source is not None)
+        if local_result is not None:
+            return self._attach_audio_advice(self._record_tier(local_result, local_result["tier"]))
+
+        # 3. Gemini Analysis
+        image_parts = None
+        if image_source is not None:
             try:
-                image = Image.open(image_path)
-                prompt_parts.append(image)
+                image_parts = _load_image_parts(image_source)
             except Exception as e:
                 return {"error": f"Failed to load image: {e}"}
 
-        if audio_path:
+        prepared = self._prepare_audio(audio_source)
+        try:
+            if prepared is not None and prepared.chunked:
+                # Long recordings: chunks are analyzed concurrently on the async client
+                state = {"text_input": text_input, "rule_based_result": rule_based_result,
+                         "upi_result": upi_result, "cache_key": cache_key, "near_key": near_key}
+                try:
+                    result = asyncio.run(self._analyze_audio_chunks_async(state, prepared))
+                except Exception as e:
+                    return self._error_result(e)
+                return self._attach_audio_advice(result)
+
+            audio_part = None
+            if audio_source is not None:
+                try:
+                    audio_part = self._load_audio_part(audio_source, audio_mime_type, prepared)
+                except Exception as e:
+                    return {"error": f"Failed to load audio: {e}"}
+        finally:
+            if prepared is not None:
+                prepared.close()
+
+        prompt_parts = self._build_prompt_parts(text_input, image_parts, audio_part, rule_based_result, upi_result)
+
+        try:
+            with timed("gemini"):
+                response = self._generate(prompt_parts)
+            record_gemini_usage(response)
+            
+            result = self._store_llm_result(cache_key, self._post_process(response.text), near_key)
+            return self._attach_audio_advice(result)
+            
+        except Exception as e:
+            return self._error_result(e)
+
+    async def _local_stages_async(self, text_input: str, image_source, audio_source, category_hint: str) -> dict:
+        """
+        Runs the cache lookup, rule engines, UPI check and decision policy.
+        Returns the stage state; "result" is set when no Gemini call is needed.
+        """
+        loop = asyncio.get_running_loop()
+        state = {"text_input": text_input, "category_hint": category_hint, "result": None,
+                 "rule_based_result": {}, "upi_result": {}, "near_key": None}
+
+        state["cache_key"], cached = await loop.run_in_executor(self.executor, self._cache_lookup, text_input, image_source, audio_source, category_hint)
+        if cached is not None:
+            state["result"] = self._record_tier(cached, TIER_CACHE)
+            return state
+
+        rule_based_result, category_hint = self._rule_pre_analysis(text_input, category_hint)
+
+        upi_result = {}
+        if image_source is not None and category_hint == "upi_qr":
+            phash = await loop.run_in_executor(self.executor, self._image_phash, image_source)
+            with timed("upi_check"):
+                upi_result = await loop.run_in_executor(self.executor, scan_and_verify_upi, image_source, phash)
+            if audio_source is None:
+                state["near_key"], near = self._near_duplicate_lookup(text_input, category_hint, phash, upi_result)
+                if near is not None:
+                    state["result"] = self._record_tier(near, TIER_NEAR_DUPLICATE)
+                    return state
+            text_input, rule_based_result = self._apply_upi_result(upi_result, text_input, rule_based_result)
+
+        state.update(text_input=text_input, category_hint=category_hint,
+                     rule_based_result=rule_based_result, upi_result=upi_result)
+        local_result = self.policy.decide(rule_based_result, upi_result, category_hint, has_audio=audio_source is not None)
+        if local_result is not None:
+            state["result"] = self._record_tier(local_result, local_result["tier"])
+        return state
+
+    async def _prompt_parts_async(self, state: dict, image_source, audio_source, audio_mime_type: str = None,
+                                  prepared=None) -> list:
+        """
+        Loads the image and audio on the stage executor and builds the Gemini prompt.
+        Raises ValueError with a user-facing message if a file cannot be read.
+        """
+        await self._ensure_gemini_async()
+        loop = asyncio.get_running_loop()
+        image_parts = None
+        if image_source is not None:
             try:
-                # Read audio file as bytes
-                with open(audio_path, "rb") as f:
-                    audio_bytes = f.read()
-                prompt_parts.append(types.Part.from_bytes(data=audio_bytes, mime_type="audio/mp3")) # Assuming mp3 for now
-                prompt_parts.append("Please transcribe this audio and analyze it for spam/scam risks.")
+                image_parts = await loop.run_in_executor(self.executor, _load_image_parts, image_source)
             except Exception as e:
-                return {"error": f"Failed to load audio: {e}"}
+                raise ValueError(f"Failed to load image: {e}")
 
-        prompt_parts.append(f"Rule-Based Analysis Result: {json.dumps(rule_based_result)}")
-        prompt_parts.append(f"UPI Verification Result: {json.dumps(upi_result)}")
+        audio_part = None
+        if audio_source is not None:
+            try:
+                audio_part = await loop.run_in_executor(self.executor, self._load_audio_part, audio_source, audio_mime_type, prepared)
+            except Exception as e:
+                raise ValueError(f"Failed to load audio: {e}")
 
-        # Define the JSON schema for structured output
-        schema = {
-            "type": "OBJECT",
-            "properties": {
-                "risk_level": {"type": "STRING", "enum": ["SAFE", "SUSPICIOUS", "SCAM", "CONFUSING"]},
-                "score": {"type": "INTEGER"},
-                "category": {"type": "STRING", "enum": ["upi", "loan", "insurance", "spam_call", "unknown"]},
-                "reasons": {"type": "ARRAY", "items": {"type": "STRING"}},
-                "advice": {"type": "STRING"},
-                "transcript": {"type": "STRING", "nullable": True},
-                "extracted_details": {
-                    "type": "OBJECT",
-                    "properties": {
-                        "interest_rate": {"type": "STRING", "nullable": True},
-                        "fees": {"type": "STRING", "nullable": True},
-                        "tenure": {"type": "STRING", "nullable": True},
-                        "exclusions": {"type": "STRING", "nullable": True},
-                        "other_key_points": {"type": "ARRAY", "items": {"type": "STRING"}}
-                    }
-                }
-            },
-            "required": ["risk_level", "score", "category", "reasons", "advice", "extracted_details"]
-        }
+        return self._build_prompt_parts(state["text_input"], image_parts, audio_part, state["rule_based_result"], state["upi_result"])
+
+    def _store_llm_result(self, cache_key: str, result: dict, near_key=None) -> dict:
+        result = self._record_tier(result, TIER_LLM)
+        if cache_key:
+            self.response_cache.set(cache_key, dict(result))
+        if near_key and "error" not in result:
+            get_phash_index().add(*near_key, dict(result))
+        return result
 
+    def _finish_llm_result(self, state: dict, response_text: str) -> dict:
+        return self._store_llm_result(state["cache_key"], self._post_process(response_text), state.get("near_key"))
+
+    def _prepare_audio(self, audio_source):
+        """
+        Probes the recording for transcoding and chunking. Returns a
+        PreparedAudio, or None when ffmpeg is unavailable or there is no audio.
+        """
+        if audio_source is None:
+            return None
         try:
-            response = self.client.models.generate_content(
-                model=self.model_name,
-                contents=prompt_parts,
-                config=types.GenerateContentConfig(
-                    system_instruction=self.system_instruction,
-                    response_mime_type="application/json",
-                    response_schema=schema
-                )
+            return prepare_audio(audio_source)
+        except (AudioTranscodeError, OSError) as e:
+            print(f"Audio probe failed, sending the original recording: {e}")
+            return None
+
+    async def _prepare_audio_async(self, audio_source):
+        if audio_source is None:
+            return None
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self._prepare_audio, audio_source)
+
+    async def _iter_audio_chunks(self, state: dict, prepared):
+        """
+        Analyzes the chunks of a long recording concurrently, at most
+        AUDIO_CHUNK_CONCURRENCY transcoded chunks in memory at once, and yields
+        (index, result) as each finishes. Stops as soon as one chunk is a SCAM.
+        """
+        await self._ensure_gemini_async()
+        from google.genai import types
+        loop = asyncio.get_running_loop()
+        slots = asyncio.Semaphore(AUDIO_CHUNK_CONCURRENCY)
+        total = len(prepared.windows)
+
+        async def analyze_chunk(index: int):
+            async with slots:
+                with timed("audio_transcode"):
+                    data = await loop.run_in_executor(self.executor, prepared.transcode, index)
+                start, end = prepared.windows[index]
+                audio_part = types.Part.from_bytes(data=data, mime_type=TRANSCODED_MIME_TYPE)
+                note = f"This is part {index + 1} of {total} of a longer call recording ({format_timestamp(start)} to {format_timestamp(end)})."
+                prompt_parts = self._build_prompt_parts(state["text_input"], None, audio_part, state["rule_based_result"],
+                                                        state["upi_result"], audio_note=note)
+                with timed("gemini"):
+                    response = await self._agenerate(prompt_parts)
+                record_gemini_usage(response)
+                return index, self._post_process(response.text)
+
+        tasks = [asyncio.ensure_future(analyze_chunk(index)) for index in range(total)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                index, result = await next_done
+                yield index, result
+                if is_early_exit(result):
+                    return
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _analyze_audio_chunks_async(self, state: dict, prepared) -> dict:
+        chunk_results = [item async for item in self._iter_audio_chunks(state, prepared)]
+        return self._store_llm_result(state["cache_key"], merge_chunk_results(chunk_results, prepared.windows))
+
+    async def transcribe_async(self, audio: bytes, mime_type: str = None) -> str:
+        """
+        Transcribes a short audio clip, e.g. a few seconds of a live call.
+        Returns plain text, or "" if nothing was said.
+        """
+        await self._ensure_gemini_async()
+        audio_part = self._read_audio_part(audio, mime_type)
+        with timed("transcribe"):
+            response = await self.router.agenerate(
+                self.gemini,
+                contents=[audio_part, "Transcribe the speech in this audio clip verbatim. Reply with the transcript only, or nothing if there is no speech."],
             )
-            
-            result = json.loads(response.text)
-            
-            # Post-Analysis: Apply strict rules to the transcript if available
-            # This ensures that even if Gemini misses the context, our keyword list catches it.
-            if result.get("transcript"):
-                transcript_text = result["transcript"]
-                strict_check = rule_based_risk_analyzer(transcript_text, category_hint="spam_call")
-                
-                if strict_check["score"] > result["score"]:
-                    result["risk_level"] = strict_check["risk_level"]
-                    result["score"] = strict_check["score"]
-                    result["reasons"].extend(strict_check["reasons"])
-                    result["advice"] += " " + " ".join([r for r in strict_check["reasons"] if "sensitive" in r.lower()])
-
-            # Generate Audio Advice
-            if "advice" in result:
-                audio_file = self.generate_audio_advice(result["advice"])
-                if audio_file:
-                    result["audio_advice_url"] = f"/static/audio/{audio_file}"
-            
-            return result
-            
+        record_gemini_usage(response)
+        return (response.text or "").strip()
+
+    async def analyze_async(self, text_input: str = None, image_path: str = None, audio_path: str = None, category_hint: str = "unknown",
+                            image_bytes: bytes = None, audio_bytes: bytes = None, audio_mime_type: str = None):
+        """
+        Non-blocking variant of analyze for use inside an event loop.
+        Uses the async Gemini client and runs QR decoding, image/audio loading
+        and TTS on the bounded stage executor.
+        """
+        image_source = image_bytes if image_bytes is not None else image_path
+        audio_source = audio_bytes if audio_bytes is not None else audio_path
+
+        state = await self._local_stages_async(text_input, image_source, audio_source, category_hint)
+        if state["result"] is not None:
+            return await self._attach_audio_advice_async(state["result"])
+
+        prepared = await self._prepare_audio_async(audio_source)
+        try:
+            if prepared is not None and prepared.chunked:
+                result = await self._analyze_audio_chunks_async(state, prepared)
+                return await self._attach_audio_advice_async(result)
+
+            try:
+                prompt_parts = await self._prompt_parts_async(state, image_source, audio_source, audio_mime_type, prepared)
+            except ValueError as e:
+                return {"error": str(e)}
+
+            with timed("gemini"):
+                response = await self._agenerate(prompt_parts)
+            record_gemini_usage(response)
+
+            result = self._finish_llm_result(state, response.text)
+            return await self._attach_audio_advice_async(result)
+
         except Exception as e:
-            error_msg = str(e)
-            if "429" in error_msg:
-                return {
-                    "error": "Quota Exceeded. Please try again later or switch to a different model.",
-                    "details": "The AI model is currently busy or you have hit your rate limit."
+            return self._error_result(e)
+        finally:
+            if prepared is not None:
+                prepared.close()
+
+    async def analyze_stream(self, text_input: str = None, image_path: str = None, audio_path: str = None, category_hint: str = "unknown",
+                             image_bytes: bytes = None, audio_bytes: bytes = None, audio_mime_type: str = None):
+        """
+        Streaming variant of analyze_async. Yields (event, data) pairs:
+
+            local   - preliminary verdict from the rules and UPI check, when
+                      they reached one
+            partial - a chunk of the model's JSON text as Gemini streams it
+            chunk   - the analysis of one part of a long call recording
+            result  - the final analysis (same shape as analyze_async)
+            audio   - {"audio_advice_url": ...} once the advice clip is registered
+            error   - {"error": ...}; nothing follows it
+
+        The local verdict arrives before any Gemini call, within milliseconds.
+        """
+        image_source = image_bytes if image_bytes is not None else image_path
+        audio_source = audio_bytes if audio_bytes is not None else audio_path
+
+        state = await self._local_stages_async(text_input, image_source, audio_source, category_hint)
+        result = state["result"]
+        if result is None:
+            rule_based_result = state["rule_based_result"]
+            # Nothing to show before Gemini when the rules reached no verdict
+            if rule_based_result.get("risk_level"):
+                yield "local", {
+                    "risk_level": rule_based_result.get("risk_level"),
+                    "score": rule_based_result.get("score"),
+                    "reasons": rule_based_result.get("reasons", []),
+                    "upi_check": state["upi_result"] or None,
                 }
-            return {"error": f"Gemini Analysis Failed: {e}"}
+
+            prepared = await self._prepare_audio_async(audio_source)
+            try:
+                if prepared is not None and prepared.chunked:
+                    chunk_results = []
+                    async for index, chunk_result in self._iter_audio_chunks(state, prepared):
+                        chunk_results.append((index, chunk_result))
+                        start, end = prepared.windows[index]
+                        yield "chunk", {"index": index, "total": len(prepared.windows), "start": start, "end": end,
+                                        "risk_level": chunk_result.get("risk_level"), "score": chunk_result.get("score"),
+                                        "reasons": chunk_result.get("reasons", [])}
+                    result = self._store_llm_result(state["cache_key"], merge_chunk_results(chunk_results, prepared.windows))
+                else:
+                    try:
+                        prompt_parts = await self._prompt_parts_async(state, image_source, audio_source, audio_mime_type, prepared)
+                    except ValueError as e:
+                        yield "error", {"error": str(e)}
+                        return
+
+                    chunks = []
+                    usage = None
+                    with timed("gemini"):
+                        # Second pass only if the context cache vanished before the first chunk
+                        for config in (self._request_config, self._generation_config()):
+                            try:
+                                async for chunk in self.router.astream(self.gemini, contents=prompt_parts, config=config):
+                                    if chunk.usage_metadata is not None:
+                                        usage = chunk
+                                    if chunk.text:
+                                        chunks.append(chunk.text)
+                                        yield "partial", {"text": chunk.text}
+                                break
+                            except Exception as e:
+                                if chunks or not callable(config) or not self.context_cache.handle_error(e):
+                                    raise
+                    if usage is not None:
+                        record_gemini_usage(usage)
+                    result = self._finish_llm_result(state, "".join(chunks))
+            except Exception as e:
+                yield "error", self._error_result(e)
+                return
+            finally:
+                if prepared is not None:
+                    prepared.close()
+
+        yield "result", dict(result)
+        # Sent separately so eager synthesis never holds back the verdict
+        result = await self._attach_audio_advice_async(result)
+        if result.get("audio_advice_url"):
+            yield "audio", {"audio_advice_url": result["audio_advice_url"]}
@@ -0,0 +1,196 @@
+"""
+Local preprocessing of call recordings before they are sent to Gemini.
+
+Recordings are transcoded with ffmpeg to mono, low-rate Opus (about 3 KB per
+second of speech) and long calls are split into overlapping windows. Each
+window is produced by its own ffmpeg run that seeks straight to it, so memory
+is bounded by window size times the number of windows in flight, not by the
+length of the recording.
+
+Without ffmpeg on the PATH recordings are sent unchanged, as before.
+"""
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+from functools import lru_cache
+
+FFMPEG_PATH = os.getenv("FFMPEG_PATH", "ffmpeg")
+FFPROBE_PATH = os.getenv("FFPROBE_PATH", "ffprobe")
+AUDIO_SAMPLE_RATE = int(os.getenv("AUDIO_SAMPLE_RATE", "16000"))
+AUDIO_BITRATE = os.getenv("AUDIO_BITRATE", "24k")
+# Recordings longer than one chunk are analyzed as overlapping chunks
+AUDIO_CHUNK_SEC = float(os.getenv("AUDIO_CHUNK_SEC", "300"))
+AUDIO_CHUNK_OVERLAP_SEC = float(os.getenv("AUDIO_CHUNK_OVERLAP_SEC", "15"))
+AUDIO_CHUNK_CONCURRENCY = int(os.getenv("AUDIO_CHUNK_CONCURRENCY", "4"))
+# Stop analyzing further chunks once one scores at least this much
+AUDIO_EARLY_EXIT_SCORE = int(os.getenv("AUDIO_EARLY_EXIT_SCORE", "80"))
+AUDIO_TRANSCODE_TIMEOUT = float(os.getenv("AUDIO_TRANSCODE_TIMEOUT", "120"))
+
+TRANSCODED_MIME_TYPE = "audio/ogg"
+
+DURATION_RE = re.compile(r"Duration:\s*(\d+):(\d+):(\d+(?:\.\d+)?)")
+
+class AudioTranscodeError(RuntimeError):
+    """
+    ffmpeg could not read or convert the recording.
+    """
+
+@lru_cache(maxsize=1)
+def ffmpeg_available() -> bool:
+    return shutil.which(FFMPEG_PATH) is not None
+
+def _run(args: list, input: bytes = None) -> subprocess.CompletedProcess:
+    try:
+        return subprocess.run(args, input=input, capture_output=True, timeout=AUDIO_TRANSCODE_TIMEOUT)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        raise AudioTranscodeError(str(e))
+
+def probe_duration(path: str):
+    """
+    Returns the recording length in seconds, or None if it cannot be read.
+    Uses ffprobe when installed, otherwise the header ffmpeg prints.
+    """
+    if shutil.which(FFPROBE_PATH):
+        proc = _run([FFPROBE_PATH, "-v", "error", "-show_entries", "format=duration",
+                     "-of", "default=noprint_wrappers=1:nokey=1", path])
+        try:
+            return float(proc.stdout.decode().strip())
+        except ValueError:
+            return None
+    # Without an output file ffmpeg exits with an error after printing the input header
+    proc = _run([FFMPEG_PATH, "-hide_banner", "-nostdin", "-i", path])
+    match = DURATION_RE.search(proc.stderr.decode(errors="replace"))
+    if not match:
+        return None
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+def chunk_windows(duration: float, chunk_sec: float = AUDIO_CHUNK_SEC, overlap_sec: float = AUDIO_CHUNK_OVERLAP_SEC) -> list:
+    """
+    Splits [0, duration) into (start, end) windows of chunk_sec that overlap
+    by overlap_sec, so a sentence cut at one boundary is whole in the next.
+    Unknown or short durations give a single window covering everything.
+    """
+    if not duration or duration <= chunk_sec:
+        return [(0.0, duration)]
+    step = max(1.0, chunk_sec - overlap_sec)
+    windows = []
+    start = 0.0
+    while True:
+        end = min(start + chunk_sec, duration)
+        windows.append((start, end))
+        if end >= duration:
+            return windows
+        start += step
+
+def transcode(source, start: float = None, duration: float = None) -> bytes:
+    """
+    Converts a recording (path or bytes), or one window of it, to mono Opus.
+    """
+    args = [FFMPEG_PATH, "-hide_banner", "-loglevel", "error", "-nostdin"]
+    if start:
+        args += ["-ss", f"{start:.3f}"]
+    if duration:
+        args += ["-t", f"{duration:.3f}"]
+    from_memory = isinstance(source, (bytes, bytearray, memoryview))
+    args += ["-i", "pipe:0" if from_memory else source,
+             "-vn", "-ac", "1", "-ar", str(AUDIO_SAMPLE_RATE),
+             "-c:a", "libopus", "-b:a", AUDIO_BITRATE, "-application", "voip",
+             "-f", "ogg", "pipe:1"]
+    proc = _run(args, input=bytes(source) if from_memory else None)
+    if proc.returncode != 0 or not proc.stdout:
+        raise AudioTranscodeError(proc.stderr.decode(errors="replace").strip() or f"ffmpeg exited with {proc.returncode}")
+    return proc.stdout
+
+class PreparedAudio:
+    """
+    A recording on disk (in-memory uploads are written to a temp file so
+    ffmpeg can seek), with its duration and chunk windows.
+    """
+    def __init__(self, source, chunk_sec: float = AUDIO_CHUNK_SEC, overlap_sec: float = AUDIO_CHUNK_OVERLAP_SEC):
+        self._temp_path = None
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            fd, self._temp_path = tempfile.mkstemp(prefix="recording_")
+            with os.fdopen(fd, "wb") as f:
+                f.write(source)
+            self.path = self._temp_path
+        else:
+            self.path = source
+        self.duration = probe_duration(self.path)
+        self.windows = chunk_windows(self.duration, chunk_sec, overlap_sec)
+
+    @property
+    def chunked(self) -> bool:
+        return len(self.windows) > 1
+
+    def transcode(self, index: int = None) -> bytes:
+        """
+        Transcodes window `index`, or the whole recording if index is None.
+        """
+        if index is None:
+            return transcode(self.path)
+        start, end = self.windows[index]
+        return transcode(self.path, start, end - start if end else None)
+
+    def close(self):
+        if self._temp_path and os.path.exists(self._temp_path):
+            os.remove(self._temp_path)
+        self._temp_path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def prepare_audio(source):
+    """
+    Returns a PreparedAudio for the recording, or None when ffmpeg is not
+    installed (the caller then sends the recording unchanged).
+    """
+    if not ffmpeg_available():
+        return None
+    return PreparedAudio(source)
+
+def format_timestamp(seconds: float) -> str:
+    seconds = int(seconds or 0)
+    return f"{seconds // 3600:d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}" if seconds >= 3600 else f"{seconds // 60:d}:{seconds % 60:02d}"
+
+def is_early_exit(result: dict, min_score: int = AUDIO_EARLY_EXIT_SCORE) -> bool:
+    return result.get("risk_level") == "SCAM" or (result.get("score") or 0) >= min_score
+
+def merge_chunk_results(chunk_results: list, windows: list) -> dict:
+    """
+    Combines per-chunk analyses, given as (index, result) pairs, into one
+    result. The highest-scoring chunk sets the verdict and advice; reasons,
+    key points and transcripts from every analyzed chunk are kept in order.
+    """
+    ordered = sorted(chunk_results, key=lambda item: item[0])
+    worst = max((result for _, result in ordered), key=lambda result: result.get("score") or 0)
+    merged = dict(worst)
+
+    reasons = []
+    key_points = []
+    transcripts = []
+    for index, result in ordered:
+        for reason in result.get("reasons") or []:
+            if reason not in reasons:
+                reasons.append(reason)
+        for point in (result.get("extracted_details") or {}).get("other_key_points") or []:
+            if point not in key_points:
+                key_points.append(point)
+        if result.get("transcript"):
+            start, end = windows[index]
+            transcripts.append(f"[{format_timestamp(start)}-{format_timestamp(end)}] {result['transcript']}")
+
+    merged["reasons"] = reasons
+    merged["transcript"] = "\n".join(transcripts) or None
+    merged["extracted_details"] = dict(worst.get("extracted_details") or {}, other_key_points=key_points)
+    merged["audio_chunks"] = {
+        "analyzed": len(ordered),
+        "total": len(windows),
+        "early_exit": len(ordered) < len(windows),
+    }
+    return merged
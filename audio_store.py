@@ -0,0 +1,233 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from metrics import timed
+
+AUDIO_STORE_DIR = os.getenv("AUDIO_STORE_DIR", "static/audio")
+AUDIO_STORE_MAX_MB = float(os.getenv("AUDIO_STORE_MAX_MB", "256"))
+AUDIO_STORE_MAX_AGE = float(os.getenv("AUDIO_STORE_MAX_AGE", str(7 * 24 * 3600)))
+TTS_BACKEND = os.getenv("TTS_BACKEND", "gtts")
+TTS_WORKERS = int(os.getenv("TTS_WORKERS", "4"))
+# Advice texts remembered for on-demand synthesis of not-yet-written clips
+AUDIO_PENDING_MAX = int(os.getenv("AUDIO_PENDING_MAX", "10000"))
+
+# A single silent MPEG-1 Layer III frame (128 kbps, 44.1 kHz)
+SILENT_MP3_FRAME = b"\xff\xfb\x90\x64" + b"\x00" * 413
+
+class GTTSBackend:
+    """
+    Google Translate TTS with an Indian English accent.
+    """
+    def __init__(self, lang: str = "en", tld: str = "co.in"):
+        self.lang = lang
+        self.tld = tld
+        self.name = f"gtts:{lang}:{tld}"
+
+    def warm_up(self):
+        import gtts # Deferred: slow to import and unused by most requests
+
+    def synthesize(self, text: str, path: str):
+        from gtts import gTTS
+        gTTS(text=text, lang=self.lang, tld=self.tld).save(path)
+
+class SilentBackend:
+    """
+    Offline stand-in for tests and benchmarks: writes a silent clip after an
+    optional simulated synthesis latency.
+    """
+    def __init__(self, lang: str = "en", latency: float = 0.0):
+        self.lang = lang
+        self.latency = latency
+        self.name = f"silent:{lang}"
+
+    def warm_up(self):
+        pass
+
+    def synthesize(self, text: str, path: str):
+        if self.latency:
+            time.sleep(self.latency)
+        with open(path, "wb") as f:
+            f.write(SILENT_MP3_FRAME)
+
+TTS_BACKENDS = {
+    "gtts": GTTSBackend,
+    "silent": SilentBackend,
+}
+
+def make_tts_backend(name: str = None):
+    name = name or TTS_BACKEND
+    if name not in TTS_BACKENDS:
+        raise ValueError(f"Unknown TTS backend '{name}'. Choose from: {', '.join(TTS_BACKENDS)}")
+    return TTS_BACKENDS[name]()
+
+class AudioStore:
+    """
+    Content-addressed store of synthesized advice clips.
+    Identical advice text (for the same backend and language) maps to the same
+    file, and the directory is kept under a size and age budget.
+    """
+    def __init__(self, directory: str = AUDIO_STORE_DIR, backend=None, max_bytes: int = None,
+                 max_age: float = AUDIO_STORE_MAX_AGE, evict_interval: float = 60):
+        self.directory = directory
+        self.backend = backend or make_tts_backend()
+        self.max_bytes = int(AUDIO_STORE_MAX_MB * 1024 * 1024) if max_bytes is None else max_bytes
+        self.max_age = max_age
+        self.evict_interval = evict_interval
+        self._last_evict = 0.0
+        self._evict_lock = threading.Lock()
+        self._pending = OrderedDict() # filename -> advice text
+        self._inflight = {} # filename -> Future of the running synthesis
+        self._lock = threading.Lock()
+        self._worker = None
+        os.makedirs(directory, exist_ok=True)
+
+    def filename_for(self, text: str) -> str:
+        digest = hashlib.sha256(f"{self.backend.name}\0{text}".encode("utf-8")).hexdigest()
+        return f"advice_{digest[:32]}.mp3"
+
+    def path_for(self, filename: str) -> str:
+        return os.path.join(self.directory, filename)
+
+    @staticmethod
+    def _touch(path: str) -> bool:
+        """
+        Marks an existing clip as used for LRU eviction.
+        Returns False if the clip does not exist.
+        """
+        try:
+            os.utime(path)
+            return True
+        except OSError:
+            return False
+
+    def register(self, text: str) -> str:
+        """
+        Returns the filename text will be stored under without synthesizing it.
+        The clip is produced later by schedule() or on first ensure().
+        """
+        filename = self.filename_for(text)
+        with self._lock:
+            self._pending[filename] = text
+            self._pending.move_to_end(filename)
+            while len(self._pending) > AUDIO_PENDING_MAX:
+                self._pending.popitem(last=False)
+        return filename
+
+    def schedule(self, text: str) -> str:
+        """
+        Registers text and synthesizes it on the background TTS worker.
+        """
+        filename = self.register(text)
+        if not self._touch(self.path_for(filename)):
+            with self._lock:
+                if self._worker is None:
+                    self._worker = ThreadPoolExecutor(max_workers=TTS_WORKERS, thread_name_prefix="tts")
+            self._worker.submit(self.ensure, filename)
+        return filename
+
+    def ensure(self, filename: str):
+        """
+        Returns the path of the clip, synthesizing it if its text is known.
+        Concurrent callers for the same clip share a single synthesis.
+        Returns None if the clip is unknown or synthesis failed.
+        """
+        path = self.path_for(filename)
+        if self._touch(path):
+            return path
+
+        with self._lock:
+            future = self._inflight.get(filename)
+            owner = future is None
+            if owner:
+                text = self._pending.get(filename)
+                if text is None:
+                    # Either unknown, or another thread finished it just now
+                    return path if os.path.exists(path) else None
+                future = Future()
+                self._inflight[filename] = future
+
+        if not owner:
+            try:
+                return future.result()
+            except Exception:
+                return None
+
+        try:
+            self._synthesize(text, path)
+            with self._lock:
+                self._pending.pop(filename, None)
+            future.set_result(path)
+        except Exception as e:
+            print(f"TTS Generation failed: {e}")
+            future.set_exception(e)
+            path = None
+        finally:
+            with self._lock:
+                self._inflight.pop(filename, None)
+
+        self.maybe_evict()
+        return path
+
+    def get_or_create(self, text: str) -> str:
+        """
+        Returns the filename holding audio for text, synthesizing it only if absent.
+        """
+        filename = self.register(text)
+        if self.ensure(filename) is None:
+            raise RuntimeError(f"Could not synthesize {filename}")
+        return filename
+
+    def _synthesize(self, text: str, path: str):
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with timed("tts"):
+                self.backend.synthesize(text, tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def maybe_evict(self):
+        now = time.monotonic()
+        if now - self._last_evict < self.evict_interval:
+            return
+        if not self._evict_lock.acquire(blocking=False):
+            return
+        try:
+            self._last_evict = now
+            self.evict()
+        finally:
+            self._evict_lock.release()
+
+    def evict(self) -> int:
+        """
+        Deletes clips older than max_age, then least recently used clips until
+        the directory fits in max_bytes. Returns the number of files removed.
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if not (name.startswith("advice_") and name.endswith(".mp3")):
+                continue
+            try:
+                st = os.stat(self.path_for(name))
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+
+        removed = 0
+        cutoff = time.time() - self.max_age
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for mtime, size, name in entries:
+            if mtime >= cutoff and total <= self.max_bytes:
+                break
+            try:
+                os.remove(self.path_for(name))
+                removed += 1
+                total -= size
+            except OSError:
+                pass
+        return removed
@@ -0,0 +1,146 @@
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from tools import rule_based_risk_analyzer
+from spam_detector import analyze_call_transcript
+
+DEFAULT_CHUNKSIZE = 500
+
+def _score_rules(record: dict) -> dict:
+    return rule_based_risk_analyzer(record["text"], record.get("category", "unknown"))
+
+def _score_transcript(record: dict) -> dict:
+    return analyze_call_transcript(record["text"])
+
+ANALYZERS = {
+    "rules": _score_rules,
+    "transcript": _score_transcript,
+}
+
+class BatchStats:
+    """
+    Running counters for a batch job, used to report throughput.
+    """
+    def __init__(self):
+        self.records = 0
+        self.chars = 0
+        self.started = time.perf_counter()
+        self.finished = None
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished or time.perf_counter()) - self.started
+
+    @property
+    def throughput(self) -> float:
+        return self.records / self.elapsed if self.elapsed > 0 else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "records": self.records,
+            "chars": self.chars,
+            "elapsed_sec": round(self.elapsed, 3),
+            "records_per_sec": round(self.throughput, 1),
+        }
+
+def read_jsonl(path: str):
+    """
+    Yields records from a JSONL file.
+    Each line is either {"text": ..., "category": ..., "id": ...} or a bare JSON string.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if isinstance(record, str):
+                record = {"text": record}
+            record.setdefault("id", line_no)
+            yield record
+
+def _score_chunk(analyzer: str, chunk: list) -> list:
+    """
+    Worker entry point: scores one chunk of records in-process.
+    """
+    score = ANALYZERS[analyzer]
+    results = []
+    for record in chunk:
+        result = score(record)
+        result["id"] = record.get("id")
+        results.append(result)
+    return results
+
+def _chunks(records, chunksize: int):
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= chunksize:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def batch_analyze(items, analyzer: str = "rules", category: str = "unknown", workers: int = None,
+                  chunksize: int = DEFAULT_CHUNKSIZE, stats: BatchStats = None):
+    """
+    Scores an iterable of texts or records and yields results in input order.
+    Work is split into chunks and spread over a process pool; only a few chunks
+    per worker are in flight at once, so memory stays flat for any input size.
+    Pass workers=1 to score in the calling process.
+    """
+    if analyzer not in ANALYZERS:
+        raise ValueError(f"Unknown analyzer '{analyzer}'. Choose from: {', '.join(ANALYZERS)}")
+    if stats is None:
+        stats = BatchStats()
+    workers = workers or os.cpu_count() or 1
+
+    def records():
+        for index, item in enumerate(items):
+            record = {"text": item, "id": index} if isinstance(item, str) else dict(item)
+            record.setdefault("category", category)
+            stats.chars += len(record["text"])
+            yield record
+
+    def emit(results):
+        stats.records += len(results)
+        return results
+
+    try:
+        if workers == 1:
+            for chunk in _chunks(records(), chunksize):
+                yield from emit(_score_chunk(analyzer, chunk))
+            return
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = deque()
+            for chunk in _chunks(records(), chunksize):
+                pending.append(pool.submit(_score_chunk, analyzer, chunk))
+                if len(pending) >= workers * 2:
+                    yield from emit(pending.popleft().result())
+            while pending:
+                yield from emit(pending.popleft().result())
+    finally:
+        stats.finished = time.perf_counter()
+
+def batch_analyze_file(path: str, **kwargs):
+    """
+    Streams results for every record in a JSONL file.
+    """
+    return batch_analyze(read_jsonl(path), **kwargs)
+
+def run_batch_file(path: str, analyzer: str = "rules", category: str = "unknown", workers: int = None,
+                   chunksize: int = DEFAULT_CHUNKSIZE, out=None):
+    """
+    Writes one JSON result per line to out and reports throughput on stderr.
+    """
+    out = out or sys.stdout
+    stats = BatchStats()
+    for result in batch_analyze_file(path, analyzer=analyzer, category=category, workers=workers,
+                                     chunksize=chunksize, stats=stats):
+        out.write(json.dumps(result) + "\n")
+    print(json.dumps({"batch_stats": stats.as_dict()}), file=sys.stderr)
+    return stats
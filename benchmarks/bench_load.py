@@ -0,0 +1,150 @@
+"""
+End-to-end load test of POST /analyze, run in-process against the FastAPI app
+with a local fake Gemini server and the silent TTS backend, so it needs no
+network or API key.
+
+    python benchmarks/bench_load.py --requests 500 --concurrency 32 --gemini-latency 0.4
+    python benchmarks/bench_load.py --concurrency 8 64 256 --repeat-ratio 0.3 --json load_results.json
+
+The Gemini client's rate limiter still applies (GEMINI_RATE_PER_SEC, or
+--gemini-rate); pass --gemini-rate 0 to measure the service without it.
+
+--repeat-ratio controls how many requests resend an earlier text, i.e. the
+expected response cache hit rate.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_micro import generate_messages
+from bench_qr import _latency_summary
+from fake_gemini import FakeGeminiServer
+
+def _make_app(gemini_url: str, tts_latency: float, audio_mode: str, work_dir: str, gemini_rate: float = None):
+    """
+    Imports the server with its settings pointed at the local stand-ins.
+    """
+    os.environ["GEMINI_API_KEY"] = os.environ.get("GEMINI_API_KEY") or "offline-benchmark"
+    os.environ["GEMINI_BASE_URL"] = gemini_url
+    os.environ["TTS_BACKEND"] = "silent"
+    os.environ["AUDIO_ADVICE_MODE"] = audio_mode
+    os.environ["AUDIO_STORE_DIR"] = os.path.join(work_dir, "audio")
+    os.environ.pop("RESPONSE_CACHE_DIR", None)
+    if gemini_rate is not None:
+        os.environ["GEMINI_RATE_PER_SEC"] = str(gemini_rate)
+
+    import server
+    from audio_store import SilentBackend
+    server.agent.audio_store.backend = SilentBackend(latency=tts_latency)
+    return server
+
+def _workload(count: int, repeat_ratio: float, seed: int = 23) -> list:
+    rng = random.Random(seed)
+    fresh = generate_messages(count, seed)
+    items = []
+    for text, category in fresh:
+        if items and rng.random() < repeat_ratio:
+            items.append(rng.choice(items))
+        else:
+            items.append({"text": text, "type": category}) # /analyze reads the category from "type"
+    return items
+
+async def _run_level(app, items: list, concurrency: int) -> dict:
+    import httpx
+
+    latencies = []
+    statuses = Counter()
+    tiers = Counter()
+    queue = asyncio.Queue()
+    for item in items:
+        queue.put_nowait(item)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        async def worker():
+            while True:
+                try:
+                    item = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                started = time.perf_counter()
+                try:
+                    response = await client.post("/analyze", data=item)
+                    statuses[response.status_code] += 1
+                    if response.status_code == 200:
+                        tiers[response.json().get("tier", "unknown")] += 1
+                except httpx.HTTPError as e:
+                    statuses[type(e).__name__] += 1
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "concurrency": concurrency,
+        "requests": len(items),
+        "elapsed_sec": round(elapsed, 3),
+        "throughput_rps": round(len(items) / elapsed, 2) if elapsed else None,
+        "latency": _latency_summary(latencies),
+        "status_codes": {str(k): v for k, v in statuses.items()},
+        "tiers": dict(tiers),
+    }
+
+def run(requests: int = 200, concurrency=(16,), gemini_latency: float = 0.3, tts_latency: float = 0.05,
+        audio_mode: str = "background", repeat_ratio: float = 0.0, gemini_rate: float = None) -> dict:
+    fake = FakeGeminiServer(latency=gemini_latency).start()
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            server = _make_app(fake.url, tts_latency, audio_mode, work_dir, gemini_rate)
+            results = {
+                "settings": {
+                    "requests": requests,
+                    "gemini_latency_sec": gemini_latency,
+                    "tts_latency_sec": tts_latency,
+                    "audio_mode": audio_mode,
+                    "repeat_ratio": repeat_ratio,
+                    "gemini_rate_per_sec": server.agent.gemini.bucket.rate,
+                },
+                "levels": [],
+            }
+            for level, workers in enumerate(concurrency):
+                # A fresh corpus per level keeps earlier levels from warming the cache
+                items = _workload(requests, repeat_ratio, seed=23 + level)
+                results["levels"].append(asyncio.run(_run_level(server.app, items, workers)))
+            results["gemini_requests"] = len(fake.requests)
+            results["gemini_client"] = dict(server.agent.gemini.stats)
+            return results
+    finally:
+        fake.stop()
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end load test of /analyze")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per concurrency level")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[16], help="Concurrent clients (one run per value)")
+    parser.add_argument("--gemini-latency", type=float, default=0.3, help="Simulated Gemini latency in seconds")
+    parser.add_argument("--tts-latency", type=float, default=0.05, help="Simulated TTS latency in seconds")
+    parser.add_argument("--audio-mode", type=str, default="background", choices=["eager", "background", "lazy"])
+    parser.add_argument("--gemini-rate", type=float, help="Override GEMINI_RATE_PER_SEC (0 disables the limiter)")
+    parser.add_argument("--repeat-ratio", type=float, default=0.0, help="Fraction of requests repeating an earlier text")
+    parser.add_argument("--json", type=str, help="Also write results to this file")
+    args = parser.parse_args()
+
+    results = run(args.requests, args.concurrency, args.gemini_latency, args.tts_latency,
+                  args.audio_mode, args.repeat_ratio, args.gemini_rate)
+    print(json.dumps(results, indent=2))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""
+Micro-benchmarks for the local (non-LLM) analysis functions over generated
+corpora: rule_based_risk_analyzer, analyze_call_transcript, parse_upi_string
+and decode_qr_code, plus decode_qr_code batches through the QR process pool
+(qr_pool.py). Runs fully offline.
+
+    python benchmarks/bench_micro.py --size 5000 --qr-images 50
+    python benchmarks/bench_micro.py --only rules transcript --json micro_results.json
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_qr import generate_corpus, load_corpus, _latency_summary
+
+MESSAGE_TEMPLATES = [
+    "Enter your UPI PIN to receive Rs. {amount} cashback immediately.",
+    "Dear customer, your KYC will expire today. Update now at bit.ly/{token}",
+    "Congratulations! You are the lottery winner of Rs. {amount}. Share your Aadhaar to claim.",
+    "Instant loan approved at {rate}% per month. Pay processing fee of Rs. {amount} in advance.",
+    "Hi, your order #{token} has been shipped and will arrive tomorrow.",
+    "Reminder: your electricity bill of Rs. {amount} is due on the 5th.",
+    "Personal loan at {rate}% p.a., no hidden charges, tenure up to 60 months.",
+    "Please send a copy of your PAN card and bank statement for the rental agreement.",
+]
+
+TRANSCRIPT_TEMPLATES = [
+    "Hello sir, I am calling from your bank. Please share the OTP you just received to stop the block on your card.",
+    "This is customs, a parcel in your name has drugs. Transfer Rs. {amount} now or the police will arrest you.",
+    "Hi, this is {name} from the dentist's office confirming your appointment on Tuesday at 4 pm.",
+    "Sir your KYC is pending, download AnyDesk so I can help you update it right now.",
+    "Hey, it's {name}. Are we still on for dinner tonight? Call me back when you can.",
+]
+
+NAMES = ["Asha", "Ravi", "Priya", "Vikram", "Neha", "Arjun"]
+PSPS = ["upi", "okicici", "okaxis", "paytm", "ybl"]
+
+def generate_messages(count: int, seed: int = 11) -> list:
+    """
+    Returns (text, category) pairs mixing scam and benign messages; every text is unique.
+    """
+    rng = random.Random(seed)
+    categories = ["upi", "loan", "document", "unknown"]
+    items = []
+    for i in range(count):
+        text = rng.choice(MESSAGE_TEMPLATES).format(
+            amount=rng.randint(100, 50000), rate=rng.randint(1, 60), token=f"{rng.getrandbits(32):08x}")
+        items.append((f"{text} Ref {i}", rng.choice(categories)))
+    return items
+
+def generate_transcripts(count: int, seed: int = 13) -> list:
+    rng = random.Random(seed)
+    return [
+        rng.choice(TRANSCRIPT_TEMPLATES).format(amount=rng.randint(1000, 200000), name=rng.choice(NAMES))
+        for _ in range(count)
+    ]
+
+def generate_upi_strings(count: int, seed: int = 17) -> list:
+    rng = random.Random(seed)
+    items = []
+    for i in range(count):
+        vpa = f"{rng.choice(['shop', 'merchant', 'user'])}{rng.randint(1, 99999)}@{rng.choice(PSPS)}"
+        items.append(f"upi://pay?pa={vpa}&pn=Payee%20{i}&am={rng.randint(1, 5000)}.00&cu=INR&tn=Order%20{i}")
+    return items
+
+def _time_each(fn, items, repeat: int = 1) -> dict:
+    """
+    Calls fn(item) for every item and returns latency and throughput figures.
+    """
+    samples = []
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for item in items:
+            t0 = time.perf_counter()
+            fn(item)
+            samples.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - started
+    return {
+        "calls": len(samples),
+        "ops_per_sec": round(len(samples) / elapsed, 1) if elapsed else None,
+        "latency": _latency_summary(samples),
+    }
+
+def bench_rules(size: int, repeat: int) -> dict:
+    from tools import rule_based_risk_analyzer
+    items = generate_messages(size)
+    return _time_each(lambda item: rule_based_risk_analyzer(item[0], item[1]), items, repeat)
+
+def bench_transcript(size: int, repeat: int) -> dict:
+    from spam_detector import analyze_call_transcript
+    return _time_each(analyze_call_transcript, generate_transcripts(size), repeat)
+
+def bench_parse_upi(size: int, repeat: int) -> dict:
+    from upi_guardian import parse_upi_string
+    return _time_each(parse_upi_string, generate_upi_strings(size), repeat)
+
+def bench_decode_qr(qr_images: int, qr_corpus: str = None) -> dict:
+    from upi_guardian import decode_qr_code
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus = qr_corpus
+        if not corpus:
+            corpus = tmp
+            generate_corpus(corpus, qr_images)
+        items = load_corpus(corpus, qr_images)
+        # Bytes in memory, so disk reads are not part of the measurement
+        images = []
+        for path, expected in items:
+            with open(path, "rb") as f:
+                images.append((f.read(), expected))
+        decoded = []
+        result = _time_each(lambda item: decoded.append(decode_qr_code(item[0])), images)
+    result["decoded"] = sum(out is not None for out in decoded)
+    result["accuracy"] = round(
+        sum(out == expected for out, (_, expected) in zip(decoded, images) if expected is not None) / len(images), 4
+    ) if images else None
+    return result
+
+def bench_decode_qr_pool(qr_images: int, qr_corpus: str = None, workers: int = None) -> dict:
+    """
+    Batch throughput of the QR process pool on the same corpus as decode_qr.
+    """
+    from qr_pool import QRDecodePool
+    workers = workers or os.cpu_count() or 1
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus = qr_corpus
+        if not corpus:
+            corpus = tmp
+            generate_corpus(corpus, qr_images)
+        images = []
+        for path, _ in load_corpus(corpus, qr_images):
+            with open(path, "rb") as f:
+                images.append(f.read())
+    started = time.perf_counter()
+    pool = QRDecodePool(workers=workers).start()
+    startup = time.perf_counter() - started
+    try:
+        started = time.perf_counter()
+        decoded = pool.decode_many(images)
+        elapsed = time.perf_counter() - started
+    finally:
+        pool.shutdown()
+    return {
+        "workers": workers,
+        "images": len(images),
+        "startup_sec": round(startup, 3),
+        "images_per_sec": round(len(images) / elapsed, 1) if elapsed else None,
+        "decoded": sum(out is not None for out in decoded),
+    }
+
+BENCHMARKS = ["rules", "transcript", "parse_upi", "decode_qr", "decode_qr_pool"]
+
+def run(size: int = 5000, repeat: int = 3, qr_images: int = 30, qr_corpus: str = None, only=None,
+        qr_pool_workers: int = None) -> dict:
+    selected = only or BENCHMARKS
+    results = {"size": size, "repeat": repeat, "benchmarks": {}}
+    if "rules" in selected:
+        results["benchmarks"]["rules"] = bench_rules(size, repeat)
+    if "transcript" in selected:
+        results["benchmarks"]["transcript"] = bench_transcript(size, repeat)
+    if "parse_upi" in selected:
+        results["benchmarks"]["parse_upi"] = bench_parse_upi(size, repeat)
+    if "decode_qr" in selected:
+        results["benchmarks"]["decode_qr"] = bench_decode_qr(qr_images, qr_corpus)
+    if "decode_qr_pool" in selected:
+        results["benchmarks"]["decode_qr_pool"] = bench_decode_qr_pool(qr_images, qr_corpus, qr_pool_workers)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline micro-benchmarks for the local analyzers")
+    parser.add_argument("--size", type=int, default=5000, help="Generated items per text benchmark")
+    parser.add_argument("--repeat", type=int, default=3, help="Passes over each text corpus")
+    parser.add_argument("--qr-images", type=int, default=30, help="QR images to generate (or use from --qr-corpus)")
+    parser.add_argument("--qr-corpus", type=str, help="Existing QR corpus directory (see bench_qr.py)")
+    parser.add_argument("--qr-pool-workers", type=int, help="QR pool worker processes (default: CPU count)")
+    parser.add_argument("--only", nargs="+", choices=BENCHMARKS, help="Run only these benchmarks")
+    parser.add_argument("--json", type=str, help="Also write results to this file")
+    args = parser.parse_args()
+
+    results = run(args.size, args.repeat, args.qr_images, args.qr_corpus, args.only, args.qr_pool_workers)
+    print(json.dumps(results, indent=2))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
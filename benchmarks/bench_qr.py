@@ -0,0 +1,151 @@
+"""
+Compares the staged QR decoder against the QReader-only path on a local
+corpus of QR images.
+
+Ground truth for an image is read from a sidecar "<image>.txt" file; images
+without one are scored against the QReader-only result.
+
+    python benchmarks/bench_qr.py --generate 200 --corpus bench_data/qr
+    python benchmarks/bench_qr.py --corpus bench_data/qr --json qr_results.json
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cv2
+import numpy as np
+import upi_guardian
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp")
+
+def generate_corpus(out_dir: str, count: int, seed: int = 7):
+    """
+    Writes synthetic UPI QR screenshots with their expected payload as sidecars.
+    Mixes clean codes with rotated, blurred, noisy and JPEG-compressed ones.
+    """
+    rng = random.Random(seed)
+    encoder = cv2.QRCodeEncoder.create()
+    os.makedirs(out_dir, exist_ok=True)
+    for i in range(count):
+        vpa = f"{rng.choice(['shop', 'merchant', 'user', 'scammer'])}{rng.randint(1, 99999)}@{rng.choice(['upi', 'okicici', 'paytm', 'ybl'])}"
+        payload = f"upi://pay?pa={vpa}&pn=Payee%20{i}&am={rng.randint(1, 5000)}&cu=INR"
+        code = encoder.encode(payload)
+        module = rng.randint(6, 20)
+        code = cv2.resize(code, None, fx=module, fy=module, interpolation=cv2.INTER_NEAREST)
+
+        # Place the code on a phone-sized screenshot canvas
+        height, width = rng.choice([(2400, 1080), (1920, 1080), (1280, 720)])
+        canvas = np.full((height, width), 255, dtype=np.uint8)
+        side = min(code.shape[0], width - 40, height - 40)
+        code = cv2.resize(code, (side, side), interpolation=cv2.INTER_NEAREST)
+        top = rng.randint(20, height - side - 20)
+        left = rng.randint(20, width - side - 20)
+        canvas[top:top + side, left:left + side] = code
+
+        variant = rng.choice(["clean", "clean", "rotate", "blur", "noise"])
+        if variant == "rotate":
+            matrix = cv2.getRotationMatrix2D((width / 2, height / 2), rng.uniform(-25, 25), 1.0)
+            canvas = cv2.warpAffine(canvas, matrix, (width, height), borderValue=255)
+        elif variant == "blur":
+            canvas = cv2.GaussianBlur(canvas, (0, 0), rng.uniform(1.0, 3.0))
+        elif variant == "noise":
+            noise = np.random.default_rng(seed + i).normal(0, 25, canvas.shape)
+            canvas = np.clip(canvas + noise, 0, 255).astype(np.uint8)
+
+        image = cv2.cvtColor(canvas, cv2.COLOR_GRAY2BGR)
+        path = os.path.join(out_dir, f"qr_{i:05d}_{variant}.jpg")
+        cv2.imwrite(path, image, [cv2.IMWRITE_JPEG_QUALITY, rng.randint(60, 95)])
+        with open(path + ".txt", "w", encoding="utf-8") as f:
+            f.write(payload)
+
+def load_corpus(corpus_dir: str, limit: int = None) -> list:
+    items = []
+    for name in sorted(os.listdir(corpus_dir)):
+        if not name.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        path = os.path.join(corpus_dir, name)
+        expected = None
+        if os.path.exists(path + ".txt"):
+            with open(path + ".txt", "r", encoding="utf-8") as f:
+                expected = f.read().strip()
+        items.append((path, expected))
+        if limit and len(items) >= limit:
+            break
+    return items
+
+def _latency_summary(samples: list) -> dict:
+    ordered = sorted(samples)
+    return {
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 3),
+        "p50_ms": round(ordered[len(ordered) // 2] * 1000, 3),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+def run(corpus_dir: str, limit: int = None) -> dict:
+    """
+    Decodes every corpus image with both paths and returns a results dict.
+    """
+    items = load_corpus(corpus_dir, limit)
+    if not items:
+        raise SystemExit(f"No images found in {corpus_dir}")
+
+    paths = {"staged": {"fast_path": True}, "qreader_only": {"fast_path": False}}
+    latencies = {name: [] for name in paths}
+    outputs = {name: [] for name in paths}
+    stats_before = upi_guardian.qr_stage_stats()["counts"]
+
+    for path, _ in items:
+        for name, options in paths.items():
+            started = time.perf_counter()
+            outputs[name].append(upi_guardian.decode_qr_code(path, **options))
+            latencies[name].append(time.perf_counter() - started)
+
+    stats_after = upi_guardian.qr_stage_stats()["counts"]
+    results = {"images": len(items), "paths": {}}
+    for name in paths:
+        correct = 0
+        for (path, expected), got, reference in zip(items, outputs[name], outputs["qreader_only"]):
+            truth = expected if expected is not None else reference
+            correct += int(got is not None and got == truth)
+        results["paths"][name] = {
+            "latency": _latency_summary(latencies[name]),
+            "decoded": sum(out is not None for out in outputs[name]),
+            "accuracy": round(correct / len(items), 4),
+        }
+
+    # The staged path also contributed the QReader-only calls; subtract those
+    staged_counts = {stage: stats_after[stage] - stats_before[stage] for stage in stats_after}
+    qreader_only_hits = sum(out is not None for out in outputs["qreader_only"])
+    staged_counts["qreader"] -= qreader_only_hits
+    staged_counts["miss"] -= len(items) - qreader_only_hits
+    results["paths"]["staged"]["stage_hit_rates"] = {
+        stage: round(count / len(items), 4) for stage, count in staged_counts.items()
+    }
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Staged vs QReader-only QR decode benchmark")
+    parser.add_argument("--corpus", type=str, default="bench_data/qr", help="Directory of QR images")
+    parser.add_argument("--generate", type=int, default=0, help="Generate this many synthetic images first")
+    parser.add_argument("--limit", type=int, default=None, help="Only use the first N images")
+    parser.add_argument("--json", type=str, help="Also write results to this file")
+    args = parser.parse_args()
+
+    if args.generate:
+        generate_corpus(args.corpus, args.generate)
+
+    results = run(args.corpus, args.limit)
+    print(json.dumps(results, indent=2))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+Startup-time benchmark for the CLI and the API server.
+
+Each scenario runs in a fresh interpreter so nothing is already imported:
+
+    cli_check_number  python main.py --check-number ...
+    import_agent      python -c "import agent"
+    import_server     python -c "import server"
+    server_ready      uvicorn server:app until GET / answers
+    server_preloaded  the same with PRELOAD_MODELS=1
+
+    python benchmarks/bench_startup.py --runs 5 --json startup_results.json
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COMMANDS = {
+    "cli_check_number": [sys.executable, "main.py", "--check-number", "9876543210"],
+    "import_agent": [sys.executable, "-c", "import agent"],
+    "import_server": [sys.executable, "-c", "import server"],
+}
+
+def _env(**overrides) -> dict:
+    env = dict(os.environ)
+    env.setdefault("GEMINI_API_KEY", "startup-benchmark") # Never called; the agent only needs one set
+    env.update(overrides)
+    return env
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def time_command(args: list) -> float:
+    started = time.perf_counter()
+    subprocess.run(args, cwd=ROOT, env=_env(), check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - started
+
+def time_server_ready(preload: bool = False, timeout: float = 120) -> float:
+    """
+    Seconds from launching uvicorn until GET / returns 200.
+    """
+    port = _free_port()
+    env = _env(PRELOAD_MODELS="1" if preload else "0")
+    started = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "-m", "uvicorn", "server:app", "--port", str(port), "--log-level", "warning"],
+                            cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - started < timeout:
+            if proc.poll() is not None:
+                raise RuntimeError(f"uvicorn exited with code {proc.returncode}")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - started
+            except OSError:
+                time.sleep(0.02)
+        raise TimeoutError(f"Server did not answer within {timeout}s")
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+def top_imports(module: str = "server", limit: int = 10) -> list:
+    """
+    The slowest top-level imports of a module, from python -X importtime.
+    """
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          cwd=ROOT, env=_env(), capture_output=True, text=True)
+    rows = []
+    pending = []
+    for line in proc.stderr.splitlines():
+        # "import time: self [us] | cumulative | imported package", children listed before their parent
+        parts = line.split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2].rstrip()
+        depth = len(name) - len(name.lstrip())
+        if depth == 3:
+            pending.append({"module": name.strip(), "cumulative_ms": round(int(parts[1]) / 1000, 1)})
+        elif depth == 1:
+            if name.strip() == module:
+                rows = pending
+            pending = []
+    return sorted(rows, key=lambda row: row["cumulative_ms"], reverse=True)[:limit]
+
+def _summary(samples: list) -> dict:
+    return {
+        "runs": len(samples),
+        "min_ms": round(min(samples) * 1000, 1),
+        "median_ms": round(statistics.median(samples) * 1000, 1),
+        "max_ms": round(max(samples) * 1000, 1),
+    }
+
+SCENARIOS = list(COMMANDS) + ["server_ready", "server_preloaded"]
+
+def run(runs: int = 3, only=None) -> dict:
+    results = {"python": sys.version.split()[0], "scenarios": {}}
+    for name in only or SCENARIOS:
+        if name in COMMANDS:
+            samples = [time_command(COMMANDS[name]) for _ in range(runs)]
+        else:
+            samples = [time_server_ready(preload=name == "server_preloaded") for _ in range(runs)]
+        results["scenarios"][name] = _summary(samples)
+    results["top_imports"] = top_imports("server")
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="CLI and server startup-time benchmark")
+    parser.add_argument("--runs", type=int, default=3, help="Runs per scenario")
+    parser.add_argument("--only", nargs="+", choices=SCENARIOS, help="Run only these scenarios")
+    parser.add_argument("--json", type=str, help="Also write results to this file")
+    args = parser.parse_args()
+
+    results = run(args.runs, args.only)
+    print(json.dumps(results, indent=2))
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+def normalize_text(text: str) -> str:
+    """
+    Canonical form used for cache keys: lowercase with collapsed whitespace.
+    """
+    return " ".join(text.lower().split()) if text else ""
+
+def hash_file(path: str, chunk_size: int = 1 << 20) -> str:
+    """
+    Streams a file through SHA-256 without loading it whole.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def hash_source(source) -> str:
+    """
+    SHA-256 of in-memory bytes, or of the file at a path.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return hashlib.sha256(source).hexdigest()
+    return hash_file(source)
+
+def make_cache_key(text: str = None, category: str = "unknown", image_hash: str = None, audio_hash: str = None) -> str:
+    """
+    Builds a content-addressed key from the normalized text, the category hint
+    and the digests of any image/audio payload.
+    """
+    digest = hashlib.sha256()
+    for part in (normalize_text(text), category or "", image_hash or "", audio_hash or ""):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+class TTLCache:
+    """
+    Thread-safe in-memory LRU cache whose entries expire after ttl seconds.
+    """
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl: float = None):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+class ResponseCache:
+    """
+    Two-tier cache for analysis results: an in-memory TTL LRU in front of an
+    optional on-disk JSON store that survives restarts. The disk tier is
+    swept of expired files, then of the oldest ones beyond disk_max_entries,
+    at startup and at most every sweep_interval seconds on writes.
+    max_entries <= 0 turns off both tiers.
+    """
+    def __init__(self, max_entries: int = 1024, ttl: float = 3600, disk_dir: str = None,
+                 disk_max_entries: int = 100000, sweep_interval: float = 300):
+        self.memory = TTLCache(max_entries=max_entries, ttl=ttl)
+        self.ttl = ttl
+        self.disk_dir = disk_dir if max_entries > 0 else None
+        self.disk_max_entries = disk_max_entries
+        self.sweep_interval = sweep_interval
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+        self._sweep_lock = threading.Lock()
+        self._last_sweep = 0.0
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self.maybe_sweep()
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def _disk_get(self, key: str):
+        """
+        Returns (value, age in seconds) of a live disk entry, or (None, None).
+        """
+        path = self._disk_path(key)
+        try:
+            age = time.time() - os.path.getmtime(path)
+            if age > self.ttl:
+                os.remove(path)
+                return None, None
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f), age
+        except (OSError, ValueError):
+            return None, None
+
+    def _disk_set(self, key: str, value: dict):
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(value, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Response cache write failed: {e}")
+
+    def maybe_sweep(self):
+        now = time.monotonic()
+        if self._last_sweep and now - self._last_sweep < self.sweep_interval:
+            return
+        if not self._sweep_lock.acquire(blocking=False):
+            return
+        try:
+            self._last_sweep = now
+            self.sweep_disk()
+        finally:
+            self._sweep_lock.release()
+
+    def sweep_disk(self) -> int:
+        """
+        Deletes expired disk entries, then the oldest ones until at most
+        disk_max_entries remain. Returns the number of files removed.
+        """
+        entries = []
+        for root, _, names in os.walk(self.disk_dir):
+            for name in names:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    entries.append((os.path.getmtime(path), path))
+                except OSError:
+                    continue
+
+        removed = 0
+        cutoff = time.time() - self.ttl
+        entries.sort()
+        excess = len(entries) - self.disk_max_entries
+        for index, (mtime, path) in enumerate(entries):
+            if mtime >= cutoff and index >= excess:
+                break
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+        return removed
+
+    def get(self, key: str):
+        """
+        Returns a copy of the cached result, or None on a miss.
+        """
+        value = self.memory.get(key)
+        from_disk = False
+        if value is None and self.disk_dir:
+            value, age = self._disk_get(key)
+            if value is not None:
+                from_disk = True
+                # Only the rest of its TTL: it expires when the disk copy does
+                self.memory.set(key, value, ttl=self.ttl - age)
+        with self._stats_lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if from_disk:
+                self.disk_hits += 1
+        return json.loads(json.dumps(value))
+
+    def set(self, key: str, value: dict):
+        self.memory.set(key, value)
+        if self.disk_dir:
+            self._disk_set(key, value)
+            self.maybe_sweep()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "entries": len(self.memory),
+            "max_entries": self.memory.max_entries,
+            "evictions": self.memory.evictions,
+            "ttl_sec": self.ttl,
+            "disk_dir": self.disk_dir,
+        }
@@ -0,0 +1,158 @@
+"""
+Explicit Gemini context caching for the static system prompt.
+
+Every analysis sends the same system instruction. With a context cache it
+is uploaded once per model (caches.create) and requests refer to it by
+name, so its tokens are not re-sent and are billed at the cached rate. The
+cache is created in the background on first use and its TTL is extended
+once less than CONTEXT_CACHE_REFRESH_SEC is left.
+
+Off by default: the current instruction is below the minimum cacheable
+size (CONTEXT_CACHE_MIN_TOKENS, 1024 on current models), and an instruction
+estimated below it is never uploaded. Until the cache exists, and whenever
+creating it fails (the model or key has no caching), the instruction is
+sent inline as before; a failed model is tried again after
+CONTEXT_CACHE_RETRY_SEC. Creates and refreshes run on a thread of their
+own, never on the request executors. Savings show up as the cached prompt
+tokens in fsn_gemini_cached_prompt_tokens.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from gemini_client import GEMINI_DEADLINE_SEC, error_status
+from metrics import counter, GEMINI_TOKENS, GEMINI_CACHED_TOKENS
+
+CONTEXT_CACHE_ENABLED = os.getenv("CONTEXT_CACHE_ENABLED", "0") == "1"
+# Smallest instruction worth caching; the API rejects smaller ones
+CONTEXT_CACHE_MIN_TOKENS = int(os.getenv("CONTEXT_CACHE_MIN_TOKENS", "1024"))
+CONTEXT_CACHE_TTL = int(os.getenv("CONTEXT_CACHE_TTL", "3600"))
+CONTEXT_CACHE_REFRESH_SEC = int(os.getenv("CONTEXT_CACHE_REFRESH_SEC", "300")) # Extend the TTL with this much left
+CONTEXT_CACHE_RETRY_SEC = float(os.getenv("CONTEXT_CACHE_RETRY_SEC", "600")) # After a failed create
+
+CONTEXT_CACHE_EVENTS = counter("fsn_context_cache_events_total", "Gemini context cache creates, refreshes and failures", ["event"])
+
+class ContextCache:
+    """
+    One cached copy of the system instruction per model.
+    """
+    def __init__(self, system_instruction: str, enabled: bool = CONTEXT_CACHE_ENABLED,
+                 ttl: int = CONTEXT_CACHE_TTL, refresh_sec: int = CONTEXT_CACHE_REFRESH_SEC,
+                 retry_sec: float = CONTEXT_CACHE_RETRY_SEC, min_tokens: int = CONTEXT_CACHE_MIN_TOKENS):
+        self.system_instruction = system_instruction
+        # About four characters per token; close enough to skip hopeless creates
+        self.estimated_tokens = len(system_instruction) // 4
+        self.enabled = enabled and self.estimated_tokens >= min_tokens
+        if enabled and not self.enabled:
+            print(f"Context cache disabled: the system instruction (~{self.estimated_tokens} tokens) "
+                  f"is below CONTEXT_CACHE_MIN_TOKENS={min_tokens}")
+        self.ttl = ttl
+        self.refresh_sec = refresh_sec
+        self.retry_sec = retry_sec
+        self._entries = {} # model -> {"name", "expires", "tokens", "busy", "retry_at"}
+        self._lock = threading.Lock()
+        self._worker = None
+
+    def _usable_name(self, entry: dict, now: float):
+        # A request may run for up to its deadline; do not start one on a cache about to expire
+        if entry["name"] and entry["expires"] - now > GEMINI_DEADLINE_SEC:
+            return entry["name"]
+        return None
+
+    def get(self, client, model: str):
+        """
+        Returns the cache name to use for model, or None to send the
+        instruction inline. Starts a background create or refresh when due.
+        """
+        if not self.enabled:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.setdefault(model, {"name": None, "expires": 0.0, "tokens": None, "busy": False, "retry_at": 0.0})
+            name = self._usable_name(entry, now)
+            due = not entry["busy"] and now >= entry["retry_at"] and (name is None or entry["expires"] - now < self.refresh_sec)
+            if due:
+                entry["busy"] = True
+                if self._worker is None:
+                    self._worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="context-cache")
+        if due:
+            self._worker.submit(self.refresh, client, model)
+        return name
+
+    def refresh(self, client, model: str) -> bool:
+        """
+        Creates the cache for model, or extends its TTL if it still exists.
+        Blocking; get calls it in the background.
+        """
+        from google.genai import types
+        with self._lock:
+            entry = self._entries.setdefault(model, {"name": None, "expires": 0.0, "tokens": None, "busy": True, "retry_at": 0.0})
+            name = entry["name"] if time.monotonic() < entry["expires"] else None
+        try:
+            if name:
+                cached = client.caches.update(name=name, config=types.UpdateCachedContentConfig(ttl=f"{self.ttl}s"))
+                event = "refreshed"
+            else:
+                cached = client.caches.create(model=model, config=types.CreateCachedContentConfig(
+                    system_instruction=self.system_instruction, ttl=f"{self.ttl}s", display_name="fsn-system-instruction"))
+                event = "created"
+        except Exception as e:
+            print(f"Context cache for {model} unavailable, sending the instruction inline: {e}")
+            CONTEXT_CACHE_EVENTS.inc(event="failed")
+            with self._lock:
+                entry["busy"] = False
+                entry["retry_at"] = time.monotonic() + self.retry_sec
+            return False
+
+        CONTEXT_CACHE_EVENTS.inc(event=event)
+        usage = getattr(cached, "usage_metadata", None)
+        with self._lock:
+            entry["name"] = cached.name
+            # Counted from after the response, so never later than the server's expiry
+            entry["expires"] = time.monotonic() + self.ttl
+            entry["tokens"] = getattr(usage, "total_token_count", None) or entry["tokens"]
+            entry["busy"] = False
+        return True
+
+    def invalidate(self, model: str = None):
+        with self._lock:
+            for key, entry in self._entries.items():
+                if model is None or key == model:
+                    entry["name"] = None
+                    entry["expires"] = 0.0
+
+    def handle_error(self, e: Exception) -> bool:
+        """
+        Drops the caches if a request failed because its cache is gone.
+        Returns True when the request should be retried without one.
+        """
+        with self._lock:
+            if not any(entry["name"] for entry in self._entries.values()):
+                return False
+        if error_status(e) == 404 or "cachedcontent" in str(e).lower().replace(" ", ""):
+            CONTEXT_CACHE_EVENTS.inc(event="lost")
+            self.invalidate()
+            return True
+        return False
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        requests = GEMINI_CACHED_TOKENS.count()
+        cached_tokens = GEMINI_TOKENS.value(kind="cached")
+        with self._lock:
+            models = {
+                model: {
+                    "name": self._usable_name(entry, now),
+                    "expires_in": round(max(0.0, entry["expires"] - now)),
+                    "tokens": entry["tokens"],
+                }
+                for model, entry in self._entries.items()
+            }
+        return {
+            "enabled": self.enabled,
+            "estimated_instruction_tokens": self.estimated_tokens,
+            "models": models,
+            "requests": requests,
+            "cached_prompt_tokens": cached_tokens,
+            "cached_prompt_tokens_per_request": round(cached_tokens / requests, 1) if requests else 0.0,
+        }
@@ -0,0 +1,228 @@
+"""
+Local stand-in for the Gemini REST API, for tests and offline benchmarks.
+
+    server = FakeGeminiServer(latency=0.2, statuses=[429, 200]).start()
+    client = genai.Client(api_key="fake", http_options=types.HttpOptions(base_url=server.url))
+
+Point the agent at it with GEMINI_BASE_URL=<server.url>, or run it standalone:
+
+    python fake_gemini.py --port 8089 --latency 0.3
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_RESULT = {
+    "risk_level": "SUSPICIOUS",
+    "score": 60,
+    "category": "unknown",
+    "reasons": ["Unverified sender asking for urgent action"],
+    "advice": "Do not click links or share OTPs. Contact your bank using the number on your card.",
+    "transcript": None,
+    "extracted_details": {
+        "interest_rate": None,
+        "fees": None,
+        "tenure": None,
+        "exclusions": None,
+        "other_key_points": [],
+    },
+}
+
+ERROR_STATUS = {
+    400: "INVALID_ARGUMENT",
+    404: "NOT_FOUND",
+    429: "RESOURCE_EXHAUSTED",
+    500: "INTERNAL",
+    503: "UNAVAILABLE",
+}
+
+class _HTTPServer(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # Clients that time out or cancel hang up mid-response; that is expected here
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+class FakeGeminiServer:
+    """
+    Threaded HTTP server answering generateContent-style requests.
+
+    latency  - seconds to wait before answering each request
+    statuses - HTTP statuses to return for the first requests, in order;
+               once exhausted every request succeeds
+    model_latency  - per-model latency overriding latency, {model: seconds}
+    model_statuses - per-model statuses used before statuses, {model: [...]}
+    result   - JSON object returned as the model's text
+    stream_chunks   - pieces the text is split into for streamGenerateContent
+    stream_interval - seconds between streamed pieces
+    cache_status    - HTTP status for cachedContents create/update requests;
+                      cached system instructions count len(text) // 4 tokens
+    """
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0, statuses=None,
+                 result: dict = None, prompt_tokens: int = 850, stream_chunks: int = 4, stream_interval: float = 0.0,
+                 model_latency: dict = None, model_statuses: dict = None, cache_status: int = 200):
+        self.latency = latency
+        self.cache_status = cache_status
+        self.caches = {} # name -> cached token count
+        self.model_latency = dict(model_latency or {})
+        self.model_statuses = {model: list(statuses) for model, statuses in (model_statuses or {}).items()}
+        self.stream_chunks = stream_chunks
+        self.stream_interval = stream_interval
+        self.statuses = list(statuses or [])
+        self.result = result or DEFAULT_RESULT
+        self.prompt_tokens = prompt_tokens
+        self.requests = []
+        self._lock = threading.Lock()
+        self._httpd = _HTTPServer((host, port), self._handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def _next_status(self, model: str = None) -> int:
+        with self._lock:
+            if self.model_statuses.get(model):
+                return self.model_statuses[model].pop(0)
+            return self.statuses.pop(0) if self.statuses else 200
+
+    def response_body(self, model: str, text: str = None, final: bool = True, cached_tokens: int = 0) -> dict:
+        full_text = json.dumps(self.result)
+        text = full_text if text is None else text
+        candidate = {"content": {"role": "model", "parts": [{"text": text}]}}
+        body = {"candidates": [candidate], "modelVersion": model}
+        if final:
+            candidate["finishReason"] = "STOP"
+            body["usageMetadata"] = {
+                "promptTokenCount": self.prompt_tokens + cached_tokens,
+                "candidatesTokenCount": len(full_text) // 4,
+                "totalTokenCount": self.prompt_tokens + cached_tokens + len(full_text) // 4,
+            }
+            if cached_tokens:
+                body["usageMetadata"]["cachedContentTokenCount"] = cached_tokens
+        return body
+
+    def stream_bodies(self, model: str, cached_tokens: int = 0) -> list:
+        text = json.dumps(self.result)
+        size = -(-len(text) // max(1, self.stream_chunks))
+        pieces = [text[i:i + size] for i in range(0, len(text), size)]
+        return [self.response_body(model, piece, final=i == len(pieces) - 1, cached_tokens=cached_tokens)
+                for i, piece in enumerate(pieces)]
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, status: int, body: dict):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_stream(self, bodies: list):
+                # Server-sent events; the body ends when the connection closes
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.end_headers()
+                for i, body in enumerate(bodies):
+                    if i and server.stream_interval:
+                        time.sleep(server.stream_interval)
+                    self.wfile.write(b"data: " + json.dumps(body).encode("utf-8") + b"\r\n\r\n")
+                    self.wfile.flush()
+
+            def _send_error(self, status: int):
+                self._send_json(status, {"error": {
+                    "code": status,
+                    "message": f"Fake Gemini error {status}",
+                    "status": ERROR_STATUS.get(status, "UNKNOWN"),
+                }})
+
+            def _read_payload(self) -> dict:
+                length = int(self.headers.get("Content-Length") or 0)
+                return json.loads(self.rfile.read(length) or b"{}")
+
+            def _cache_request(self, payload: dict, name: str = None):
+                with server._lock:
+                    server.requests.append({"path": self.path, "model": None, "body": payload, "at": time.monotonic()})
+                if server.cache_status != 200:
+                    self._send_error(server.cache_status)
+                    return
+                with server._lock:
+                    if name is None:
+                        parts = (payload.get("systemInstruction") or {}).get("parts", [])
+                        name = f"cachedContents/fake-{len(server.caches) + 1}"
+                        server.caches[name] = sum(len(part.get("text", "")) for part in parts) // 4
+                    elif name not in server.caches:
+                        self._send_error(404)
+                        return
+                    tokens = server.caches[name]
+                self._send_json(200, {"name": name, "model": payload.get("model"),
+                                      "usageMetadata": {"totalTokenCount": tokens}})
+
+            def do_PATCH(self):
+                self._cache_request(self._read_payload(), self.path.split("?")[0].split("/v1beta/")[-1])
+
+            def do_POST(self):
+                payload = self._read_payload()
+                if self.path.split("?")[0].endswith("/cachedContents"):
+                    self._cache_request(payload)
+                    return
+                model = self.path.split("/models/")[-1].split(":")[0]
+                with server._lock:
+                    server.requests.append({"path": self.path, "model": model, "body": payload, "at": time.monotonic()})
+
+                latency = server.model_latency.get(model, server.latency)
+                if latency:
+                    time.sleep(latency)
+
+                status = server._next_status(model)
+                cached_tokens = 0
+                if payload.get("cachedContent"):
+                    cached_tokens = server.caches.get(payload["cachedContent"])
+                    if cached_tokens is None:
+                        status = 404 # Expired or deleted cache
+                if status != 200:
+                    self._send_error(status)
+                    return
+                if ":streamGenerateContent" in self.path:
+                    self._send_stream(server.stream_bodies(model, cached_tokens))
+                    return
+                self._send_json(200, server.response_body(model, cached_tokens=cached_tokens))
+
+        return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description="Local fake Gemini API server")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds of simulated model latency")
+    args = parser.parse_args()
+
+    server = FakeGeminiServer(host=args.host, port=args.port, latency=args.latency)
+    print(f"Fake Gemini listening on {server.url}")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,4 @@
 import { useState } from 'react';
-import axios from 'axios';
 import { ScanLine, FileText, Loader2, Upload, Mic, Square } from 'lucide-react';
 import RiskCard from './components/RiskCard';
 
@@ -66,20 +65,59 @@ function App() {
     }
 
     try {
-      const response = await axios.post('http://localhost:8000/analyze', formData, {
-        headers: {
-          'Content-Type': 'multipart/form-data',
-        },
+      // Stream the analysis: the local verdict shows up first, the AI result replaces it
+      const response = await fetch('http://localhost:8000/analyze/stream', {
+        method: 'POST',
+        body: formData,
       });
+      if (!response.ok || !response.body) {
+        const body = await response.json().catch(() => null);
+        throw new Error(body?.detail || "An error occurred");
+      }
+
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      let finished = false;
+
+      const handleEvent = (event: string, data: any) => {
+        if (event === 'local') {
+          setResult({ ...data, preliminary: true });
+        } else if (event === 'result') {
+          setResult(data);
+          setLoading(false);
+        } else if (event === 'audio') {
+          setResult((prev: any) => (prev ? { ...prev, ...data } : prev));
+        } else if (event === 'error') {
+          setError(data.error);
+          setResult(null);
+          finished = true;
+        } else if (event === 'done') {
+          finished = true;
+        }
+      };
 
-      if (response.data.error) {
-        setError(response.data.error);
-        setResult(null);
-      } else {
-        setResult(response.data);
+      while (!finished) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        // Server-sent events are separated by a blank line
+        let boundary: number;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+          const block = buffer.slice(0, boundary);
+          buffer = buffer.slice(boundary + 2);
+          let event = 'message';
+          let data = '';
+          for (const line of block.split('\n')) {
+            if (line.startsWith('event:')) event = line.slice(6).trim();
+            else if (line.startsWith('data:')) data += line.slice(5).trim();
+          }
+          if (data) handleEvent(event, JSON.parse(data));
+        }
       }
     } catch (err: any) {
-      setError(err.response?.data?.detail || "An error occurred");
+      setError(err.message || "An error occurred");
     } finally {
       setLoading(false);
     }
@@ -132,7 +170,7 @@ function App() {
               <div className="border-2 border-dashed border-gray-300 rounded-xl p-8 text-center hover:bg-gray-50 transition-colors relative">
                 <input
                   type="file"
-                  accept={activeTab === 'image' ? "image/*" : "audio/*"}
+                  accept={activeTab === 'image' ? "image/*,application/pdf" : "audio/*"}
                   onChange={(e) => {
                     if (e.target.files && e.target.files[0]) {
                       setSelectedFile(e.target.files[0]);
@@ -11,12 +11,13 @@ interface ExtractedDetails {
 
 interface AnalysisResult {
     risk_level: "SAFE" | "SCAM" | "SUSPICIOUS" | "CONFUSING";
-    score: number;
+    score?: number | null; // A preliminary verdict from the UPI check has none
     reasons: string[];
-    advice: string;
+    advice?: string;
     transcript?: string | null;
     audio_advice_url?: string | null;
-    extracted_details: ExtractedDetails;
+    extracted_details?: ExtractedDetails;
+    preliminary?: boolean; // Local rule verdict while the AI analysis is still running
 }
 
 interface RiskCardProps {
@@ -26,7 +27,7 @@ interface RiskCardProps {
 const RiskCard: React.FC<RiskCardProps> = ({ result }) => {
     if (!result) return null;
 
-    const { risk_level, score, reasons, advice, extracted_details, transcript, audio_advice_url } = result;
+    const { risk_level, score, reasons, advice, extracted_details, transcript, audio_advice_url, preliminary } = result;
 
     let colorClass = "bg-gray-100 border-gray-300 text-gray-800";
     let Icon = ShieldQuestion;
@@ -48,8 +49,13 @@ const RiskCard: React.FC<RiskCardProps> = ({ result }) => {
                 <Icon className="w-10 h-10" />
                 <div>
                     <h2 className="text-2xl font-bold">{risk_level}</h2>
-                    <p className="text-sm opacity-80">Risk Score: {score}/100</p>
+                    {score != null && <p className="text-sm opacity-80">Risk Score: {score}/100</p>}
                 </div>
+                {preliminary && (
+                    <span className="ml-auto text-xs font-medium bg-white bg-opacity-70 px-2 py-1 rounded-full">
+                        Preliminary check, AI analysis in progress...
+                    </span>
+                )}
             </div>
 
             <div className="mb-4">
@@ -61,24 +67,26 @@ const RiskCard: React.FC<RiskCardProps> = ({ result }) => {
                 </ul>
             </div>
 
-            <div className="mb-4 bg-white bg-opacity-50 p-4 rounded-lg">
-                <h3 className="font-semibold mb-2 flex items-center gap-2">
-                    Advice
+            {advice && (
+                <div className="mb-4 bg-white bg-opacity-50 p-4 rounded-lg">
+                    <h3 className="font-semibold mb-2 flex items-center gap-2">
+                        Advice
+                        {audio_advice_url && (
+                            <span className="text-xs font-normal bg-blue-100 text-blue-800 px-2 py-0.5 rounded-full flex items-center gap-1">
+                                Audio Available
+                            </span>
+                        )}
+                    </h3>
+                    <p className="mb-3">{advice}</p>
+
                     {audio_advice_url && (
-                        <span className="text-xs font-normal bg-blue-100 text-blue-800 px-2 py-0.5 rounded-full flex items-center gap-1">
-                            Audio Available
-                        </span>
+                        <audio controls className="w-full h-8 mt-2">
+                            <source src={`http://localhost:8000${audio_advice_url}`} type="audio/mpeg" />
+                            Your browser does not support the audio element.
+                        </audio>
                     )}
-                </h3>
-                <p className="mb-3">{advice}</p>
-
-                {audio_advice_url && (
-                    <audio controls className="w-full h-8 mt-2">
-                        <source src={`http://localhost:8000${audio_advice_url}`} type="audio/mpeg" />
-                        Your browser does not support the audio element.
-                    </audio>
-                )}
-            </div>
+                </div>
+            )}
 
             {transcript && (
                 <div className="mb-4 p-4 bg-gray-50 rounded-lg border border-gray-200">
@@ -0,0 +1,260 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import Counter
+from metrics import GEMINI_CLIENT_EVENTS
+
+# Sized to the project quota; shared by every request in this worker
+GEMINI_RATE_PER_SEC = float(os.getenv("GEMINI_RATE_PER_SEC", "10"))
+GEMINI_BURST = int(os.getenv("GEMINI_BURST", "20"))
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "32"))
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "4"))
+GEMINI_BACKOFF_BASE = float(os.getenv("GEMINI_BACKOFF_BASE", "0.5"))
+GEMINI_BACKOFF_MAX = float(os.getenv("GEMINI_BACKOFF_MAX", "8"))
+# Total time a request may spend queueing, calling and retrying
+GEMINI_DEADLINE_SEC = float(os.getenv("GEMINI_DEADLINE_SEC", "30"))
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+class DeadlineExceeded(TimeoutError):
+    """
+    The request could not complete within its deadline.
+    """
+
+def error_status(e: Exception):
+    """
+    Best-effort HTTP status of an SDK error.
+    """
+    for attr in ("code", "status_code"):
+        value = getattr(e, attr, None)
+        if isinstance(value, int):
+            return value
+    message = str(e)
+    if "429" in message or "RESOURCE_EXHAUSTED" in message:
+        return 429
+    if "503" in message or "UNAVAILABLE" in message:
+        return 503
+    return None
+
+def is_retryable(e: Exception) -> bool:
+    if isinstance(e, DeadlineExceeded):
+        return False
+    if isinstance(e, (ConnectionError, TimeoutError)):
+        return True
+    return error_status(e) in RETRYABLE_STATUS
+
+def with_request_timeout(config, seconds: float):
+    """
+    Copy of a generate_content config whose HTTP request times out after
+    seconds, so a blocking call cannot outlive its deadline.
+    """
+    from google.genai import types
+    if config is None:
+        config = types.GenerateContentConfig()
+    elif isinstance(config, dict):
+        config = types.GenerateContentConfig(**config)
+    else:
+        config = config.model_copy()
+    http_options = config.http_options.model_copy() if config.http_options else types.HttpOptions()
+    timeout_ms = max(1, int(seconds * 1000)) # HttpOptions.timeout is in milliseconds
+    http_options.timeout = min(http_options.timeout, timeout_ms) if http_options.timeout else timeout_ms
+    config.http_options = http_options
+    return config
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. Callers reserve a token and sleep for the
+    returned wait, so it works the same from threads and coroutines.
+    """
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, deadline: float = None):
+        """
+        Reserves one token and returns how long to wait before using it,
+        or None (reserving nothing) if that wait would pass the deadline.
+        """
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = max(0.0, (1 - self._tokens) / self.rate)
+            if deadline is not None and now + wait > deadline:
+                return None
+            self._tokens -= 1
+            return wait
+
+class GeminiClient:
+    """
+    Wraps a google-genai Client with a shared rate limiter, a bounded number
+    of in-flight calls, and exponential backoff with full jitter on 429/5xx.
+    Every call carries a deadline: waiting for a token or a slot, the call
+    itself and any retries must all finish before it.
+    """
+    def __init__(self, client, rate: float = GEMINI_RATE_PER_SEC, burst: int = GEMINI_BURST,
+                 max_concurrency: int = GEMINI_MAX_CONCURRENCY, max_retries: int = GEMINI_MAX_RETRIES,
+                 backoff_base: float = GEMINI_BACKOFF_BASE, backoff_max: float = GEMINI_BACKOFF_MAX,
+                 deadline: float = GEMINI_DEADLINE_SEC):
+        self.client = client
+        self.bucket = TokenBucket(rate, burst)
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.deadline = deadline
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._async_slots = None
+        self.stats = Counter()
+        self._stats_lock = threading.Lock()
+
+    def _count(self, key: str, n: int = 1):
+        with self._stats_lock:
+            self.stats[key] += n
+        GEMINI_CLIENT_EVENTS.inc(n, event=key)
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _deadline(self, timeout: float = None) -> float:
+        return time.monotonic() + (timeout if timeout is not None else self.deadline)
+
+    def _check_retry(self, e: Exception, attempt: int, deadline: float, max_retries: int = None):
+        """
+        Returns the backoff delay before the next attempt, or re-raises e.
+        """
+        if max_retries is None:
+            max_retries = self.max_retries
+        if not is_retryable(e) or attempt >= max_retries:
+            raise e
+        delay = self._backoff(attempt)
+        if time.monotonic() + delay >= deadline:
+            self._count("deadline_exceeded")
+            raise e
+        self._count("retries")
+        if error_status(e) == 429:
+            self._count("throttled")
+        return delay
+
+    def _reserve(self, deadline: float) -> float:
+        wait = self.bucket.reserve(deadline)
+        if wait is None:
+            self._count("deadline_exceeded")
+            raise DeadlineExceeded("Gemini rate limit queue exceeded the request deadline")
+        if wait:
+            self._count("rate_limited")
+        return wait
+
+    def generate_content(self, *, model: str, contents, config=None, timeout: float = None, max_retries: int = None):
+        """
+        Blocking generate_content with rate limiting, retries and a deadline;
+        the remaining deadline is the HTTP timeout of each attempt.
+        max_retries overrides the client default, e.g. 0 when the caller
+        fails over to another model instead.
+        """
+        deadline = self._deadline(timeout)
+        attempt = 0
+        while True:
+            time.sleep(self._reserve(deadline))
+            if not self._slots.acquire(timeout=max(0.0, deadline - time.monotonic())):
+                self._count("deadline_exceeded")
+                raise DeadlineExceeded("No Gemini call slot became free before the request deadline")
+            try:
+                self._count("calls")
+                # A thread cannot be cancelled like a coroutine; the HTTP timeout bounds the call instead
+                return self.client.models.generate_content(
+                    model=model, contents=contents,
+                    config=with_request_timeout(config, max(0.0, deadline - time.monotonic())),
+                )
+            except Exception as e:
+                if time.monotonic() >= deadline and error_status(e) is None:
+                    self._count("deadline_exceeded")
+                    raise DeadlineExceeded("Gemini call did not finish before the request deadline") from e
+                delay = self._check_retry(e, attempt, deadline, max_retries)
+            finally:
+                self._slots.release()
+            time.sleep(delay)
+            attempt += 1
+
+    async def agenerate_content(self, *, model: str, contents, config=None, timeout: float = None, max_retries: int = None):
+        """
+        Async generate_content; the in-flight call is cancelled at the deadline.
+        """
+        if self._async_slots is None:
+            self._async_slots = asyncio.Semaphore(self.max_concurrency)
+        deadline = self._deadline(timeout)
+        attempt = 0
+        while True:
+            await asyncio.sleep(self._reserve(deadline))
+            try:
+                await asyncio.wait_for(self._async_slots.acquire(), max(0.0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                self._count("deadline_exceeded")
+                raise DeadlineExceeded("No Gemini call slot became free before the request deadline")
+            try:
+                self._count("calls")
+                return await asyncio.wait_for(
+                    self.client.aio.models.generate_content(model=model, contents=contents, config=config),
+                    max(0.0, deadline - time.monotonic()),
+                )
+            except asyncio.TimeoutError:
+                self._count("deadline_exceeded")
+                raise DeadlineExceeded("Gemini call did not finish before the request deadline")
+            except Exception as e:
+                delay = self._check_retry(e, attempt, deadline, max_retries)
+            finally:
+                self._async_slots.release()
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def astream_content(self, *, model: str, contents, config=None, timeout: float = None, max_retries: int = None):
+        """
+        Async generate_content_stream, yielding response chunks as they arrive.
+        Failures before the first chunk are retried like agenerate_content;
+        once chunks have been yielded an error is raised to the caller.
+        The call slot is held until the stream finishes.
+        """
+        if self._async_slots is None:
+            self._async_slots = asyncio.Semaphore(self.max_concurrency)
+        deadline = self._deadline(timeout)
+        attempt = 0
+        while True:
+            await asyncio.sleep(self._reserve(deadline))
+            try:
+                await asyncio.wait_for(self._async_slots.acquire(), max(0.0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                self._count("deadline_exceeded")
+                raise DeadlineExceeded("No Gemini call slot became free before the request deadline")
+            streaming = False
+            try:
+                self._count("calls")
+                stream = await asyncio.wait_for(
+                    self.client.aio.models.generate_content_stream(model=model, contents=contents, config=config),
+                    max(0.0, deadline - time.monotonic()),
+                )
+                chunks = stream.__aiter__()
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(chunks.__anext__(), max(0.0, deadline - time.monotonic()))
+                    except StopAsyncIteration:
+                        return
+                    streaming = True
+                    yield chunk
+            except asyncio.TimeoutError:
+                self._count("deadline_exceeded")
+                raise DeadlineExceeded("Gemini stream did not finish before the request deadline")
+            except Exception as e:
+                if streaming:
+                    raise
+                delay = self._check_retry(e, attempt, deadline, max_retries)
+            finally:
+                self._async_slots.release()
+            await asyncio.sleep(delay)
+            attempt += 1
@@ -0,0 +1,141 @@
+"""
+Prepares uploaded images and PDFs before they are sent to Gemini.
+
+Screenshots and scanned documents are often several megabytes at a
+resolution well above what the model uses. Each image is downscaled to a
+pixel budget and re-encoded as JPEG until it fits a byte budget; images
+already within both budgets are sent unchanged. PDFs are rendered to page
+images, up to IMAGE_PDF_MAX_PAGES pages, when pypdfium2 is installed and are
+otherwise sent as a PDF for Gemini to read.
+
+Prepared images are cached by content hash, so retries and repeat
+submissions skip the decode and re-encode.
+"""
+import io
+import os
+from cache import TTLCache, hash_source
+from metrics import timed, gauge_callback
+
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", str(1600 * 1600)))
+IMAGE_MAX_BYTES = int(os.getenv("IMAGE_MAX_BYTES", str(512 * 1024)))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+IMAGE_MIN_JPEG_QUALITY = int(os.getenv("IMAGE_MIN_JPEG_QUALITY", "55"))
+IMAGE_PDF_MAX_PAGES = int(os.getenv("IMAGE_PDF_MAX_PAGES", "3"))
+IMAGE_PREP_CACHE_SIZE = int(os.getenv("IMAGE_PREP_CACHE_SIZE", "128"))
+IMAGE_PREP_CACHE_TTL = float(os.getenv("IMAGE_PREP_CACHE_TTL", "3600"))
+
+PASSTHROUGH_FORMATS = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
+
+_cache = TTLCache(max_entries=IMAGE_PREP_CACHE_SIZE, ttl=IMAGE_PREP_CACHE_TTL)
+gauge_callback("fsn_image_prep_cache_entries", "Prepared images held in memory", [], lambda: {(): len(_cache)})
+
+def _read(source) -> bytes:
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return bytes(source)
+    with open(source, "rb") as f:
+        return f.read()
+
+def is_pdf(data: bytes) -> bool:
+    return data[:5] == b"%PDF-"
+
+def _fit_pixels(width: int, height: int, max_pixels: int):
+    """
+    Largest size with the same aspect ratio and at most max_pixels pixels.
+    """
+    if width * height <= max_pixels:
+        return width, height
+    scale = (max_pixels / (width * height)) ** 0.5
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+def encode_image(image, max_pixels: int = IMAGE_MAX_PIXELS, max_bytes: int = IMAGE_MAX_BYTES) -> bytes:
+    """
+    Downscales a PIL image to the pixel budget and encodes it as JPEG,
+    lowering the quality and then the size until it fits max_bytes.
+    """
+    from PIL import Image
+    if image.mode in ("RGBA", "LA", "P"):
+        # Flatten transparency onto white; JPEG has no alpha channel
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, "white")
+        background.paste(image, mask=image.getchannel("A"))
+        image = background
+    elif image.mode != "RGB":
+        image = image.convert("RGB")
+
+    size = _fit_pixels(image.width, image.height, max_pixels)
+    while True:
+        resized = image.resize(size, Image.LANCZOS) if size != image.size else image
+        for quality in range(IMAGE_JPEG_QUALITY, IMAGE_MIN_JPEG_QUALITY - 1, -10):
+            out = io.BytesIO()
+            resized.save(out, format="JPEG", quality=quality, optimize=True)
+            if out.tell() <= max_bytes:
+                return out.getvalue()
+        if min(size) <= 256:
+            return out.getvalue() # Smallest useful size; send it even if over budget
+        size = (max(1, int(size[0] * 0.75)), max(1, int(size[1] * 0.75)))
+
+def _prepare_bitmap(data: bytes, max_pixels: int, max_bytes: int) -> list:
+    from PIL import Image, ImageOps
+    image = Image.open(io.BytesIO(data))
+    if (image.format in PASSTHROUGH_FORMATS and len(data) <= max_bytes
+            and image.width * image.height <= max_pixels and not image.getexif().get(0x0112)):
+        # Already within budget (and upright): sending it as-is loses nothing
+        return [(data, PASSTHROUGH_FORMATS[image.format])]
+    if image.format == "JPEG":
+        # Let the JPEG decoder downscale by a power of two while decoding
+        image.draft("RGB", _fit_pixels(image.width, image.height, max_pixels))
+    image = ImageOps.exif_transpose(image)
+    return [(encode_image(image, max_pixels, max_bytes), "image/jpeg")]
+
+def render_pdf_pages(data: bytes, max_pages: int = IMAGE_PDF_MAX_PAGES, max_pixels: int = IMAGE_MAX_PIXELS) -> list:
+    """
+    Renders the first max_pages pages of a PDF to PIL images sized to the
+    pixel budget. Needs the optional pypdfium2 package.
+    """
+    import pypdfium2 as pdfium
+    pdf = pdfium.PdfDocument(data)
+    try:
+        pages = []
+        for index in range(min(len(pdf), max_pages)):
+            page = pdf[index]
+            width, height = page.get_size() # In points, 72 per inch
+            scale = min(4.0, (max_pixels / (width * height)) ** 0.5)
+            pages.append(page.render(scale=scale).to_pil())
+            page.close()
+        return pages
+    finally:
+        pdf.close()
+
+def _prepare_pdf(data: bytes, max_pixels: int, max_bytes: int, max_pages: int) -> list:
+    try:
+        pages = render_pdf_pages(data, max_pages, max_pixels)
+    except ImportError:
+        # Gemini reads PDFs natively; without a renderer send the document itself
+        return [(data, "application/pdf")]
+    # The byte budget is shared by the rendered pages
+    page_bytes = max_bytes // max(1, len(pages))
+    return [(encode_image(page, max_pixels, page_bytes), "image/jpeg") for page in pages]
+
+def prepare_image(source, digest: str = None, max_pixels: int = IMAGE_MAX_PIXELS, max_bytes: int = IMAGE_MAX_BYTES,
+                  max_pdf_pages: int = IMAGE_PDF_MAX_PAGES) -> list:
+    """
+    Returns the image (path or bytes) as a list of (data, mime_type) parts
+    within the pixel and byte budgets: one part for an image, one per
+    rendered page for a PDF. Pass digest when the content hash is known.
+    """
+    key = (digest or hash_source(source), max_pixels, max_bytes, max_pdf_pages)
+    parts = _cache.get(key)
+    if parts is not None:
+        return parts
+
+    with timed("image_prep"):
+        data = _read(source)
+        if is_pdf(data):
+            parts = _prepare_pdf(data, max_pixels, max_bytes, max_pdf_pages)
+        else:
+            parts = _prepare_bitmap(data, max_pixels, max_bytes)
+    _cache.set(key, parts)
+    return parts
+
+def cache_stats() -> dict:
+    return {"entries": len(_cache), "evictions": _cache.evictions}
@@ -1,29 +1,45 @@
 import argparse
 import json
 import os
-from agent import FinancialSafetyNet
-from spam_detector import check_spam_number
+from spam_detector import check_spam_number, check_spam_numbers
 
 def main():
     parser = argparse.ArgumentParser(description="Financial Safety Net Agent")
     parser.add_argument("--text", type=str, help="Text content to analyze")
     parser.add_argument("--image", type=str, help="Path to image file (Screenshot/PDF/QR)")
     parser.add_argument("--type", type=str, default="unknown", help="Category hint: upi, loan, insurance, spam_check, upi_qr")
-    parser.add_argument("--check-number", type=str, help="Check a phone number for spam")
+    parser.add_argument("--check-number", type=str, help="Check a phone number for spam, or every number in a file (one per line)")
+    parser.add_argument("--batch-file", type=str, help="JSONL file of texts to score offline (one result per line on stdout)")
+    parser.add_argument("--batch-analyzer", type=str, default="rules", help="Batch analyzer: rules, transcript")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes for --batch-file (default: all cores)")
     
     args = parser.parse_args()
     
     # Simple Spam Number Check
     if args.check_number:
+        if os.path.isfile(args.check_number):
+            with open(args.check_number, "r", encoding="utf-8") as f:
+                numbers = [line.strip() for line in f if line.strip()]
+            for number, result in zip(numbers, check_spam_numbers(numbers)):
+                print(json.dumps({"number": number, **result}))
+            return
         result = check_spam_number(args.check_number)
         print(json.dumps(result, indent=2))
         return
 
+    # Offline Batch Scoring
+    if args.batch_file:
+        from batch import run_batch_file
+        run_batch_file(args.batch_file, analyzer=args.batch_analyzer, category=args.type, workers=args.workers)
+        return
+
     # Agent Analysis
     if not args.text and not args.image:
         print("Error: Please provide --text or --image input.")
         return
 
+    # Imported here so the quick commands above skip loading the Gemini SDK
+    from agent import FinancialSafetyNet
     try:
         agent = FinancialSafetyNet()
         result = agent.analyze(text_input=args.text, image_path=args.image, category_hint=args.type)
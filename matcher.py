@@ -0,0 +1,150 @@
+import re
+
+class KeywordAutomaton:
+    """
+    Aho-Corasick automaton over a fixed set of lowercase terms.
+    Finds every term occurring as a substring of the input in a single pass.
+    """
+
+    def __init__(self, terms):
+        self.terms = sorted(set(terms))
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [set()]
+
+        for term in self.terms:
+            state = 0
+            for ch in term:
+                next_state = self._goto[state].get(ch)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][ch] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append(set())
+                state = next_state
+            self._output[state].add(term)
+
+        # Breadth-first pass to wire failure links and merge outputs
+        queue = list(self._goto[0].values())
+        while queue:
+            state = queue.pop(0)
+            for ch, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(ch, 0)
+                self._fail[next_state] = target if target != next_state else 0
+                self._output[next_state] |= self._output[self._fail[next_state]]
+
+        self._output = [frozenset(out) for out in self._output]
+
+    def feed(self, text: str, state: int = 0, found: set = None):
+        """
+        Advances the automaton over text starting from state.
+        Returns (state, found) so callers can resume on the next fragment.
+        """
+        if found is None:
+            found = set()
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if output[state]:
+                found |= output[state]
+        return state, found
+
+    def scan(self, text: str) -> set:
+        """
+        Returns the set of terms occurring anywhere in text.
+        """
+        return self.feed(text)[1]
+
+
+class RuleEngine:
+    """
+    Compiles a declarative rule table into one keyword automaton plus
+    precompiled regexes, so each text is scanned exactly once.
+
+    category_triggers maps a category to the terms that activate it even
+    when the caller did not pass that category (None = always active).
+
+    Each rule is a dict with:
+        category  - category gate the rule belongs to
+        all_of    - list of term groups; every group needs at least one hit
+        none_of   - terms that must all be absent (optional)
+        pattern   - regex searched only once all_of is satisfied (optional)
+        min_value - first regex group must exceed this value (optional)
+        score     - points added when the rule fires
+        reason    - message; "{value}" is filled from the regex group
+    """
+
+    def __init__(self, rules, category_triggers):
+        self.rules = []
+        self.category_triggers = {}
+        terms = set()
+
+        for category, triggers in category_triggers.items():
+            self.category_triggers[category] = frozenset(triggers) if triggers is not None else None
+            terms.update(triggers or ())
+
+        for rule in rules:
+            compiled = dict(rule)
+            compiled["all_of"] = [frozenset(group) for group in rule.get("all_of", [])]
+            compiled["none_of"] = frozenset(rule.get("none_of", ()))
+            compiled["pattern"] = re.compile(rule["pattern"]) if rule.get("pattern") else None
+            for group in compiled["all_of"]:
+                terms.update(group)
+            terms.update(compiled["none_of"])
+            self.rules.append(compiled)
+
+        self.automaton = KeywordAutomaton(terms)
+
+    def active_categories(self, found: set, category: str = "unknown") -> set:
+        """
+        Returns the categories enabled by the category hint or by trigger terms.
+        """
+        active = set()
+        for name, triggers in self.category_triggers.items():
+            if triggers is None or name == category or not triggers.isdisjoint(found):
+                active.add(name)
+        return active
+
+    def evaluate(self, text: str, found: set, category: str = "unknown"):
+        """
+        Applies the rule table to the terms found in text.
+        Returns (score, reasons) in rule table order.
+        """
+        active = self.active_categories(found, category)
+        score = 0
+        reasons = []
+        for rule in self.rules:
+            if rule["category"] not in active:
+                continue
+            if any(group.isdisjoint(found) for group in rule["all_of"]):
+                continue
+            if not rule["none_of"].isdisjoint(found):
+                continue
+
+            value = None
+            if rule["pattern"] is not None:
+                match = rule["pattern"].search(text)
+                if not match:
+                    continue
+                value = int(match.group(1))
+                if "min_value" in rule and value <= rule["min_value"]:
+                    continue
+
+            reasons.append(rule["reason"].format(value=value))
+            score += rule["score"]
+        return score, reasons
+
+    def match(self, text: str, category: str = "unknown"):
+        """
+        Scans lowercase text once and returns (score, reasons).
+        """
+        return self.evaluate(text, self.automaton.scan(text), category)
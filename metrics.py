@@ -0,0 +1,182 @@
+"""
+Minimal in-process metrics with Prometheus text exposition.
+
+Recording is a lock, a bisect and two additions, cheap enough to leave on
+in production. Each uvicorn worker keeps its own registry, so scrape every
+worker (or run one worker per container).
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+TOKEN_BUCKETS = (0, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+def _label_key(labelnames: tuple, labels: dict) -> tuple:
+    return tuple(str(labels.get(name, "")) for name in labelnames)
+
+def _format_labels(labelnames: tuple, key: tuple, extra: str = "") -> str:
+    parts = [f'{name}="{value}"' for name, value in zip(labelnames, key)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(self.labelnames, labels), 0)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {} # key -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _label_key(self.labelnames, labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 3)
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def count(self, **labels) -> int:
+        series = self._series.get(_label_key(self.labelnames, labels))
+        return series[-1] if series else 0
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._series.items())
+        for key, series in items:
+            cumulative = 0
+            for bound, hits in zip(self.buckets + (float("inf"),), series):
+                cumulative += hits
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                labels = _format_labels(self.labelnames, key, 'le="%s"' % le)
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {series[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {series[-1]}")
+        return lines
+
+class CallbackGauge:
+    """
+    Gauge whose values are read from a callback at scrape time.
+    The callback returns {label value tuple: number}.
+    """
+    def __init__(self, name: str, help: str, labelnames, callback):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            values = self.callback()
+        except Exception as e:
+            print(f"Metrics callback {self.name} failed: {e}")
+            return lines
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            # Re-registering a name replaces it, e.g. when a new agent is created
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+def counter(name: str, help: str, labelnames=()) -> Counter:
+    return REGISTRY.register(Counter(name, help, labelnames))
+
+def histogram(name: str, help: str, labelnames=(), buckets=LATENCY_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, help, labelnames, buckets))
+
+def gauge_callback(name: str, help: str, labelnames, callback) -> CallbackGauge:
+    return REGISTRY.register(CallbackGauge(name, help, labelnames, callback))
+
+def render() -> str:
+    return REGISTRY.render()
+
+# Shared metrics recorded across the pipeline
+STAGE_LATENCY = histogram("fsn_stage_latency_seconds", "Latency of each analysis stage", ["stage"])
+REQUEST_LATENCY = histogram("fsn_http_request_latency_seconds", "HTTP request latency", ["method", "route", "status"])
+PAYLOAD_BYTES = histogram("fsn_payload_bytes", "Size of analyzed payloads", ["kind"], buckets=SIZE_BUCKETS)
+CACHE_LOOKUPS = counter("fsn_response_cache_lookups_total", "Response cache lookups", ["result"])
+ANALYSIS_TIER = counter("fsn_analysis_tier_total", "Which tier answered each analysis", ["tier"])
+GEMINI_TOKENS = counter("fsn_gemini_tokens_total", "Gemini token usage", ["kind"])
+GEMINI_CACHED_TOKENS = histogram("fsn_gemini_cached_prompt_tokens", "Prompt tokens per Gemini response served from a context cache",
+                                 buckets=TOKEN_BUCKETS)
+GEMINI_CLIENT_EVENTS = counter("fsn_gemini_client_events_total", "Gemini client calls, retries and throttling", ["event"])
+QR_DECODE_STAGE = counter("fsn_qr_decode_stage_total", "QR decode stage that produced the result", ["stage"])
+LIVE_CALL_UPDATES = counter("fsn_live_call_updates_total", "Risk updates pushed to live call sessions", ["risk_level"])
+
+@contextmanager
+def timed(stage: str):
+    """
+    Records the wall time of the enclosed block under fsn_stage_latency_seconds.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_LATENCY.observe(time.perf_counter() - started, stage=stage)
+
+def record_gemini_usage(response):
+    """
+    Adds the token counts of a Gemini response to fsn_gemini_tokens_total
+    and its cached prompt tokens (the input-token saving) to
+    fsn_gemini_cached_prompt_tokens.
+    """
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    GEMINI_CACHED_TOKENS.observe(getattr(usage, "cached_content_token_count", None) or 0)
+    for kind, attr in (("prompt", "prompt_token_count"), ("candidates", "candidates_token_count"),
+                       ("cached", "cached_content_token_count"), ("total", "total_token_count")):
+        value = getattr(usage, attr, None)
+        if value:
+            GEMINI_TOKENS.inc(value, kind=kind)
@@ -0,0 +1,299 @@
+"""
+Latency-aware routing across the configured Gemini models.
+
+The router keeps a moving window of latencies and outcomes per model and
+sends each request to the fastest healthy one (by p50). A model is
+unhealthy while its recent error rate is above ROUTER_MAX_ERROR_RATE, and
+cools down for ROUTER_COOLDOWN_SEC after a 429; both wear off on their own,
+so a recovered model is tried again.
+
+Async requests are hedged: when the first call has not answered within
+the model's ROUTER_HEDGE_PERCENTILE latency a second call goes to the next
+model (or the same one when only one is configured) and the first valid
+response wins. A retryable failure (429, 5xx) fails over to the next model
+instead of retrying the same one; only the last model left uses the
+client's own retries. Sync and streaming calls fail over but are not
+hedged.
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from gemini_client import GEMINI_DEADLINE_SEC, DeadlineExceeded, error_status, is_retryable
+from metrics import counter, gauge_callback
+
+# First model is the default; the rest are failover and hedge targets
+GEMINI_MODELS = [m.strip() for m in os.getenv("GEMINI_MODELS", "gemini-1.5-flash").split(",") if m.strip()]
+ROUTER_WINDOW = int(os.getenv("ROUTER_WINDOW", "200")) # Latency samples kept per model
+ROUTER_MIN_SAMPLES = int(os.getenv("ROUTER_MIN_SAMPLES", "10")) # Before a model is ranked by latency or hedged
+ROUTER_HEDGE_ENABLED = os.getenv("ROUTER_HEDGE_ENABLED", "1") == "1"
+ROUTER_HEDGE_PERCENTILE = float(os.getenv("ROUTER_HEDGE_PERCENTILE", "95"))
+ROUTER_HEDGE_MIN_SEC = float(os.getenv("ROUTER_HEDGE_MIN_SEC", "0.25")) # Never hedge sooner than this
+ROUTER_MAX_ERROR_RATE = float(os.getenv("ROUTER_MAX_ERROR_RATE", "0.5"))
+ROUTER_ERROR_WINDOW_SEC = float(os.getenv("ROUTER_ERROR_WINDOW_SEC", "60"))
+ROUTER_COOLDOWN_SEC = float(os.getenv("ROUTER_COOLDOWN_SEC", "30")) # After a 429
+
+ROUTER_DECISIONS = counter("fsn_model_router_decisions_total", "Gemini calls started by the model router", ["model", "decision"])
+ROUTER_WINS = counter("fsn_model_router_wins_total", "Gemini calls whose response was used", ["model", "decision"])
+
+class InvalidResponse(ValueError):
+    """
+    The model answered, but not with a response the caller can use.
+    """
+
+def _config_for(config, model: str):
+    # config may be a function of the model, e.g. to use that model's context cache
+    return config(model) if callable(config) else config
+
+class ModelStats:
+    """
+    Moving latency window and time-stamped outcomes of one model.
+    """
+    def __init__(self, window: int = ROUTER_WINDOW):
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window) # (time, ok)
+        self.cooldown_until = 0.0
+
+    def percentile(self, q: float):
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))]
+
+    def error_rate(self, now: float, window_sec: float = ROUTER_ERROR_WINDOW_SEC) -> float:
+        recent = [ok for t, ok in self.outcomes if now - t <= window_sec]
+        if not recent:
+            return 0.0
+        return 1 - sum(recent) / len(recent)
+
+class ModelRouter:
+    def __init__(self, models=None, min_samples: int = ROUTER_MIN_SAMPLES, hedge_enabled: bool = ROUTER_HEDGE_ENABLED,
+                 hedge_percentile: float = ROUTER_HEDGE_PERCENTILE, hedge_min_sec: float = ROUTER_HEDGE_MIN_SEC,
+                 max_error_rate: float = ROUTER_MAX_ERROR_RATE, cooldown_sec: float = ROUTER_COOLDOWN_SEC):
+        self.models = list(models or GEMINI_MODELS)
+        if not self.models:
+            raise ValueError("At least one Gemini model must be configured.")
+        self.min_samples = min_samples
+        self.hedge_enabled = hedge_enabled
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_sec = hedge_min_sec
+        self.max_error_rate = max_error_rate
+        self.cooldown_sec = cooldown_sec
+        self._stats = {model: ModelStats() for model in self.models}
+        self._lock = threading.Lock()
+        gauge_callback("fsn_model_latency_seconds", "Moving Gemini latency per model", ["model", "quantile"], self._latency_gauge)
+        gauge_callback("fsn_model_error_rate", "Recent Gemini error rate per model", ["model"],
+                       lambda: {(m,): s["error_rate"] for m, s in self.stats().items()})
+        gauge_callback("fsn_model_available", "1 if the router currently sends traffic to the model", ["model"],
+                       lambda: {(m,): int(s["available"]) for m, s in self.stats().items()})
+
+    def _latency_gauge(self) -> dict:
+        values = {}
+        for model, stats in self.stats().items():
+            for quantile in ("p50", "p95"):
+                if stats[quantile] is not None:
+                    values[(model, quantile)] = stats[quantile]
+        return values
+
+    def _available(self, stats: ModelStats, now: float) -> bool:
+        return now >= stats.cooldown_until and stats.error_rate(now) <= self.max_error_rate
+
+    def ranked(self) -> list:
+        """
+        Models in the order they should be tried: available before cooling
+        down or failing, then by p50 latency, then by configured order.
+        """
+        now = time.monotonic()
+        with self._lock:
+            def key(item):
+                index, model = item
+                stats = self._stats[model]
+                p50 = stats.percentile(50) if len(stats.latencies) >= self.min_samples else None
+                return (not self._available(stats, now), float("inf") if p50 is None else p50, index)
+            return [model for _, model in sorted(enumerate(self.models), key=key)]
+
+    def hedge_delay(self, model: str):
+        """
+        Seconds to wait for model before hedging, or None when hedging is
+        off or there are too few samples to know its tail latency.
+        """
+        if not self.hedge_enabled:
+            return None
+        with self._lock:
+            stats = self._stats[model]
+            if len(stats.latencies) < self.min_samples:
+                return None
+            return max(self.hedge_min_sec, stats.percentile(self.hedge_percentile))
+
+    def record(self, model: str, latency: float = None, ok: bool = True, status: int = None):
+        now = time.monotonic()
+        with self._lock:
+            stats = self._stats[model]
+            if latency is not None:
+                stats.latencies.append(latency)
+            stats.outcomes.append((now, ok))
+            if status == 429:
+                stats.cooldown_until = now + self.cooldown_sec
+
+    def record_latency(self, model: str, latency: float):
+        """
+        Adds a latency sample without an outcome, e.g. for a cancelled call.
+        """
+        with self._lock:
+            self._stats[model].latencies.append(latency)
+
+    def _record_error(self, model: str, e: Exception):
+        self.record(model, ok=False, status=error_status(e))
+        if not is_retryable(e) and not isinstance(e, InvalidResponse):
+            raise e
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                model: {
+                    "samples": len(stats.latencies),
+                    "p50": stats.percentile(50),
+                    "p95": stats.percentile(95),
+                    "error_rate": round(stats.error_rate(now), 3),
+                    "available": self._available(stats, now),
+                }
+                for model, stats in self._stats.items()
+            }
+
+    @staticmethod
+    def _deadline(timeout: float = None) -> float:
+        return time.monotonic() + (GEMINI_DEADLINE_SEC if timeout is None else timeout)
+
+    def generate(self, gemini, *, contents, config=None, validate=None, timeout: float = None):
+        """
+        Blocking call through the client, failing over in ranked order.
+        """
+        deadline = self._deadline(timeout)
+        candidates = self.ranked()
+        last_error = None
+        for position, model in enumerate(candidates):
+            decision = "primary" if position == 0 else "failover"
+            ROUTER_DECISIONS.inc(model=model, decision=decision)
+            started = time.monotonic()
+            try:
+                response = gemini.generate_content(model=model, contents=contents, config=_config_for(config, model),
+                                                   timeout=max(0.0, deadline - started),
+                                                   max_retries=0 if position < len(candidates) - 1 else None)
+                if validate is not None and not validate(response):
+                    raise InvalidResponse(f"{model} returned a response that does not match the schema")
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                self._record_error(model, e)
+                last_error = e
+                continue
+            self.record(model, time.monotonic() - started)
+            ROUTER_WINS.inc(model=model, decision=decision)
+            return response
+        raise last_error
+
+    async def agenerate(self, gemini, *, contents, config=None, validate=None, timeout: float = None):
+        """
+        Async call through the client with hedging and failover.
+        Returns the first response that passes validate.
+        """
+        deadline = self._deadline(timeout)
+        candidates = self.ranked()
+        primary = candidates[0]
+        pending = {} # task -> (model, decision, started)
+        last_error = None
+
+        def launch(decision: str):
+            # With one model the hedge goes to the same model again
+            model = candidates.pop(0) if candidates else primary
+            ROUTER_DECISIONS.inc(model=model, decision=decision)
+            started = time.monotonic()
+            task = asyncio.ensure_future(gemini.agenerate_content(
+                model=model, contents=contents, config=_config_for(config, model),
+                timeout=max(0.0, deadline - started), max_retries=0 if candidates else None))
+            pending[task] = (model, decision, started)
+
+        launch("primary")
+        hedge_delay = self.hedge_delay(primary)
+        hedge_at = None if hedge_delay is None else time.monotonic() + hedge_delay
+        try:
+            while pending:
+                wake_at = deadline if hedge_at is None else min(deadline, hedge_at)
+                done, _ = await asyncio.wait(pending, timeout=max(0.0, wake_at - time.monotonic()),
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    if time.monotonic() >= deadline:
+                        # The finally block cancels whatever is still running
+                        raise DeadlineExceeded("No Gemini model answered before the request deadline")
+                    if hedge_at is not None and time.monotonic() >= hedge_at:
+                        hedge_at = None
+                        launch("hedge")
+                    continue
+                for task in done:
+                    model, decision, started = pending.pop(task)
+                    try:
+                        response = task.result()
+                        if validate is not None and not validate(response):
+                            raise InvalidResponse(f"{model} returned a response that does not match the schema")
+                    except DeadlineExceeded:
+                        if not pending:
+                            raise
+                        continue
+                    except Exception as e:
+                        self._record_error(model, e)
+                        last_error = e
+                        continue
+                    self.record(model, time.monotonic() - started)
+                    ROUTER_WINS.inc(model=model, decision=decision)
+                    return response
+                if not pending:
+                    if not candidates:
+                        raise last_error
+                    hedge_at = None
+                    launch("failover")
+            raise last_error
+        finally:
+            losers = list(pending.items())
+            for task, _ in losers:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            now = time.monotonic()
+            for _, (model, _, started) in losers:
+                # A lower bound, but it keeps a model that keeps losing from looking fast;
+                # cancelled calls did not succeed, so they do not count toward the error rate
+                self.record_latency(model, now - started)
+
+    async def astream(self, gemini, *, contents, config=None, timeout: float = None):
+        """
+        Streams from the best model, failing over to the next one if a call
+        fails before its first chunk.
+        """
+        deadline = self._deadline(timeout)
+        candidates = self.ranked()
+        last_error = None
+        for position, model in enumerate(candidates):
+            decision = "primary" if position == 0 else "failover"
+            ROUTER_DECISIONS.inc(model=model, decision=decision)
+            started = time.monotonic()
+            streaming = False
+            try:
+                async for chunk in gemini.astream_content(model=model, contents=contents, config=_config_for(config, model),
+                                                          timeout=max(0.0, deadline - started),
+                                                          max_retries=0 if position < len(candidates) - 1 else None):
+                    streaming = True
+                    yield chunk
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                if streaming:
+                    self.record(model, ok=False, status=error_status(e))
+                    raise
+                self._record_error(model, e)
+                last_error = e
+                continue
+            self.record(model, time.monotonic() - started)
+            ROUTER_WINS.inc(model=model, decision=decision)
+            return
+        raise last_error
@@ -0,0 +1,242 @@
+"""
+Perceptual-hash index of previously analyzed images.
+
+The same scam QR poster or fake-loan screenshot keeps coming back
+re-compressed or resized, so its bytes (and the response cache key) differ
+every time. Each image is reduced to a 256-bit difference hash (dHash over a
+17x16 grayscale thumbnail) that barely changes under such edits, and looked
+up among earlier images by Hamming distance. Crops of more than a few
+percent move the thumbnail grid and are treated as new images.
+
+Similar is not the same: posters printed from one template with different
+QR codes are near-duplicates. A match is therefore only used to skip work
+(the QReader fallback on an image like one no stage could read) or
+together with an exact check (a verdict is reused only for the same
+decoded QR payload), never to stand in for the image's own content.
+
+Search uses multi-index hashing: the hash is split into 16 chunks of 16
+bits with one table per chunk. Two hashes within distance d agree exactly
+on at least one chunk when d < 16 (within d // 16 bits on one chunk in
+general), so only those buckets are checked instead of every entry.
+
+Memory is bounded by PHASH_INDEX_SIZE entries (oldest evicted first) and
+entries expire after PHASH_TTL seconds. With PHASH_INDEX_PATH set, entries
+are appended to a JSONL log that is replayed on startup and compacted when
+it grows well past the live entries.
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from itertools import combinations
+from metrics import counter, gauge_callback
+
+PHASH_INDEX_ENABLED = os.getenv("PHASH_INDEX_ENABLED", "1") == "1"
+PHASH_INDEX_PATH = os.getenv("PHASH_INDEX_PATH") # Optional JSONL log; memory only when unset
+PHASH_INDEX_SIZE = int(os.getenv("PHASH_INDEX_SIZE", "20000"))
+# Largest Hamming distance (of 256 bits) still treated as the same image
+PHASH_MAX_DISTANCE = int(os.getenv("PHASH_MAX_DISTANCE", "10"))
+PHASH_TTL = float(os.getenv("PHASH_TTL", str(7 * 24 * 3600)))
+
+HASH_WIDTH, HASH_HEIGHT = 16, 16
+HASH_BITS = HASH_WIDTH * HASH_HEIGHT
+CHUNK_BITS = 16
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+NUM_CHUNKS = HASH_BITS // CHUNK_BITS
+
+PHASH_LOOKUPS = counter("fsn_phash_lookups_total", "Perceptual-hash index lookups", ["scope", "result"])
+
+def image_dhash(source):
+    """
+    256-bit difference hash of an image (path or encoded bytes), or None
+    for PDFs, missing files and data that is not a readable image.
+    """
+    import cv2
+    import numpy as np
+    try:
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            data = np.frombuffer(source, dtype=np.uint8)
+        else:
+            data = np.fromfile(source, dtype=np.uint8)
+    except (OSError, ValueError):
+        return None
+    if data.size == 0 or data[:5].tobytes() == b"%PDF-":
+        return None
+    # Full decode: the reduced-size decode modes subsample PNGs differently
+    # from JPEGs, which moves the hash of a re-encoded copy by 10-20 bits
+    try:
+        gray = cv2.imdecode(data, cv2.IMREAD_GRAYSCALE)
+    except cv2.error:
+        return None
+    if gray is None:
+        return None
+    small = cv2.resize(gray, (HASH_WIDTH + 1, HASH_HEIGHT), interpolation=cv2.INTER_AREA)
+    bits = small[:, 1:] > small[:, :-1]
+    return int.from_bytes(np.packbits(bits.flatten()).tobytes(), "big")
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+def _chunks(phash: int) -> list:
+    return [(phash >> (i * CHUNK_BITS)) & CHUNK_MASK for i in range(NUM_CHUNKS)]
+
+def _chunk_probes(value: int, radius: int) -> list:
+    """
+    Every chunk value within radius bits of value.
+    """
+    probes = [value]
+    for r in range(1, radius + 1):
+        for bits in combinations(range(CHUNK_BITS), r):
+            flipped = value
+            for bit in bits:
+                flipped ^= 1 << bit
+            probes.append(flipped)
+    return probes
+
+class PerceptualIndex:
+    """
+    Bounded, optionally persisted map from perceptual hashes to stored
+    values, searched by Hamming distance. Each entry has a scope (e.g.
+    "qr_miss" or the request's text, category and QR payload) and only matches lookups with the
+    same scope.
+    """
+    def __init__(self, max_entries: int = PHASH_INDEX_SIZE, max_distance: int = PHASH_MAX_DISTANCE,
+                 ttl: float = PHASH_TTL, path: str = None):
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self.ttl = ttl
+        self.path = path
+        self._entries = OrderedDict() # id -> (phash, scope, value, created)
+        self._tables = [{} for _ in range(NUM_CHUNKS)] # chunk value -> set of ids
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._log_lines = 0
+        if path:
+            self._load()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _insert(self, phash: int, scope: str, value, created: float):
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = (phash, scope, value, created)
+        for table, chunk in zip(self._tables, _chunks(phash)):
+            table.setdefault(chunk, set()).add(entry_id)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, entry_id: int):
+        phash = self._entries.pop(entry_id)[0]
+        for table, chunk in zip(self._tables, _chunks(phash)):
+            bucket = table.get(chunk)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del table[chunk]
+
+    def _candidates(self, phash: int) -> set:
+        radius = self.max_distance // NUM_CHUNKS
+        found = set()
+        for table, chunk in zip(self._tables, _chunks(phash)):
+            for probe in _chunk_probes(chunk, radius):
+                bucket = table.get(probe)
+                if bucket:
+                    found |= bucket
+        return found
+
+    def lookup(self, phash: int, scope: str):
+        """
+        Returns (value, distance) of the closest live entry with this scope
+        within max_distance, or None.
+        """
+        now = time.time()
+        with self._lock:
+            best = None
+            expired = []
+            for entry_id in self._candidates(phash):
+                entry_hash, entry_scope, value, created = self._entries[entry_id]
+                if now - created > self.ttl:
+                    expired.append(entry_id)
+                    continue
+                if entry_scope != scope:
+                    continue
+                distance = hamming(phash, entry_hash)
+                if distance <= self.max_distance and (best is None or distance < best[1]):
+                    best = (value, distance)
+            for entry_id in expired:
+                self._remove(entry_id)
+        return best
+
+    def add(self, phash: int, scope: str, value):
+        """
+        Stores a value for an image; value must be JSON-serializable when
+        the index is persisted.
+        """
+        created = time.time()
+        with self._lock:
+            self._insert(phash, scope, value, created)
+            if self.path:
+                self._append({"h": format(phash, "x"), "s": scope, "v": value, "t": created})
+
+    def _append(self, record: dict):
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record) + "\n")
+            self._log_lines += 1
+            if self._log_lines > 2 * self.max_entries:
+                self._compact()
+        except OSError as e:
+            print(f"Perceptual index write failed: {e}")
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                lines = f.readlines()
+        except OSError:
+            return
+        now = time.time()
+        for line in lines:
+            try:
+                record = json.loads(line)
+                if now - record["t"] <= self.ttl:
+                    self._insert(int(record["h"], 16), record["s"], record["v"], record["t"])
+            except (ValueError, KeyError, TypeError):
+                continue # Torn last line after a crash
+        self._log_lines = len(lines)
+        if self._log_lines > len(self._entries) * 2:
+            self._compact()
+
+    def _compact(self):
+        """
+        Rewrites the log with only the live entries; written next to it and
+        atomically renamed into place.
+        """
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for phash, scope, value, created in self._entries.values():
+                    f.write(json.dumps({"h": format(phash, "x"), "s": scope, "v": value, "t": created}) + "\n")
+            os.replace(tmp_path, self.path)
+            self._log_lines = len(self._entries)
+        except OSError as e:
+            print(f"Perceptual index compaction failed: {e}")
+
+_index = None
+_index_lock = threading.Lock()
+
+def get_phash_index():
+    """
+    Returns the shared perceptual-hash index, or None when disabled.
+    """
+    global _index
+    if _index is None and PHASH_INDEX_ENABLED:
+        with _index_lock:
+            if _index is None:
+                _index = PerceptualIndex(path=PHASH_INDEX_PATH)
+    return _index
+
+gauge_callback("fsn_phash_index_entries", "Images in the perceptual-hash index", [],
+               lambda: {(): len(_index) if _index is not None else 0})
@@ -0,0 +1,97 @@
+import os
+from tools import reason_category
+
+SHORT_CIRCUIT_ENABLED = os.getenv("SHORT_CIRCUIT_ENABLED", "1") == "1"
+# Rule score at or above which the local verdict is final (100 = certain SCAM)
+SHORT_CIRCUIT_MIN_SCORE = int(os.getenv("SHORT_CIRCUIT_MIN_SCORE", "100"))
+SHORT_CIRCUIT_BLOCKED_VPA = os.getenv("SHORT_CIRCUIT_BLOCKED_VPA", "1") == "1"
+
+# Which stage produced the final answer
+TIER_CACHE = "cache"
+TIER_NEAR_DUPLICATE = "near_duplicate"
+TIER_UPI_BLOCKLIST = "upi_blocklist"
+TIER_RULES = "rules"
+TIER_LLM = "llm"
+
+REPORT_ADVICE = "If you have already paid or shared details, call the cyber crime helpline 1930 or report it at cybercrime.gov.in immediately."
+
+ADVICE_TEMPLATES = {
+    "upi": "This is a scam. You never need to enter your UPI PIN or click a link to receive money, and banks never ask you to update KYC through messages. Do not pay, scan or share anything.",
+    "loan": "This is a loan scam. Genuine lenders registered with RBI never ask for processing fees in advance or skip credit checks. Do not pay anything or share your documents.",
+    "insurance": "This policy offer has serious warning signs. Do not pay or sign anything until you have read the full policy wording and checked the insurer with IRDAI.",
+    "spam_call": "This call is a scam. Police, CBI and bank officials never ask for OTPs, payments or 'digital arrest' over a phone call. Hang up and do not share any details.",
+    "unknown": "This message is a scam. Never share your Aadhaar, PAN, OTP, CVV or passwords over WhatsApp, phone calls or unknown links. Banks and officials never ask for them this way.",
+}
+
+BLOCKED_VPA_ADVICE = "Do not pay this UPI ID. It has been reported for fraud. Close the payment app without entering your PIN."
+
+def _category_for(category_hint: str, reasons: list) -> str:
+    if category_hint == "upi_qr":
+        return "upi"
+    if category_hint in ("spam_check", "spam_call"):
+        return "spam_call"
+    if category_hint in ADVICE_TEMPLATES and category_hint != "unknown":
+        return category_hint
+    for reason in reasons:
+        category = reason_category(reason)
+        if category in ADVICE_TEMPLATES:
+            return category
+    return "unknown"
+
+def _local_result(risk_level: str, score: int, category: str, reasons: list, advice: str, tier: str, key_points: list = None) -> dict:
+    """
+    Builds a result with the same schema Gemini is asked to return.
+    """
+    return {
+        "risk_level": risk_level,
+        "score": score,
+        "category": category,
+        "reasons": list(reasons),
+        "advice": f"{advice} {REPORT_ADVICE}",
+        "transcript": None,
+        "extracted_details": {
+            "interest_rate": None,
+            "fees": None,
+            "tenure": None,
+            "exclusions": None,
+            "other_key_points": key_points or [],
+        },
+        "tier": tier,
+    }
+
+class DecisionPolicy:
+    """
+    Decides when the local rule engine and UPI blocklist are certain enough to
+    answer without calling the LLM.
+    """
+    def __init__(self, enabled: bool = SHORT_CIRCUIT_ENABLED, min_score: int = SHORT_CIRCUIT_MIN_SCORE,
+                 blocked_vpa: bool = SHORT_CIRCUIT_BLOCKED_VPA):
+        self.enabled = enabled
+        self.min_score = min_score
+        self.blocked_vpa = blocked_vpa
+
+    def decide(self, rule_based_result: dict, upi_result: dict, category_hint: str = "unknown", has_audio: bool = False):
+        """
+        Returns a final templated result, or None if the LLM should be consulted.
+        Audio inputs always go to the LLM because the response must carry a transcript.
+        """
+        if not self.enabled or has_audio:
+            return None
+
+        verification = (upi_result or {}).get("verification_result") or {}
+        if self.blocked_vpa and verification.get("status") == "BLOCKED":
+            vpa = upi_result.get("extracted_details", {}).get("pa")
+            return _local_result(
+                "SCAM", 100, "upi", [verification.get("message", "UPI ID reported for fraud.")],
+                BLOCKED_VPA_ADVICE, TIER_UPI_BLOCKLIST,
+                key_points=[f"Payee UPI ID: {vpa}"] if vpa else None,
+            )
+
+        if rule_based_result.get("risk_level") == "SCAM" and rule_based_result.get("score", 0) >= self.min_score:
+            reasons = rule_based_result.get("reasons", [])
+            category = _category_for(category_hint, reasons)
+            return _local_result(
+                "SCAM", min(rule_based_result["score"], 100), category, reasons,
+                ADVICE_TEMPLATES[category], TIER_RULES,
+            )
+        return None
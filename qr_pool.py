@@ -0,0 +1,269 @@
+"""
+Process pool for QR decoding.
+
+QReader inference holds the GIL for long stretches, so in the API server it
+runs in separate worker processes instead of on the request threads. Each
+worker loads OpenCV and the QReader model once, in its initializer.
+
+Images reach the workers through a fixed set of shared memory slots created
+when the pool starts: the caller copies the encoded bytes (or a raw frame)
+into a free slot and only the slot number crosses the process boundary.
+The slots double as the queue bound: with every slot in use a new request
+waits up to QR_POOL_QUEUE_TIMEOUT for one to free up, then fails with
+QRPoolBusy instead of queueing without limit.
+
+Without a started pool (QR_POOL_WORKERS=0, the CLI and tests) decoding runs
+in the calling process as before.
+"""
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from metrics import timed, gauge_callback
+
+QR_POOL_WORKERS = int(os.getenv("QR_POOL_WORKERS", "0"))
+# Images queued or decoding at once; each holds one shared memory slot
+QR_POOL_MAX_PENDING = int(os.getenv("QR_POOL_MAX_PENDING", "0")) or 4 * max(1, QR_POOL_WORKERS)
+QR_POOL_SLOT_BYTES = int(os.getenv("QR_POOL_SLOT_MB", "8")) * 1024 * 1024
+QR_POOL_QUEUE_TIMEOUT = float(os.getenv("QR_POOL_QUEUE_TIMEOUT", "10"))
+# fork is unsafe once the server has started threads and loaded torch
+QR_POOL_START_METHOD = os.getenv("QR_POOL_START_METHOD", "spawn")
+
+class QRPoolBusy(RuntimeError):
+    """
+    No slot became free within the queue timeout.
+    """
+
+# Worker process state
+_worker_slots = None
+_worker_qreader = True # False when QReader failed to load; only the fast stages run
+
+def _init_worker(slot_names: list):
+    global _worker_slots, _worker_qreader
+    # One decode per core; extra BLAS/OpenMP threads per worker only contend
+    os.environ.setdefault("OMP_NUM_THREADS", "1")
+    import cv2
+    cv2.setNumThreads(1)
+    _worker_slots = [shared_memory.SharedMemory(name=name) for name in slot_names]
+    import upi_guardian
+    upi_guardian._fast_detectors()
+    try:
+        upi_guardian.get_qreader()
+    except Exception as e:
+        # e.g. no zbar library; an exception here would break the whole pool
+        print(f"QR pool worker {os.getpid()}: QReader unavailable, decoding with OpenCV only: {e}")
+        _worker_qreader = False
+
+def _worker_ready() -> int:
+    return os.getpid()
+
+def _decode_in_worker(slot: int, payload, meta, fast_path: bool, fallback: bool = True):
+    """
+    Decodes one image and returns (data, stage).
+    payload is "encoded" or "frame" when the image is in the shared memory
+    slot (meta is the byte count or (shape, dtype)); otherwise it is the
+    image itself (a path, or bytes too large for a slot).
+    """
+    import numpy as np
+    import upi_guardian
+    buf = _worker_slots[slot].buf
+    try:
+        if payload == "encoded":
+            img = upi_guardian.load_image(buf[:meta])
+        elif payload == "frame":
+            shape, dtype = meta
+            # Copied out so no view of the slot outlives this call
+            img = np.ndarray(shape, dtype=dtype, buffer=buf).copy()
+        else:
+            img = upi_guardian.load_image(payload)
+        if img is None:
+            return None, "miss"
+        data, stage = upi_guardian.decode_qr_stages(img, fast_path or not _worker_qreader, fallback and _worker_qreader)
+        if stage is None and fallback:
+            stage = "miss" # QReader would have run but is unavailable
+        return data, stage
+    except Exception as e:
+        print(f"Error decoding QR: {e}")
+        return None, "miss"
+    finally:
+        del buf
+
+class QRDecodePool:
+    """
+    Pre-warmed worker processes that decode QR images passed through
+    shared memory slots, with a bounded number of images in flight.
+    """
+    def __init__(self, workers: int = QR_POOL_WORKERS, max_pending: int = QR_POOL_MAX_PENDING,
+                 slot_bytes: int = QR_POOL_SLOT_BYTES, queue_timeout: float = QR_POOL_QUEUE_TIMEOUT,
+                 start_method: str = QR_POOL_START_METHOD):
+        self.workers = max(1, workers)
+        self.slot_bytes = slot_bytes
+        self.queue_timeout = queue_timeout
+        self._context = multiprocessing.get_context(start_method)
+        self._slots = [shared_memory.SharedMemory(create=True, size=slot_bytes) for _ in range(max(1, max_pending))]
+        self._free = queue.Queue()
+        for index in range(len(self._slots)):
+            self._free.put(index)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    @property
+    def pending(self) -> int:
+        return len(self._slots) - self._free.qsize()
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=self._context, initializer=_init_worker,
+                                   initargs=([slot.name for slot in self._slots],))
+
+    def start(self, timeout: float = 300):
+        """
+        Starts every worker and waits until each has loaded its models.
+        """
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = self._new_executor()
+            executor = self._executor
+        # Each submit spawns a new worker until the pool is full
+        done, pending = wait([executor.submit(_worker_ready) for _ in range(self.workers)], timeout=timeout)
+        if pending:
+            raise TimeoutError(f"QR pool workers did not start within {timeout}s")
+        for future in done:
+            future.result()
+        return self
+
+    def _restart(self, broken: ProcessPoolExecutor):
+        # A worker died (e.g. killed for memory); replace the whole executor once
+        with self._executor_lock:
+            if self._executor is broken:
+                print("QR pool worker died, restarting the pool")
+                broken.shutdown(wait=False, cancel_futures=True)
+                self._executor = self._new_executor()
+
+    def _acquire_slot(self, timeout: float = None) -> int:
+        try:
+            return self._free.get(timeout=self.queue_timeout if timeout is None else timeout)
+        except queue.Empty:
+            raise QRPoolBusy("QR scanner is busy, try again shortly.")
+
+    def _fill_slot(self, slot: int, image):
+        """
+        Copies the image into the slot when it fits.
+        Returns the (payload, meta) arguments for the worker.
+        """
+        if isinstance(image, str):
+            return image, None # Workers read the file themselves
+        if hasattr(image, "__array_interface__"):
+            if image.nbytes <= self.slot_bytes:
+                import numpy as np
+                np.ndarray(image.shape, dtype=image.dtype, buffer=self._slots[slot].buf)[...] = image
+                return "frame", (image.shape, image.dtype.str)
+            # Encoded as PNG below so the oversized frame is not pickled raw
+            import cv2
+            ok, encoded = cv2.imencode(".png", image)
+            image = encoded.tobytes() if ok else b""
+        image = memoryview(image).cast("B")
+        if image.nbytes <= self.slot_bytes:
+            self._slots[slot].buf[:image.nbytes] = image
+            return "encoded", image.nbytes
+        return bytes(image), None
+
+    def submit(self, image, fast_path: bool = True, timeout: float = None, fallback: bool = True):
+        """
+        Queues one image (path, encoded bytes or BGR array) and returns a
+        Future of (data, stage). Blocks while every slot is in use and raises
+        QRPoolBusy if none frees up within the timeout.
+        """
+        if self._executor is None:
+            self.start()
+        slot = self._acquire_slot(timeout)
+        try:
+            payload, meta = self._fill_slot(slot, image)
+            executor = self._executor
+            try:
+                future = executor.submit(_decode_in_worker, slot, payload, meta, fast_path, fallback)
+            except BrokenProcessPool:
+                self._restart(executor)
+                future = self._executor.submit(_decode_in_worker, slot, payload, meta, fast_path, fallback)
+        except BaseException:
+            self._free.put(slot)
+            raise
+        future.add_done_callback(lambda _: self._free.put(slot))
+        return future
+
+    def _result(self, future):
+        try:
+            data, stage = future.result()
+        except BrokenProcessPool:
+            # The next submit replaces the executor
+            print("QR pool worker died while decoding")
+            data, stage = None, "miss"
+        import upi_guardian
+        upi_guardian._record_stage(stage)
+        return data
+
+    def decode(self, image, fast_path: bool = True, fallback: bool = True):
+        """
+        Decodes one image in a worker and returns the data, or None.
+        """
+        with timed("qr_pool"):
+            return self._result(self.submit(image, fast_path, fallback=fallback))
+
+    def decode_many(self, images, fast_path: bool = True) -> list:
+        """
+        Decodes a batch across all workers and returns results in input order.
+        Larger batches than the queue bound stream through it: each submit
+        waits for a free slot.
+        """
+        with timed("qr_pool_batch"):
+            futures = [self.submit(image, fast_path) for image in images]
+            return [self._result(future) for future in futures]
+
+    def shutdown(self):
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True, cancel_futures=True)
+                self._executor = None
+        for slot in self._slots:
+            slot.close()
+            slot.unlink()
+        self._slots = []
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """
+    Returns the started QR pool, or None when decoding runs in-process.
+    """
+    return _pool
+
+def start_pool(workers: int = QR_POOL_WORKERS):
+    """
+    Starts the shared QR pool (no-op when workers is 0 or it is already running).
+    """
+    global _pool
+    if workers <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            pool = QRDecodePool(workers=workers)
+            try:
+                pool.start()
+            except BaseException:
+                pool.shutdown()
+                raise
+            _pool = pool
+    return _pool
+
+def shutdown_pool():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown()
+
+gauge_callback("fsn_qr_pool_pending", "QR images queued or decoding in the process pool", [],
+               lambda: {(): _pool.pending if _pool is not None else 0})
@@ -0,0 +1,215 @@
+"""
+Compact VPA reputation store.
+
+Built offline into a single file that every worker memory-maps read-only,
+so the OS page cache holds one shared copy:
+
+    header | bloom filter bits | sorted uint64 VPA hashes | uint8 flags
+
+Usage:
+    python reputation.py build --blocked reported.txt --merchants merchants.txt --out data/vpa_reputation.bin
+    python reputation.py check --store data/vpa_reputation.bin scammer@upi shop@okicici
+"""
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import numpy as np
+
+MAGIC = b"VPAR"
+VERSION = 1
+# magic, version, entry count, bloom bit count, bloom hash count
+HEADER = struct.Struct("<4sIQQI4x")
+
+FLAG_BLOCKED = 1
+FLAG_MERCHANT = 2
+
+def normalize_vpa(vpa: str) -> str:
+    return vpa.strip().lower()
+
+def vpa_hash(vpa: str) -> int:
+    """
+    64-bit hash of a normalized VPA.
+    """
+    return int.from_bytes(hashlib.blake2b(normalize_vpa(vpa).encode("utf-8"), digest_size=8).digest(), "little")
+
+def _bloom_positions(hashes: np.ndarray, num_bits: int, num_hashes: int) -> np.ndarray:
+    """
+    Kirsch-Mitzenmacher double hashing; returns a (len(hashes), num_hashes) array of bit positions.
+    """
+    h1 = hashes & np.uint64(0xFFFFFFFF)
+    h2 = (hashes >> np.uint64(32)) | np.uint64(1)
+    steps = np.arange(num_hashes, dtype=np.uint64)
+    return (h1[:, None] + steps[None, :] * h2[:, None]) % np.uint64(num_bits)
+
+def _read_vpas(path: str):
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                yield line
+
+def build_reputation_store(out_path: str, blocked=(), merchants=(), bits_per_entry: int = 10, num_hashes: int = 7) -> int:
+    """
+    Writes a reputation store for the given blocked and verified-merchant VPAs.
+    The file is written next to out_path and atomically renamed into place, so
+    running servers pick it up on their next reload check.
+    Returns the number of distinct VPAs stored.
+    """
+    blocked_hashes = np.fromiter((vpa_hash(v) for v in blocked), dtype=np.uint64)
+    merchant_hashes = np.fromiter((vpa_hash(v) for v in merchants), dtype=np.uint64)
+    all_hashes = np.concatenate([blocked_hashes, merchant_hashes])
+    all_flags = np.concatenate([
+        np.full(len(blocked_hashes), FLAG_BLOCKED, dtype=np.uint8),
+        np.full(len(merchant_hashes), FLAG_MERCHANT, dtype=np.uint8),
+    ])
+
+    # Merge duplicates, OR-ing their flags
+    hashes, inverse = np.unique(all_hashes, return_inverse=True)
+    flags = np.zeros(len(hashes), dtype=np.uint8)
+    np.bitwise_or.at(flags, inverse, all_flags)
+
+    num_bits = max(64, len(hashes) * bits_per_entry)
+    num_bits += -num_bits % 64 # Keep the following arrays 8-byte aligned
+    bloom = np.zeros(num_bits // 8, dtype=np.uint8)
+    if len(hashes):
+        positions = _bloom_positions(hashes, num_bits, num_hashes).ravel()
+        np.bitwise_or.at(bloom, positions >> np.uint64(3), (1 << (positions & np.uint64(7))).astype(np.uint8))
+
+    out_dir = os.path.dirname(out_path)
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    tmp_path = f"{out_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(hashes), num_bits, num_hashes))
+        f.write(bloom.tobytes())
+        f.write(hashes.astype("<u8").tobytes())
+        f.write(flags.tobytes())
+    os.replace(tmp_path, out_path)
+    return len(hashes)
+
+class _Mapping:
+    """
+    One memory-mapped snapshot of a store file.
+    """
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self.stat = os.fstat(f.fileno())
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count, num_bits, num_hashes = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} VPA reputation store")
+        offset = HEADER.size
+        self.bloom = np.frombuffer(self.mm, dtype=np.uint8, count=num_bits // 8, offset=offset)
+        offset += num_bits // 8
+        self.hashes = np.frombuffer(self.mm, dtype="<u8", count=count, offset=offset)
+        offset += count * 8
+        self.flags = np.frombuffer(self.mm, dtype=np.uint8, count=count, offset=offset)
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+
+    def lookup(self, hashes: np.ndarray) -> np.ndarray:
+        """
+        Returns the flags for each hash (0 = not present).
+        """
+        result = np.zeros(len(hashes), dtype=np.uint8)
+        if not len(self.hashes) or not len(hashes):
+            return result
+
+        # Bloom filter rejects most unknown VPAs without touching the hash array
+        positions = _bloom_positions(hashes, self.num_bits, self.num_hashes)
+        bits = (self.bloom[positions >> np.uint64(3)] >> (positions & np.uint64(7)).astype(np.uint8)) & 1
+        candidates = np.flatnonzero(bits.all(axis=1))
+        if not len(candidates):
+            return result
+
+        index = np.searchsorted(self.hashes, hashes[candidates])
+        index = np.minimum(index, len(self.hashes) - 1)
+        found = self.hashes[index] == hashes[candidates]
+        result[candidates[found]] = self.flags[index[found]]
+        return result
+
+class ReputationStore:
+    """
+    Read-only view of a reputation store file that reloads itself when the
+    file is replaced, checking at most every reload_interval seconds.
+    """
+    def __init__(self, path: str, reload_interval: float = 30):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._mapping = _Mapping(path)
+        self._checked_at = time.monotonic()
+
+    def __len__(self):
+        return len(self._mapping.hashes)
+
+    def maybe_reload(self) -> bool:
+        now = time.monotonic()
+        if now - self._checked_at < self.reload_interval:
+            return False
+        with self._lock:
+            if now - self._checked_at < self.reload_interval:
+                return False
+            self._checked_at = now
+            try:
+                st = os.stat(self.path)
+            except OSError:
+                return False
+            current = self._mapping.stat
+            if (st.st_ino, st.st_mtime_ns, st.st_size) == (current.st_ino, current.st_mtime_ns, current.st_size):
+                return False
+            try:
+                # Old mapping stays valid for in-flight lookups until released
+                self._mapping = _Mapping(self.path)
+            except (OSError, ValueError) as e:
+                print(f"Reputation store reload failed: {e}")
+                return False
+            return True
+
+    def lookup_many(self, vpas) -> list:
+        """
+        Returns {"blocked": bool, "merchant": bool} for each VPA.
+        """
+        self.maybe_reload()
+        hashes = np.fromiter((vpa_hash(v) for v in vpas), dtype=np.uint64)
+        flags = self._mapping.lookup(hashes)
+        return [{"blocked": bool(f & FLAG_BLOCKED), "merchant": bool(f & FLAG_MERCHANT)} for f in flags]
+
+    def lookup(self, vpa: str) -> dict:
+        return self.lookup_many([vpa])[0]
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query a VPA reputation store")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    build = sub.add_parser("build", help="Build a store from text files (one VPA per line)")
+    build.add_argument("--blocked", type=str, help="File of reported VPAs")
+    build.add_argument("--merchants", type=str, help="File of verified merchant VPAs")
+    build.add_argument("--out", type=str, required=True, help="Output store path")
+    build.add_argument("--bits-per-entry", type=int, default=10, help="Bloom filter bits per VPA")
+
+    check = sub.add_parser("check", help="Look up VPAs in a store")
+    check.add_argument("--store", type=str, required=True, help="Store path")
+    check.add_argument("vpas", nargs="+", help="VPAs to look up")
+
+    args = parser.parse_args()
+    if args.command == "build":
+        count = build_reputation_store(
+            args.out,
+            blocked=_read_vpas(args.blocked) if args.blocked else (),
+            merchants=_read_vpas(args.merchants) if args.merchants else (),
+            bits_per_entry=args.bits_per_entry,
+        )
+        print(json.dumps({"store": args.out, "vpas": count, "bytes": os.path.getsize(args.out)}))
+    else:
+        store = ReputationStore(args.store)
+        for vpa, result in zip(args.vpas, store.lookup_many(args.vpas)):
+            print(json.dumps({"vpa": vpa, **result}))
+
+if __name__ == "__main__":
+    main()
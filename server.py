@@ -1,12 +1,164 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from typing import List
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Body, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from agent import FinancialSafetyNet
-import shutil
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from fastapi.routing import APIRoute
+from starlette.datastructures import UploadFile as StarletteUploadFile
+from starlette.formparsers import MultiPartParser, MultiPartException, parse_options_header
+from agent import FinancialSafetyNet, audio_mime_type
+from upi_guardian import verify_vpas, scan_and_verify_upi_batch
+from qr_pool import start_pool, shutdown_pool, QRPoolBusy, QR_POOL_WORKERS
+from spam_detector import check_spam_numbers, TranscriptSession
+from metrics import REQUEST_LATENCY, LIVE_CALL_UPDATES, timed
+import metrics
+import image_prep
+import asyncio
+from contextlib import asynccontextmanager
+import re
+import tempfile
+import time
 import os
 import json
+import io
 
-app = FastAPI()
+# Load the Gemini SDK, TTS and QR models at startup instead of on first use
+PRELOAD_MODELS = os.getenv("PRELOAD_MODELS", "0") == "1"
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if agent and PRELOAD_MODELS:
+        try:
+            await run_in_threadpool(agent.warm_up)
+        except Exception as e:
+            # Still serve; whatever failed loads (or fails) on first use instead
+            print(f"Model preload failed: {e}")
+    if QR_POOL_WORKERS > 0:
+        # Decode QR codes in worker processes that load their models up front
+        try:
+            await run_in_threadpool(start_pool)
+        except Exception as e:
+            print(f"QR pool failed to start, decoding in-process: {e}")
+    yield
+    shutdown_pool()
+
+# Uploads up to this size stay in memory; larger ones are spooled to a temp file
+UPLOAD_SPOOL_THRESHOLD = int(os.getenv("UPLOAD_SPOOL_THRESHOLD", str(16 * 1024 * 1024)))
+UPLOAD_DIR = "uploads"
+
+class UploadSpool:
+    """
+    Buffer for one uploaded file: in memory up to max_size, then a named
+    temp file in UPLOAD_DIR. The agent reads a spilled upload from that
+    path directly, so it is written to disk only once.
+    """
+    def __init__(self, max_size: int, suffix: str = ""):
+        self._max_size = max_size # UploadFile reads these two to pick sync or threadpool I/O
+        self._rolled = False
+        self._file = io.BytesIO()
+        self._suffix = suffix
+        self._detached = False
+        self.name = None
+
+    @property
+    def rolled(self) -> bool:
+        return self._rolled
+
+    def write(self, data: bytes) -> int:
+        if not self._rolled and self._file.tell() + len(data) > self._max_size:
+            os.makedirs(UPLOAD_DIR, exist_ok=True)
+            # Unique temp name, so concurrent uploads sharing a filename never collide
+            fd, self.name = tempfile.mkstemp(prefix="upload_", suffix=self._suffix, dir=UPLOAD_DIR)
+            spilled = os.fdopen(fd, "w+b")
+            spilled.write(self._file.getbuffer())
+            self._file = spilled
+            self._rolled = True
+        return self._file.write(data)
+
+    def read(self, size: int = -1) -> bytes:
+        return self._file.read(size)
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        return self._file.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self._file.tell()
+
+    def detach(self) -> str:
+        """
+        Returns the temp file path; removing it is now up to the caller.
+        """
+        self._file.flush()
+        self._detached = True
+        return self.name
+
+    def close(self):
+        self._file.close()
+        if self._rolled and not self._detached:
+            try:
+                os.remove(self.name)
+            except OSError:
+                pass
+
+class UploadParser(MultiPartParser):
+    """
+    Multipart parser that buffers files in UploadSpools sized by
+    UPLOAD_SPOOL_THRESHOLD; Starlette's own parser spills anything over 1 MB.
+    """
+    def on_headers_finished(self) -> None:
+        super().on_headers_finished()
+        part = self._current_part
+        if part.file is not None:
+            self._files_to_close_on_error.pop().close()
+            spool = UploadSpool(UPLOAD_SPOOL_THRESHOLD, os.path.splitext(part.file.filename or "")[1])
+            self._files_to_close_on_error.append(spool)
+            part.file = StarletteUploadFile(file=spool, size=0, filename=part.file.filename, headers=part.file.headers)
+
+class UploadRequest(Request):
+    async def _get_form(self, *, max_files=1000, max_fields=1000, max_part_size=1024 * 1024):
+        content_type, _ = parse_options_header(self.headers.get("Content-Type"))
+        if self._form is None and content_type == b"multipart/form-data":
+            parser = UploadParser(self.headers, self.stream(), max_files=max_files,
+                                  max_fields=max_fields, max_part_size=max_part_size)
+            try:
+                self._form = await parser.parse()
+            except MultiPartException as e:
+                raise HTTPException(status_code=400, detail=e.message)
+        return await super()._get_form(max_files=max_files, max_fields=max_fields, max_part_size=max_part_size)
+
+class UploadRoute(APIRoute):
+    """
+    Parses this app's form uploads with UploadParser, leaving Starlette's
+    defaults alone for anything else in the process.
+    """
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def upload_handler(request: Request):
+            return await handler(UploadRequest(request.scope, request.receive))
+        return upload_handler
+
+app = FastAPI(lifespan=lifespan)
+app.router.route_class = UploadRoute
+
+# Maximum number of /analyze requests processed at once by this worker;
+# further requests wait for a free slot instead of piling onto Gemini.
+MAX_CONCURRENT_ANALYSES = int(os.getenv("MAX_CONCURRENT_ANALYSES", "256"))
+analysis_slots = asyncio.Semaphore(MAX_CONCURRENT_ANALYSES)
+
+# Most QR images accepted by one /upi/scan-batch request
+UPI_SCAN_BATCH_MAX = int(os.getenv("UPI_SCAN_BATCH_MAX", "100"))
+
+# Live call sessions (/ws/call): per-worker cap, idle timeout and message limits
+LIVE_CALL_MAX_SESSIONS = int(os.getenv("LIVE_CALL_MAX_SESSIONS", "10000"))
+LIVE_CALL_IDLE_SEC = float(os.getenv("LIVE_CALL_IDLE_SEC", "300"))
+LIVE_CALL_MAX_FRAGMENT_CHARS = int(os.getenv("LIVE_CALL_MAX_FRAGMENT_CHARS", "4096"))
+LIVE_CALL_MAX_AUDIO_BYTES = int(os.getenv("LIVE_CALL_MAX_AUDIO_BYTES", str(1024 * 1024)))
+live_calls = set()
+metrics.gauge_callback("fsn_live_call_sessions", "Open live call sessions", [], lambda: {(): len(live_calls)})
+
+AUDIO_FILENAME_RE = re.compile(r"advice_[0-9a-f]{32}\.mp3")
 
 # Enable CORS for React Frontend
 app.add_middleware(
@@ -17,9 +169,18 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Mount static directory for audio files
-os.makedirs("static/audio", exist_ok=True)
-app.mount("/static", StaticFiles(directory="static"), name="static")
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        REQUEST_LATENCY.observe(time.perf_counter() - started, method=request.method,
+                                route=route.path if route else "unmatched", status=status)
 
 # Initialize Agent
 try:
@@ -28,6 +189,71 @@ except Exception as e:
     print(f"Failed to initialize agent: {e}")
     agent = None
 
+@app.get("/static/audio/{filename}")
+async def get_audio_advice(filename: str):
+    """
+    Serves advice audio, synthesizing it on first request if it is still pending.
+    Registered before the /static mount so it takes precedence.
+    """
+    if not AUDIO_FILENAME_RE.fullmatch(filename):
+        raise HTTPException(status_code=404, detail="Not Found")
+    if agent:
+        path = await run_in_threadpool(agent.audio_store.ensure, filename)
+    else:
+        path = os.path.join("static", "audio", filename)
+    if not path or not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Not Found")
+    return FileResponse(path, media_type="audio/mpeg")
+
+# Mount static directory for audio files
+os.makedirs("static/audio", exist_ok=True)
+app.mount("/static", StaticFiles(directory="static"), name="static")
+
+def _upload_kind(filename: str, category_hint: str):
+    """
+    Decides whether an upload is an image or audio, based on extension or type hint.
+    """
+    filename = (filename or "").lower()
+    if filename.endswith(('.png', '.jpg', '.jpeg', '.webp', '.pdf')):
+        return "image"
+    if filename.endswith(('.mp3', '.wav', '.m4a', '.ogg')):
+        return "audio"
+    if category_hint == "upi_qr": # Fallback if extension is missing but type is known
+        return "image"
+    return None
+
+async def read_upload(file: UploadFile):
+    """
+    Returns (data, file_path): the upload bytes when they fit under the spool
+    threshold, otherwise the path of the temp file UploadParser spilled them to.
+    """
+    spool = file.file
+    if isinstance(spool, UploadSpool) and spool.rolled:
+        return None, spool.detach()
+    return await file.read(), None
+
+async def read_media(file: UploadFile, category: str):
+    """
+    Returns (media, file_path): keyword arguments for the agent's analyze
+    methods, and the spooled temp file to remove afterwards (or None).
+    """
+    file_path = None
+    media = {}
+    if file:
+        kind = _upload_kind(file.filename, category)
+        if kind:
+            data, file_path = await read_upload(file)
+            if data is not None:
+                media[f"{kind}_bytes"] = data
+            else:
+                media[f"{kind}_path"] = file_path
+            if kind == "audio":
+                media["audio_mime_type"] = audio_mime_type(file.filename)
+    return media, file_path
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
 @app.post("/analyze")
 async def analyze(
     text: str = Form(None),
@@ -37,38 +263,181 @@ async def analyze(
     if not agent:
         raise HTTPException(status_code=500, detail="Agent not initialized. Check API Key.")
 
-    file_path = None
-    image_path = None
-    audio_path = None
-
-    if file:
-        # Save uploaded file temporarily
-        upload_dir = "uploads"
-        os.makedirs(upload_dir, exist_ok=True)
-        file_path = os.path.join(upload_dir, file.filename)
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        # Determine if it's image or audio based on extension or type hint
-        if file.filename.lower().endswith(('.png', '.jpg', '.jpeg', '.webp')):
-            image_path = file_path
-        elif file.filename.lower().endswith(('.mp3', '.wav', '.m4a', '.ogg')):
-            audio_path = file_path
-        elif type == "upi_qr": # Fallback if extension is missing but type is known
-            image_path = file_path
+    media, file_path = await read_media(file, type)
 
     try:
-        result = agent.analyze(text_input=text, image_path=image_path, audio_path=audio_path, category_hint=type)
-        
-        # Cleanup uploaded file
-        if file_path and os.path.exists(file_path):
-            os.remove(file_path)
-            
+        async with analysis_slots:
+            result = await agent.analyze_async(text_input=text, category_hint=type, **media)
         return result
     except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        # Cleanup spooled upload
         if file_path and os.path.exists(file_path):
             os.remove(file_path)
-        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/analyze/stream")
+async def analyze_stream(
+    text: str = Form(None),
+    type: str = Form("unknown"),
+    file: UploadFile = File(None)
+):
+    """
+    Server-sent events variant of /analyze: a "local" verdict first, then
+    "partial" Gemini output, the final "result" and the "audio" advice URL.
+    """
+    if not agent:
+        raise HTTPException(status_code=500, detail="Agent not initialized. Check API Key.")
+
+    media, file_path = await read_media(file, type)
+
+    async def events():
+        try:
+            async with analysis_slots:
+                async for event, data in agent.analyze_stream(text_input=text, category_hint=type, **media):
+                    yield _sse(event, data)
+        except Exception as e:
+            yield _sse("error", {"error": str(e)})
+        finally:
+            # Cleanup spooled upload once the stream is done
+            if file_path and os.path.exists(file_path):
+                os.remove(file_path)
+        yield _sse("done", {})
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+async def _live_call_fragment(websocket: WebSocket, session: TranscriptSession, text: str):
+    """
+    Feeds one transcript fragment and pushes an update if the risk changed.
+    """
+    with timed("live_call_feed"):
+        changed = session.feed(text)
+    if changed:
+        LIVE_CALL_UPDATES.inc(risk_level=session.risk_level)
+        await websocket.send_json({"event": "update", **session.result()})
+
+@app.websocket("/ws/call")
+async def live_call(websocket: WebSocket, mime_type: str = "audio/webm"):
+    """
+    Analyzes a call while it is happening. The client sends transcript
+    fragments as {"text": "..."} and/or short self-contained audio clips as
+    binary frames (transcribed with Gemini), then {"type": "end"}.
+    The server pushes an "update" as soon as the risk score changes and a
+    "result" at the end.
+    """
+    if len(live_calls) >= LIVE_CALL_MAX_SESSIONS:
+        await websocket.close(code=1013) # Try again later
+        return
+    await websocket.accept()
+    session = TranscriptSession()
+    live_calls.add(session)
+    try:
+        while True:
+            try:
+                async with asyncio.timeout(LIVE_CALL_IDLE_SEC):
+                    message = await websocket.receive()
+            except TimeoutError:
+                await websocket.close(code=1000, reason="Idle timeout")
+                return
+            if message["type"] == "websocket.disconnect":
+                return
+
+            if message.get("bytes") is not None:
+                audio = message["bytes"]
+                if not agent:
+                    await websocket.send_json({"event": "error", "error": "Agent not initialized. Check API Key."})
+                elif len(audio) > LIVE_CALL_MAX_AUDIO_BYTES:
+                    await websocket.send_json({"event": "error", "error": f"Audio clip exceeds {LIVE_CALL_MAX_AUDIO_BYTES} bytes"})
+                else:
+                    try:
+                        transcript = await agent.transcribe_async(audio, mime_type)
+                    except Exception as e:
+                        await websocket.send_json({"event": "error", "error": str(e)})
+                        continue
+                    await websocket.send_json({"event": "transcript", "text": transcript})
+                    await _live_call_fragment(websocket, session, transcript)
+                continue
+
+            try:
+                payload = json.loads(message.get("text") or "")
+            except ValueError:
+                payload = None
+            if not isinstance(payload, dict):
+                await websocket.send_json({"event": "error", "error": "Expected {\"text\": \"...\"} or {\"type\": \"end\"}"})
+                continue
+            if payload.get("type") == "end":
+                await websocket.send_json({"event": "result", **session.result()})
+                await websocket.close()
+                return
+            text = payload.get("text")
+            if not isinstance(text, str):
+                await websocket.send_json({"event": "error", "error": "Expected {\"text\": \"...\"}"})
+            elif len(text) > LIVE_CALL_MAX_FRAGMENT_CHARS:
+                await websocket.send_json({"event": "error", "error": f"Fragment exceeds {LIVE_CALL_MAX_FRAGMENT_CHARS} characters"})
+            else:
+                await _live_call_fragment(websocket, session, text)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        live_calls.discard(session)
+
+@app.post("/upi/verify-batch")
+async def verify_upi_batch(payload: dict = Body(...)):
+    """
+    Verifies a list of VPAs: {"vpas": ["a@upi", ...]}.
+    """
+    vpas = payload.get("vpas")
+    if not isinstance(vpas, list) or not all(isinstance(v, str) for v in vpas):
+        raise HTTPException(status_code=422, detail="Expected {\"vpas\": [\"...\"]}")
+    results = await run_in_threadpool(verify_vpas, vpas)
+    return {"results": [{"vpa": vpa, **result} for vpa, result in zip(vpas, results)]}
+
+@app.post("/upi/scan-batch")
+async def scan_upi_batch(files: List[UploadFile] = File(...)):
+    """
+    Scans and verifies many UPI QR images at once, e.g. a merchant onboarding
+    upload. Results are in upload order.
+    """
+    if len(files) > UPI_SCAN_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"At most {UPI_SCAN_BATCH_MAX} images per batch")
+    images = [await file.read() for file in files]
+    try:
+        results = await run_in_threadpool(scan_and_verify_upi_batch, images)
+    except QRPoolBusy as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {"results": [{"filename": file.filename, **result} for file, result in zip(files, results)]}
+
+@app.post("/spam/check-numbers")
+async def check_numbers(payload: dict = Body(...)):
+    """
+    Bulk spam lookup: {"numbers": ["+919876543210", ...]}.
+    """
+    numbers = payload.get("numbers")
+    if not isinstance(numbers, list) or not all(isinstance(n, str) for n in numbers):
+        raise HTTPException(status_code=422, detail="Expected {\"numbers\": [\"...\"]}")
+    results = await run_in_threadpool(check_spam_numbers, numbers)
+    return {"results": [{"number": number, **result} for number, result in zip(numbers, results)]}
+
+@app.get("/cache/stats")
+def cache_stats():
+    if not agent:
+        raise HTTPException(status_code=500, detail="Agent not initialized. Check API Key.")
+    return agent.response_cache.stats()
+
+@app.get("/pipeline/stats")
+def pipeline_stats():
+    if not agent:
+        raise HTTPException(status_code=500, detail="Agent not initialized. Check API Key.")
+    # agent._gemini, not agent.gemini: a stats probe must not import the SDK and build the client
+    gemini = agent._gemini
+    return {"tiers": dict(agent.tier_counts), "gemini": dict(gemini.stats) if gemini is not None else {},
+            "image_prep": image_prep.cache_stats(),
+            "models": agent.router.stats(), "context_cache": agent.context_cache.stats()}
+
+@app.get("/metrics")
+def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 @app.get("/")
 def read_root():
@@ -1,4 +1,8 @@
+import os
 import random
+import threading
+from matcher import RuleEngine
+from spam_store import SpamNumberStore, normalize_phone_number
 
 # Mock Spam Database
 SPAM_DB = {
@@ -6,52 +10,144 @@ SPAM_DB = {
     "9988776655": {"risk": "SUSPICIOUS", "reports": 120, "tag": "Telemarketer"},
     "1234567890": {"risk": "SAFE", "reports": 0, "tag": "Verified Business"},
 }
+# Same entries keyed by normalized E.164 number
+_SPAM_DB_E164 = {normalize_phone_number(number): record for number, record in SPAM_DB.items()}
+
+# Offline-built store of reported numbers (see spam_store.py)
+SPAM_STORE_PATH = os.getenv("SPAM_STORE_PATH")
+SPAM_STORE_RELOAD_SEC = float(os.getenv("SPAM_STORE_RELOAD_SEC", "30"))
+
+UNKNOWN_NUMBER = {"risk": "UNKNOWN", "reports": 0, "tag": "Unknown Number"}
+
+# Call transcript rules, in the rule table format of tools.py
+TRANSCRIPT_RULES = [
+    {
+        "category": "call",
+        "all_of": [["otp"], ["share"]],
+        "score": 90,
+        "reason": "Caller asked for OTP sharing",
+    },
+    {
+        "category": "call",
+        "all_of": [["police", "cbi"]],
+        "score": 80,
+        "reason": "Impersonating Law Enforcement (Digital Arrest Scam)",
+    },
+    {
+        "category": "call",
+        "all_of": [["refund"], ["click"]],
+        "score": 70,
+        "reason": "Refund scam pattern detected",
+    },
+]
+transcript_engine = RuleEngine(TRANSCRIPT_RULES, {"call": None})
+
+_spam_store = None
+_spam_store_lock = threading.Lock()
+
+def get_spam_store():
+    """
+    Opens the memory-mapped spam number store configured by SPAM_STORE_PATH.
+    Returns None when no store is configured.
+    """
+    global _spam_store
+    if _spam_store is None and SPAM_STORE_PATH and os.path.exists(SPAM_STORE_PATH):
+        with _spam_store_lock:
+            if _spam_store is None:
+                _spam_store = SpamNumberStore(SPAM_STORE_PATH, reload_interval=SPAM_STORE_RELOAD_SEC)
+    return _spam_store
+
+def check_spam_numbers(phone_numbers: list) -> list:
+    """
+    Checks many phone numbers at once with a single vectorized store lookup.
+    """
+    normalized = [normalize_phone_number(n) for n in phone_numbers]
+    store = get_spam_store()
+    found = store.lookup_many(normalized) if store else [None] * len(normalized)
+    results = []
+    for number, record in zip(normalized, found):
+        if record is None:
+            record = _SPAM_DB_E164.get(number)
+        # In a real app, unknown numbers would query a live API like Truecaller
+        results.append(dict(record) if record else dict(UNKNOWN_NUMBER))
+    return results
 
 def check_spam_number(phone_number: str) -> dict:
     """
-    Checks a phone number against the mock spam database.
+    Checks a phone number against the spam database.
     """
-    # Clean number
-    phone_number = phone_number.replace("+91", "").strip()
-    
-    if phone_number in SPAM_DB:
-        return SPAM_DB[phone_number]
-    
-    # Simulate random unknown number check
-    # In a real app, this would query a live API like Truecaller
-    return {"risk": "UNKNOWN", "reports": 0, "tag": "Unknown Number"}
+    return check_spam_numbers([phone_number])[0]
+
+def transcript_risk_level(score: int) -> str:
+    if score >= 80:
+        return "SCAM"
+    elif score >= 50:
+        return "SUSPICIOUS"
+    return "SAFE"
 
 def analyze_call_transcript(transcript: str, gemini_client=None) -> dict:
     """
     Analyzes a call transcript for scam patterns.
     Uses Gemini if client is provided, otherwise simple keywords.
     """
-    risk_score = 0
-    reasons = []
-    
-    transcript_lower = transcript.lower()
-    
-    if "otp" in transcript_lower and "share" in transcript_lower:
-        risk_score += 90
-        reasons.append("Caller asked for OTP sharing")
-        
-    if "police" in transcript_lower or "cbi" in transcript_lower:
-        risk_score += 80
-        reasons.append("Impersonating Law Enforcement (Digital Arrest Scam)")
-        
-    if "refund" in transcript_lower and "click" in transcript_lower:
-        risk_score += 70
-        reasons.append("Refund scam pattern detected")
-
-    if risk_score >= 80:
-        risk_level = "SCAM"
-    elif risk_score >= 50:
-        risk_level = "SUSPICIOUS"
-    else:
-        risk_level = "SAFE"
-        
+    risk_score, reasons = transcript_engine.match(transcript.lower())
+
     return {
-        "risk_level": risk_level,
+        "risk_level": transcript_risk_level(risk_score),
         "score": risk_score,
         "reasons": reasons
     }
+
+class TranscriptSession:
+    """
+    Incremental analysis of a call transcript that arrives in fragments.
+    Only the automaton state and the terms seen so far are kept, so each
+    fragment costs its own length and a phrase split across fragments
+    ("share" ... "OTP") is still caught.
+    """
+    __slots__ = ("state", "found", "score", "reasons", "chars", "_last_char")
+
+    def __init__(self):
+        self.state = 0
+        self.found = set()
+        self.score = 0
+        self.reasons = []
+        self.chars = 0
+        self._last_char = " "
+
+    @property
+    def risk_level(self) -> str:
+        return transcript_risk_level(self.score)
+
+    def feed(self, fragment: str) -> bool:
+        """
+        Adds the next fragment of the transcript.
+        Returns True if the score changed.
+        """
+        if not fragment:
+            return False
+        fragment = fragment.lower()
+        # Keep words of consecutive fragments apart unless the caller already did
+        if not self._last_char.isspace() and not fragment[0].isspace():
+            fragment = " " + fragment
+        self._last_char = fragment[-1]
+        self.chars += len(fragment)
+
+        seen = len(self.found)
+        self.state, self.found = transcript_engine.automaton.feed(fragment, self.state, self.found)
+        if len(self.found) == seen:
+            return False
+        # The transcript rules have no regex patterns, so the text itself is not needed
+        score, reasons = transcript_engine.evaluate("", self.found, "call")
+        if score == self.score:
+            return False
+        self.score = score
+        self.reasons = reasons
+        return True
+
+    def result(self) -> dict:
+        return {
+            "risk_level": self.risk_level,
+            "score": self.score,
+            "reasons": list(self.reasons),
+        }
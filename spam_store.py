@@ -0,0 +1,217 @@
+"""
+Compact spam number store.
+
+Numbers are normalized to E.164 and packed as a sorted int64 column with
+parallel risk, report count and tag id columns in one file that workers
+memory-map read-only:
+
+    header | tag table (JSON) | int64 numbers | uint32 reports | uint32 tag ids | uint8 risk
+
+Usage:
+    python spam_store.py build --csv reported_numbers.csv --out data/spam_numbers.bin
+    python spam_store.py check --store data/spam_numbers.bin +919876543210 09988776655
+
+The CSV needs the columns number, risk, reports, tag.
+"""
+import argparse
+import csv
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+
+MAGIC = b"SPAM"
+VERSION = 1
+# magic, version, entry count, tag table length
+HEADER = struct.Struct("<4sIQQ")
+
+RISK_LEVELS = ["UNKNOWN", "SAFE", "SUSPICIOUS", "SCAM"]
+DEFAULT_COUNTRY_CODE = "91"
+
+def normalize_phone_number(phone_number: str, country_code: str = DEFAULT_COUNTRY_CODE):
+    """
+    Normalizes a phone number to its E.164 digits as an integer
+    (e.g. "+91 98765-43210", "098765 43210" and "9876543210" all give 919876543210).
+    Returns None if it cannot be a valid number.
+    """
+    raw = phone_number.strip()
+    digits = "".join(ch for ch in raw if ch.isdigit())
+    if raw.startswith("+"):
+        pass
+    elif digits.startswith("00"):
+        digits = digits[2:]
+    elif len(digits) == 11 and digits.startswith("0"):
+        digits = country_code + digits[1:] # Domestic trunk prefix
+    elif len(digits) == 10:
+        digits = country_code + digits
+    if not 8 <= len(digits) <= 15:
+        return None
+    return int(digits)
+
+def format_e164(number: int) -> str:
+    return f"+{number}"
+
+def build_spam_store(out_path: str, records) -> int:
+    """
+    Writes a store from (phone_number, risk, reports, tag) records.
+    Invalid numbers are skipped; for duplicates the last record wins.
+    The file is atomically renamed into place so running workers reload it.
+    Returns the number of distinct numbers stored.
+    """
+    import numpy as np
+    numbers = array("q")
+    risks = array("B")
+    reports = array("I")
+    tag_ids = array("I")
+    tags = {}
+    for phone_number, risk, report_count, tag in records:
+        number = normalize_phone_number(str(phone_number))
+        if number is None:
+            continue
+        numbers.append(number)
+        risks.append(RISK_LEVELS.index(risk) if risk in RISK_LEVELS else 0)
+        reports.append(int(report_count))
+        tag_ids.append(tags.setdefault(tag, len(tags)))
+
+    numbers = np.frombuffer(numbers, dtype=np.int64)
+    # Keep the last record per number: stable sort, then take each run's final entry
+    order = np.argsort(numbers, kind="stable")
+    sorted_numbers = numbers[order]
+    last = np.ones(len(sorted_numbers), dtype=bool)
+    last[:-1] = sorted_numbers[1:] != sorted_numbers[:-1]
+    order = order[last]
+
+    tag_table = json.dumps(list(tags)).encode("utf-8")
+    tag_table += b" " * (-len(tag_table) % 8) # Keep the columns 8-byte aligned
+
+    out_dir = os.path.dirname(out_path)
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    tmp_path = f"{out_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(order), len(tag_table)))
+        f.write(tag_table)
+        f.write(numbers[order].astype("<i8").tobytes())
+        f.write(np.frombuffer(reports, dtype=np.uint32)[order].astype("<u4").tobytes())
+        f.write(np.frombuffer(tag_ids, dtype=np.uint32)[order].astype("<u4").tobytes())
+        f.write(np.frombuffer(risks, dtype=np.uint8)[order].tobytes())
+    os.replace(tmp_path, out_path)
+    return len(order)
+
+def _read_csv(path: str):
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        for row in csv.DictReader(f):
+            yield row["number"], row["risk"], row.get("reports") or 0, row.get("tag") or ""
+
+class _Mapping:
+    """
+    One memory-mapped snapshot of a store file.
+    """
+    def __init__(self, path: str):
+        import numpy as np # Deferred so number normalization alone stays cheap to import
+        with open(path, "rb") as f:
+            self.stat = os.fstat(f.fileno())
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count, tag_len = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} spam number store")
+        offset = HEADER.size
+        self.tags = json.loads(self.mm[offset:offset + tag_len].decode("utf-8"))
+        offset += tag_len
+        self.numbers = np.frombuffer(self.mm, dtype="<i8", count=count, offset=offset)
+        offset += count * 8
+        self.reports = np.frombuffer(self.mm, dtype="<u4", count=count, offset=offset)
+        offset += count * 4
+        self.tag_ids = np.frombuffer(self.mm, dtype="<u4", count=count, offset=offset)
+        offset += count * 4
+        self.risks = np.frombuffer(self.mm, dtype=np.uint8, count=count, offset=offset)
+
+class SpamNumberStore:
+    """
+    Read-only view of a spam number store file that reloads itself when the
+    file is replaced, checking at most every reload_interval seconds.
+    """
+    def __init__(self, path: str, reload_interval: float = 30):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._mapping = _Mapping(path)
+        self._checked_at = time.monotonic()
+
+    def __len__(self):
+        return len(self._mapping.numbers)
+
+    def maybe_reload(self) -> bool:
+        now = time.monotonic()
+        if now - self._checked_at < self.reload_interval:
+            return False
+        with self._lock:
+            if now - self._checked_at < self.reload_interval:
+                return False
+            self._checked_at = now
+            try:
+                st = os.stat(self.path)
+            except OSError:
+                return False
+            current = self._mapping.stat
+            if (st.st_ino, st.st_mtime_ns, st.st_size) == (current.st_ino, current.st_mtime_ns, current.st_size):
+                return False
+            try:
+                self._mapping = _Mapping(self.path)
+            except (OSError, ValueError) as e:
+                print(f"Spam number store reload failed: {e}")
+                return False
+            return True
+
+    def lookup_many(self, numbers) -> list:
+        """
+        Looks up normalized numbers (ints, None for invalid) with one vectorized
+        binary search. Returns a record dict per number, or None if not listed.
+        """
+        import numpy as np
+        self.maybe_reload()
+        mapping = self._mapping
+        results = [None] * len(numbers)
+        valid = [i for i, number in enumerate(numbers) if number is not None]
+        if not valid or not len(mapping.numbers):
+            return results
+
+        queries = np.array([numbers[i] for i in valid], dtype=np.int64)
+        index = np.minimum(np.searchsorted(mapping.numbers, queries), len(mapping.numbers) - 1)
+        found = mapping.numbers[index] == queries
+        for i, position, hit in zip(valid, index.tolist(), found.tolist()):
+            if hit:
+                results[i] = {
+                    "risk": RISK_LEVELS[mapping.risks[position]],
+                    "reports": int(mapping.reports[position]),
+                    "tag": mapping.tags[mapping.tag_ids[position]],
+                }
+        return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query a spam number store")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    build = sub.add_parser("build", help="Build a store from a CSV feed (number,risk,reports,tag)")
+    build.add_argument("--csv", type=str, required=True, help="CSV feed of reported numbers")
+    build.add_argument("--out", type=str, required=True, help="Output store path")
+
+    check = sub.add_parser("check", help="Look up numbers in a store")
+    check.add_argument("--store", type=str, required=True, help="Store path")
+    check.add_argument("numbers", nargs="+", help="Phone numbers to look up")
+
+    args = parser.parse_args()
+    if args.command == "build":
+        count = build_spam_store(args.out, _read_csv(args.csv))
+        print(json.dumps({"store": args.out, "numbers": count, "bytes": os.path.getsize(args.out)}))
+    else:
+        store = SpamNumberStore(args.store)
+        normalized = [normalize_phone_number(n) for n in args.numbers]
+        for number, result in zip(args.numbers, store.lookup_many(normalized)):
+            print(json.dumps({"number": number, "result": result}))
+
+if __name__ == "__main__":
+    main()
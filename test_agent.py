@@ -1,7 +1,49 @@
+import os
+import sys
+import json
+import subprocess
 import unittest
+import tempfile
+import threading
+import time
+import asyncio
 from tools import rule_based_risk_analyzer
-from spam_detector import check_spam_number, analyze_call_transcript
-from upi_guardian import parse_upi_string, verify_vpa_mock_api
+from matcher import KeywordAutomaton
+from batch import batch_analyze
+from cache import ResponseCache, make_cache_key
+from audio_store import AudioStore, SilentBackend
+from policy import DecisionPolicy
+from audio_pipeline import chunk_windows, merge_chunk_results
+from reputation import ReputationStore, build_reputation_store
+from fake_gemini import FakeGeminiServer
+from gemini_client import GeminiClient, DeadlineExceeded
+from model_router import ModelRouter
+from context_cache import ContextCache
+import httpx
+from google import genai
+from google.genai import types
+from spam_detector import check_spam_number, check_spam_numbers, analyze_call_transcript, TranscriptSession
+from spam_store import SpamNumberStore, build_spam_store, normalize_phone_number
+from metrics import Histogram, render, STAGE_LATENCY
+from qr_pool import QRDecodePool, QRPoolBusy
+from image_prep import prepare_image
+import phash_index
+from phash_index import PerceptualIndex, image_dhash, hamming
+from upi_guardian import parse_upi_string, verify_vpa_mock_api, decode_qr_code, qr_stage_stats, scan_and_verify_upi
+import cv2
+import numpy as np
+
+def template_poster(payload: str) -> bytes:
+    """
+    A "scan & pay" standee with the QR code at 30% of the width.
+    """
+    poster = np.full((1200, 900, 3), 255, dtype=np.uint8)
+    cv2.rectangle(poster, (0, 0), (900, 260), (40, 90, 200), -1)
+    cv2.putText(poster, "SCAN & PAY", (120, 170), cv2.FONT_HERSHEY_DUPLEX, 3, (255, 255, 255), 6)
+    cv2.rectangle(poster, (0, 1000), (900, 1200), (30, 160, 60), -1)
+    code = cv2.resize(cv2.QRCodeEncoder.create().encode(payload), (270, 270), interpolation=cv2.INTER_NEAREST)
+    poster[500:770, 315:585] = cv2.cvtColor(code, cv2.COLOR_GRAY2BGR)
+    return cv2.imencode(".png", poster)[1].tobytes()
 
 class TestFinancialSafetyNet(unittest.TestCase):
 
@@ -17,26 +59,626 @@ class TestFinancialSafetyNet(unittest.TestCase):
         self.assertEqual(result["risk_level"], "SCAM")
         self.assertIn("Demands advance processing fee (Illegal/Scam)", result["reasons"])
 
+    def test_rule_engine_single_pass(self):
+        automaton = KeywordAutomaton(["pin", "shopping", "ping", "pan card"])
+        self.assertEqual(automaton.scan("shopping with pan cards"), {"pin", "ping", "shopping", "pan card"})
+        result = rule_based_risk_analyzer("Loan at 36% interest, no documents needed. Share your OTP.", "unknown")
+        self.assertEqual(result["score"], 100)
+        self.assertEqual(result["reasons"], [
+            "Very high interest rate detected: 36%",
+            "Too good to be true (No CIBIL/Docs check)",
+            "Requests sharing of sensitive document/info: OTP (High Privacy Risk)",
+        ])
+
     def test_spam_number_check(self):
         result = check_spam_number("9876543210")
         self.assertEqual(result["risk"], "SCAM")
         self.assertEqual(result["tag"], "Fake Loan Agent")
 
+    def test_spam_number_normalization(self):
+        self.assertEqual(normalize_phone_number("+91 98765-43210"), 919876543210)
+        self.assertEqual(normalize_phone_number("098765 43210"), 919876543210)
+        self.assertIsNone(normalize_phone_number("12345"))
+        self.assertEqual([r["risk"] for r in check_spam_numbers(["+919876543210", "9988776655", "9000000000"])],
+                         ["SCAM", "SUSPICIOUS", "UNKNOWN"])
+
+    def test_spam_store_bulk_lookup(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "spam.bin")
+            build_spam_store(path, [
+                ("+91 90000 00001", "SCAM", 40, "KYC Fraud"),
+                ("9000000002", "SUSPICIOUS", 3, "Telemarketer"),
+                ("09000000001", "SCAM", 41, "KYC Fraud"),
+            ])
+            store = SpamNumberStore(path)
+            self.assertEqual(len(store), 2)
+            results = store.lookup_many([919000000001, None, 919000000003, 919000000002])
+            self.assertEqual(results[0], {"risk": "SCAM", "reports": 41, "tag": "KYC Fraud"})
+            self.assertIsNone(results[1])
+            self.assertIsNone(results[2])
+            self.assertEqual(results[3]["tag"], "Telemarketer")
+
     def test_spam_transcript(self):
         text = "I am calling from CBI police station. You are under digital arrest."
         result = analyze_call_transcript(text)
         self.assertEqual(result["risk_level"], "SCAM")
         self.assertIn("Impersonating Law Enforcement (Digital Arrest Scam)", result["reasons"])
 
+    def test_transcript_session_matches_across_fragments(self):
+        fragments = ["Hello sir, I am calling from your bank. Please share", "the", "OTP you just received"]
+        session = TranscriptSession()
+        changes = [session.feed(fragment) for fragment in fragments]
+        self.assertEqual(changes, [False, False, True])
+        self.assertEqual(session.result(), analyze_call_transcript(" ".join(fragments)))
+        self.assertEqual(session.risk_level, "SCAM")
+        # Separate fragments are not glued into one word
+        session = TranscriptSession()
+        session.feed("please click")
+        session.feed("refund")
+        self.assertEqual(session.score, 70)
+        session = TranscriptSession()
+        session.feed("re")
+        session.feed("fund")
+        self.assertEqual(session.score, 0)
+
+    def test_batch_analyze_preserves_order(self):
+        texts = ["hello", "I am calling from CBI police station.", "Share the OTP with me"]
+        results = list(batch_analyze(texts, analyzer="transcript", workers=1, chunksize=2))
+        self.assertEqual([r["id"] for r in results], [0, 1, 2])
+        self.assertEqual([r["risk_level"] for r in results], ["SAFE", "SCAM", "SCAM"])
+
+    def test_response_cache_tiers(self):
+        key = make_cache_key("Your KYC  will EXPIRE today", "unknown")
+        self.assertEqual(key, make_cache_key("your kyc will expire today", "unknown"))
+        self.assertNotEqual(key, make_cache_key("your kyc will expire today", "upi"))
+
+        with tempfile.TemporaryDirectory() as disk_dir:
+            cache = ResponseCache(max_entries=1, ttl=60, disk_dir=disk_dir)
+            self.assertIsNone(cache.get(key))
+            cache.set(key, {"risk_level": "SCAM"})
+            self.assertEqual(cache.get(key), {"risk_level": "SCAM"})
+
+            restarted = ResponseCache(max_entries=1, ttl=60, disk_dir=disk_dir)
+            self.assertEqual(restarted.get(key), {"risk_level": "SCAM"})
+            self.assertEqual(restarted.stats()["disk_hits"], 1)
+
+            # Size 0 turns off the disk tier too
+            disabled = ResponseCache(max_entries=0, ttl=60, disk_dir=disk_dir)
+            self.assertIsNone(disabled.get(key))
+        self.assertEqual(cache.stats()["misses"], 1)
+
+    def test_response_cache_disk_tier_is_swept_and_keeps_its_expiry(self):
+        keys = [make_cache_key(f"message {i}") for i in range(4)]
+        with tempfile.TemporaryDirectory() as disk_dir:
+            cache = ResponseCache(max_entries=8, ttl=60, disk_dir=disk_dir, disk_max_entries=2)
+            for i, key in enumerate(keys):
+                cache.set(key, {"score": i})
+                aged = time.time() - 50 + i
+                os.utime(cache._disk_path(key), (aged, aged))
+            os.utime(cache._disk_path(keys[0]), (time.time() - 120, time.time() - 120)) # Expired
+
+            # Expired files go first, then the oldest beyond disk_max_entries
+            self.assertEqual(cache.sweep_disk(), 2)
+            self.assertEqual([os.path.exists(cache._disk_path(key)) for key in keys], [False, False, True, True])
+
+            # A disk hit keeps the remaining ~13s of its TTL in memory, not a fresh 60s
+            restarted = ResponseCache(max_entries=8, ttl=60, disk_dir=disk_dir, disk_max_entries=2)
+            self.assertEqual(restarted.get(keys[3]), {"score": 3})
+            expires_at = restarted.memory._entries[keys[3]][1]
+            self.assertLess(expires_at - time.monotonic(), 15)
+
+    def test_audio_store_dedup_and_eviction(self):
+        with tempfile.TemporaryDirectory() as audio_dir:
+            store = AudioStore(directory=audio_dir, backend=SilentBackend(), max_bytes=1000)
+            first = store.get_or_create("Never share your OTP.")
+            self.assertEqual(first, store.get_or_create("Never share your OTP."))
+            second = store.get_or_create("Do not pay advance fees.")
+            self.assertNotEqual(first, second)
+            self.assertEqual(len(os.listdir(audio_dir)), 2)
+
+            store.max_bytes = 500
+            self.assertEqual(store.evict(), 1)
+            self.assertEqual(len(os.listdir(audio_dir)), 1)
+
+    def test_audio_store_evicts_least_recently_served(self):
+        with tempfile.TemporaryDirectory() as audio_dir:
+            store = AudioStore(directory=audio_dir, backend=SilentBackend(), max_bytes=1000)
+            old = store.get_or_create("Never share your OTP.")
+            new = store.get_or_create("Do not pay advance fees.")
+            os.utime(store.path_for(old), (time.time() - 3600, time.time() - 3600))
+            os.utime(store.path_for(new), (time.time() - 60, time.time() - 60))
+
+            # Serving and re-scheduling the old clip both count as use
+            store.ensure(old)
+            self.assertEqual(store.schedule("Never share your OTP."), old)
+            store.max_bytes = 500
+            self.assertEqual(store.evict(), 1)
+            self.assertEqual(os.listdir(audio_dir), [old])
+
+    def test_audio_store_lazy_synthesis_is_deduplicated(self):
+        calls = []
+
+        class CountingBackend(SilentBackend):
+            def synthesize(self, text, path):
+                calls.append(text)
+                super().synthesize(text, path)
+
+        with tempfile.TemporaryDirectory() as audio_dir:
+            store = AudioStore(directory=audio_dir, backend=CountingBackend(latency=0.05))
+            filename = store.register("Hang up and call your bank.")
+            self.assertFalse(os.path.exists(store.path_for(filename)))
+
+            threads = [threading.Thread(target=store.ensure, args=(filename,)) for _ in range(8)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            self.assertEqual(len(calls), 1)
+            self.assertTrue(os.path.exists(store.path_for(filename)))
+            self.assertIsNone(store.ensure("advice_" + "0" * 32 + ".mp3"))
+
+    def test_audio_chunk_windows_overlap_and_merge(self):
+        self.assertEqual(chunk_windows(200, chunk_sec=300, overlap_sec=15), [(0.0, 200)])
+        windows = chunk_windows(720, chunk_sec=300, overlap_sec=15)
+        self.assertEqual(windows, [(0.0, 300.0), (285.0, 585.0), (570.0, 720)])
+
+        details = {"other_key_points": []}
+        chunk_results = [
+            (2, {"risk_level": "SCAM", "score": 95, "reasons": ["Asked for OTP"], "advice": "Hang up.",
+                 "transcript": "share the otp", "extracted_details": details}),
+            (0, {"risk_level": "SAFE", "score": 5, "reasons": ["Greeting"], "advice": "Looks fine.",
+                 "transcript": "hello", "extracted_details": details}),
+        ]
+        merged = merge_chunk_results(chunk_results, windows)
+        self.assertEqual(merged["risk_level"], "SCAM")
+        self.assertEqual(merged["advice"], "Hang up.")
+        self.assertEqual(merged["reasons"], ["Greeting", "Asked for OTP"])
+        self.assertEqual(merged["transcript"], "[0:00-5:00] hello\n[9:30-12:00] share the otp")
+        self.assertEqual(merged["audio_chunks"], {"analyzed": 2, "total": 3, "early_exit": True})
+
+    def test_heavy_dependencies_load_lazily(self):
+        heavy = ["cv2", "google.genai", "gtts", "PIL.Image", "qreader"]
+        code = f"import sys, main, agent; print([m for m in {heavy!r} if m in sys.modules])"
+        out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(out.stdout.strip(), "[]", out.stderr)
+
+    def test_pipeline_stats_does_not_build_the_gemini_client(self):
+        code = "import sys, server; stats = server.pipeline_stats(); print('google.genai' in sys.modules, stats['gemini'])"
+        out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)), env={**os.environ, "GEMINI_API_KEY": "test"})
+        self.assertEqual(out.stdout.strip().splitlines()[-1], "False {}", out.stderr)
+
+    def test_policy_short_circuits_certain_scams(self):
+        policy = DecisionPolicy(enabled=True, min_score=100)
+        rules = rule_based_risk_analyzer("Instant loan, pay processing fee in advance. Send Aadhaar photo.", "unknown")
+        result = policy.decide(rules, {})
+        self.assertEqual(result["tier"], "rules")
+        self.assertEqual(result["category"], "loan")
+        self.assertEqual(result["score"], 100)
+        self.assertIsNone(policy.decide(rules, {}, has_audio=True))
+        self.assertIsNone(policy.decide(rule_based_risk_analyzer("Your policy has a waiting period"), {}))
+
+        upi_result = {"extracted_details": {"pa": "scammer@upi"}, "verification_result": verify_vpa_mock_api("scammer@upi")}
+        result = policy.decide({}, upi_result, "upi_qr")
+        self.assertEqual(result["tier"], "upi_blocklist")
+        self.assertEqual(result["risk_level"], "SCAM")
+
+    def test_metrics_histogram_and_exposition(self):
+        latency = Histogram("test_latency_seconds", "Test latency", ["stage"], buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 3.0):
+            latency.observe(value, stage="rules")
+        lines = latency.render()
+        self.assertIn('test_latency_seconds_bucket{stage="rules",le="0.1"} 2', lines)
+        self.assertIn('test_latency_seconds_bucket{stage="rules",le="1.0"} 3', lines)
+        self.assertIn('test_latency_seconds_bucket{stage="rules",le="+Inf"} 4', lines)
+        self.assertIn('test_latency_seconds_count{stage="rules"} 4', lines)
+        self.assertIn("# TYPE fsn_stage_latency_seconds histogram", render())
+
     def test_upi_parsing(self):
         upi_string = "upi://pay?pa=merchant@okicici&pn=Shop&am=100"
         details = parse_upi_string(upi_string)
         self.assertEqual(details["pa"], "merchant@okicici")
 
+    def test_qr_fast_path_decodes_clean_code(self):
+        payload = "upi://pay?pa=merchant@okicici&pn=Shop&am=100"
+        code = cv2.QRCodeEncoder.create().encode(payload)
+        code = cv2.resize(code, None, fx=10, fy=10, interpolation=cv2.INTER_NEAREST)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "qr.png")
+            cv2.imwrite(path, cv2.copyMakeBorder(code, 40, 40, 40, 40, cv2.BORDER_CONSTANT, value=255))
+            before = qr_stage_stats()["counts"]["opencv"]
+            self.assertEqual(decode_qr_code(path), payload)
+            self.assertEqual(qr_stage_stats()["counts"]["opencv"], before + 1)
+
+            with open(path, "rb") as f:
+                self.assertEqual(decode_qr_code(f.read()), payload)
+            self.assertIsNone(decode_qr_code(b"not an image"))
+
+    def test_qr_pool_decodes_through_shared_memory(self):
+        payload = "upi://pay?pa=merchant@okicici&pn=Shop&am=100"
+        code = cv2.QRCodeEncoder.create().encode(payload)
+        code = cv2.resize(code, None, fx=10, fy=10, interpolation=cv2.INTER_NEAREST)
+        frame = cv2.cvtColor(cv2.copyMakeBorder(code, 40, 40, 40, 40, cv2.BORDER_CONSTANT, value=255), cv2.COLOR_GRAY2BGR)
+        encoded = cv2.imencode(".png", frame)[1].tobytes()
+
+        # OpenCV reads this code, so it decodes whether or not QReader can load in the workers
+        pool = QRDecodePool(workers=2, max_pending=2, slot_bytes=1024 * 1024).start()
+        try:
+            self.assertEqual(pool.decode_many([encoded, frame, b"not an image", encoded]), [payload, payload, None, payload])
+            self.assertEqual(pool.pending, 0)
+            # With every slot taken, a new image is refused instead of queued
+            held = [pool._acquire_slot() for _ in range(2)]
+            with self.assertRaises(QRPoolBusy):
+                pool.submit(encoded, timeout=0.01)
+            for slot in held:
+                pool._free.put(slot)
+        finally:
+            pool.shutdown()
+
+    def test_image_prep_fits_budget_and_caches(self):
+        rng = np.random.default_rng(7)
+        noisy = cv2.imencode(".png", rng.integers(0, 256, (2400, 1800, 3), dtype=np.uint8))[1].tobytes()
+        parts = prepare_image(noisy, max_pixels=1000 * 1000, max_bytes=200 * 1024)
+        self.assertEqual(len(parts), 1)
+        data, mime_type = parts[0]
+        self.assertEqual(mime_type, "image/jpeg")
+        self.assertLessEqual(len(data), 200 * 1024)
+        height, width = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR).shape[:2]
+        self.assertLessEqual(width * height, 1000 * 1000)
+        self.assertAlmostEqual(width / height, 1800 / 2400, places=2)
+        # Same content again is served from the cache
+        self.assertIs(prepare_image(noisy, max_pixels=1000 * 1000, max_bytes=200 * 1024), parts)
+
+        small = cv2.imencode(".png", np.full((64, 64, 3), 255, dtype=np.uint8))[1].tobytes()
+        self.assertEqual(prepare_image(small), [(small, "image/png")])
+
+    def test_phash_index_finds_near_duplicates_and_persists(self):
+        rng = np.random.default_rng(3)
+        poster = cv2.resize(rng.integers(0, 256, (24, 18, 3), dtype=np.uint8), (900, 1200), interpolation=cv2.INTER_NEAREST)
+        original = image_dhash(cv2.imencode(".png", poster)[1].tobytes())
+        # Resized and re-compressed copy of the same poster
+        copy = cv2.imencode(".jpg", cv2.resize(poster, (450, 600), interpolation=cv2.INTER_AREA),
+                            [cv2.IMWRITE_JPEG_QUALITY, 60])[1].tobytes()
+        other = image_dhash(cv2.imencode(".png", rng.integers(0, 256, (600, 450, 3), dtype=np.uint8))[1].tobytes())
+        self.assertIsNone(image_dhash(b"%PDF-1.7 not an image"))
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "phash.jsonl")
+            index = PerceptualIndex(max_entries=2, max_distance=10, path=path)
+            index.add(original, "upi", "upi://pay?pa=poster@ybl")
+            value, distance = index.lookup(image_dhash(copy), "upi")
+            self.assertEqual(value, "upi://pay?pa=poster@ybl")
+            self.assertLessEqual(distance, 10)
+            self.assertIsNone(index.lookup(image_dhash(copy), "other scope"))
+            self.assertIsNone(index.lookup(other, "upi"))
+
+            # Replayed from the log on restart, still bounded in size
+            index.add(other, "upi", "upi://pay?pa=other@ybl")
+            index.add(original ^ 1, "upi", "upi://pay?pa=newest@ybl")
+            reloaded = PerceptualIndex(max_entries=2, max_distance=10, path=path)
+            self.assertEqual(len(reloaded), 2)
+            self.assertEqual(reloaded.lookup(original, "upi"), ("upi://pay?pa=newest@ybl", 1))
+
+    def test_same_template_posters_keep_their_own_qr_payload(self):
+        from agent import FinancialSafetyNet
+        real = template_poster("upi://pay?pa=realshop@ybl&pn=Real%20Shop")
+        fraud = template_poster("upi://pay?pa=fraudster99@ybl&pn=Real%20Shop")
+        self.assertLessEqual(hamming(image_dhash(real), image_dhash(fraud)), 10) # Near-duplicates by layout
+
+        previous, phash_index._index = phash_index._index, PerceptualIndex()
+        try:
+            real_scan = scan_and_verify_upi(real)
+            fraud_scan = scan_and_verify_upi(fraud)
+            self.assertEqual(real_scan["extracted_details"]["pa"], "realshop@ybl")
+            self.assertEqual(fraud_scan["extracted_details"]["pa"], "fraudster99@ybl")
+
+            # A verdict stored for the real poster is only reused for the same payload
+            os.environ.setdefault("GEMINI_API_KEY", "test")
+            agent = FinancialSafetyNet()
+            real_key, _ = agent._near_duplicate_lookup(None, "upi_qr", image_dhash(real), real_scan)
+            phash_index._index.add(*real_key, {"risk_level": "SAFE"})
+            self.assertIsNone(agent._near_duplicate_lookup(None, "upi_qr", image_dhash(fraud), fraud_scan)[1])
+            self.assertEqual(agent._near_duplicate_lookup(None, "upi_qr", image_dhash(real), real_scan)[1]["risk_level"], "SAFE")
+
+            # Once the VPA is reported the stored verdict no longer applies
+            real_scan["verification_result"]["status"] = "BLOCKED"
+            self.assertIsNone(agent._near_duplicate_lookup(None, "upi_qr", image_dhash(real), real_scan)[1])
+            # QR verdicts stay out of the response cache for the same reason
+            self.assertIsNone(agent._cache_key(None, real, None, "upi_qr"))
+        finally:
+            phash_index._index = previous
+
+    def test_unreadable_qr_upload_returns_an_error(self):
+        self.assertIsNone(image_dhash(b""))
+        self.assertIsNone(image_dhash("/nonexistent.png"))
+        self.assertIsNone(image_dhash(b"not an image"))
+        self.assertIn("error", scan_and_verify_upi(b""))
+        self.assertIn("error", scan_and_verify_upi("/nonexistent.png"))
+
+    def test_reputation_store_lookup_and_reload(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "vpa.bin")
+            build_reputation_store(path, blocked=["fraud@ybl", "both@upi"], merchants=["Tea.Stall@okaxis", "both@upi"])
+            store = ReputationStore(path, reload_interval=0)
+            self.assertEqual(store.lookup_many(["fraud@ybl", " tea.stall@OKAXIS", "both@upi", "friend@upi"]), [
+                {"blocked": True, "merchant": False},
+                {"blocked": False, "merchant": True},
+                {"blocked": True, "merchant": True},
+                {"blocked": False, "merchant": False},
+            ])
+
+            build_reputation_store(path, blocked=["friend@upi"])
+            self.assertTrue(store.lookup("friend@upi")["blocked"])
+            self.assertFalse(store.lookup("fraud@ybl")["blocked"])
+
     def test_upi_mock_api(self):
         result = verify_vpa_mock_api("scammer@upi")
         self.assertEqual(result["status"], "BLOCKED")
         self.assertEqual(result["risk_level"], "SCAM")
 
+class TestGeminiClient(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeGeminiServer().start()
+        self.client = genai.Client(api_key="fake", http_options=types.HttpOptions(base_url=self.server.url))
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_retries_429_and_5xx_with_backoff(self):
+        self.server.statuses = [429, 503]
+        gemini = GeminiClient(self.client, rate=100, burst=10, backoff_base=0.01, backoff_max=0.05)
+        response = gemini.generate_content(model="gemini-1.5-flash", contents=["hi"])
+        self.assertIn("risk_level", response.text)
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(gemini.stats["retries"], 2)
+        self.assertEqual(gemini.stats["throttled"], 1)
+
+    def test_client_errors_are_not_retried(self):
+        self.server.statuses = [400]
+        gemini = GeminiClient(self.client, backoff_base=0.01)
+        with self.assertRaises(Exception):
+            gemini.generate_content(model="gemini-1.5-flash", contents=["hi"])
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_rate_limit_queues_then_respects_deadline(self):
+        # Warm up the HTTP connection so only the rate limit spaces the calls
+        GeminiClient(self.client).generate_content(model="gemini-1.5-flash", contents=["hi"])
+        self.server.requests.clear()
+        gemini = GeminiClient(self.client, rate=20, burst=1)
+        for _ in range(3):
+            gemini.generate_content(model="gemini-1.5-flash", contents=["hi"])
+        starts = [r["at"] for r in self.server.requests]
+        self.assertGreaterEqual(starts[-1] - starts[0], 0.08)
+
+        slow = GeminiClient(self.client, rate=1, burst=1)
+        slow.generate_content(model="gemini-1.5-flash", contents=["hi"])
+        with self.assertRaises(DeadlineExceeded):
+            slow.generate_content(model="gemini-1.5-flash", contents=["hi"], timeout=0.2)
+
+    def test_blocking_call_times_out_at_deadline(self):
+        self.server.latency = 2.0
+        gemini = GeminiClient(self.client)
+        started = time.monotonic()
+        with self.assertRaises(DeadlineExceeded):
+            gemini.generate_content(model="gemini-1.5-flash", contents=["hi"], timeout=0.3)
+        self.assertLess(time.monotonic() - started, 1.5)
+
+    def test_async_call_is_cancelled_at_deadline(self):
+        self.server.latency = 0.5
+        gemini = GeminiClient(self.client)
+        with self.assertRaises(DeadlineExceeded):
+            asyncio.run(gemini.agenerate_content(model="gemini-1.5-flash", contents=["hi"], timeout=0.1))
+
+    def test_stream_retries_before_first_chunk(self):
+        self.server.statuses = [503]
+        gemini = GeminiClient(self.client, backoff_base=0.01)
+
+        async def collect():
+            return [chunk.text async for chunk in gemini.astream_content(model="gemini-1.5-flash", contents=["hi"])]
+
+        chunks = asyncio.run(collect())
+        self.assertGreater(len(chunks), 1)
+        self.assertIn("risk_level", json.loads("".join(chunks)))
+        self.assertEqual(gemini.stats["retries"], 1)
+
+    def test_router_fails_over_on_429_and_hedges_slow_model(self):
+        gemini = GeminiClient(self.client, rate=100, burst=10, backoff_base=0.01)
+        router = ModelRouter(["model-a", "model-b"], min_samples=3, hedge_min_sec=0.05)
+        self.server.model_statuses = {"model-a": [429]}
+        response = router.generate(gemini, contents=["hi"])
+        self.assertIn("risk_level", response.text)
+        self.assertEqual([r["model"] for r in self.server.requests], ["model-a", "model-b"])
+        self.assertEqual(router.ranked()[0], "model-b") # model-a cools down after the 429
+
+        for _ in range(3):
+            router.record("model-b", 0.01)
+        self.server.requests.clear()
+        self.server.model_latency = {"model-b": 0.5}
+        response = asyncio.run(router.agenerate(gemini, contents=["hi"], validate=lambda r: "risk_level" in r.text))
+        self.assertIn("risk_level", response.text)
+        # model-b blew past its p95, so the hedge on model-a answered first
+        self.assertEqual([r["model"] for r in self.server.requests], ["model-b", "model-a"])
+        # The cancelled primary adds a latency sample but no successful outcome
+        stats = router._stats["model-b"]
+        self.assertEqual(len(stats.latencies), 5) # Failover win, three recorded, the cancelled call
+        self.assertEqual(len(stats.outcomes), 4) # Not the cancelled call
+
+        # Nobody answers in time: the router gives up at the deadline and cancels both calls
+        self.server.model_latency = {"model-a": 1.0, "model-b": 1.0}
+        started = time.monotonic()
+        with self.assertRaises(DeadlineExceeded):
+            asyncio.run(router.agenerate(gemini, contents=["hi"], timeout=0.3))
+        self.assertLess(time.monotonic() - started, 0.8)
+
+    def test_context_cache_serves_instruction_and_falls_back(self):
+        # Too short to cache: never sent to the API
+        self.assertFalse(ContextCache("You are a fraud analyst.", enabled=True).enabled)
+        self.assertIsNone(ContextCache("You are a fraud analyst.", enabled=True).get(self.client, "gemini-1.5-flash"))
+        self.assertEqual(self.server.requests, [])
+
+        cache = ContextCache("You are a fraud analyst. " * 100, enabled=True, min_tokens=512)
+        self.assertTrue(cache.refresh(self.client, "gemini-1.5-flash"))
+        name = cache.get(self.client, "gemini-1.5-flash")
+        self.assertIsNotNone(name)
+        gemini = GeminiClient(self.client)
+        config = types.GenerateContentConfig(cached_content=name, response_mime_type="application/json")
+        response = gemini.generate_content(model="gemini-1.5-flash", contents=["hi"], config=config)
+        self.assertEqual(response.usage_metadata.cached_content_token_count, 625)
+        self.assertTrue(cache.refresh(self.client, "gemini-1.5-flash")) # TTL extended in place
+        self.assertEqual(cache.get(self.client, "gemini-1.5-flash"), name)
+
+        self.server.caches.clear() # Expired on the server
+        with self.assertRaises(Exception) as raised:
+            gemini.generate_content(model="gemini-1.5-flash", contents=["hi"], config=config)
+        self.assertTrue(cache.handle_error(raised.exception))
+        self.assertIsNone(cache.stats()["models"]["gemini-1.5-flash"]["name"])
+
+        self.server.cache_status = 400 # e.g. prompt below the minimum cacheable size
+        failing = ContextCache("You are a fraud analyst. " * 100, enabled=True, min_tokens=512, retry_sec=60)
+        self.assertFalse(failing.refresh(self.client, "gemini-1.5-flash"))
+        self.assertIsNone(failing.get(self.client, "gemini-1.5-flash"))
+
+class TestServerEndpoints(unittest.TestCase):
+    """
+    The HTTP and WebSocket endpoints end to end, against the fake Gemini server.
+    """
+    def setUp(self):
+        import server
+        from agent import FinancialSafetyNet
+        self.server = FakeGeminiServer().start()
+        self.audio_dir = tempfile.TemporaryDirectory()
+        os.environ.setdefault("GEMINI_API_KEY", "test")
+        agent = FinancialSafetyNet()
+        agent._base_url = self.server.url
+        agent.audio_store = AudioStore(directory=self.audio_dir.name, backend=SilentBackend())
+        self.app = server.app
+        self._previous_agent, server.agent = server.agent, agent
+
+    def tearDown(self):
+        import server
+        server.agent = self._previous_agent
+        self.server.stop()
+        self.audio_dir.cleanup()
+
+    def request(self, path: str, data: dict, files: dict = None):
+        async def send():
+            transport = httpx.ASGITransport(app=self.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                return await client.post(path, data=data, files=files)
+        return asyncio.run(send())
+
+    def stream_events(self, data: dict, files: dict = None) -> list:
+        response = self.request("/analyze/stream", data, files)
+        self.assertEqual(response.status_code, 200)
+        events = []
+        for block in response.text.strip().split("\n\n"):
+            event, payload = block.split("\n")
+            events.append((event[len("event: "):], json.loads(payload[len("data: "):])))
+        return events
+
+    def test_analyze_calls_gemini_once_then_serves_the_cache(self):
+        form = {"text": "Is this personal loan offer from my bank genuine?", "type": "loan"}
+        result = self.request("/analyze", form).json()
+        self.assertEqual(result["risk_level"], "SUSPICIOUS")
+        self.assertEqual(result["tier"], "llm")
+        self.assertTrue(result["audio_advice_url"].startswith("/static/audio/advice_"))
+        self.assertEqual(len(self.server.requests), 1)
+
+        again = self.request("/analyze", form).json()
+        self.assertEqual(again["tier"], "cache")
+        self.assertEqual(again["risk_level"], "SUSPICIOUS")
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_large_upload_is_spooled_once_and_removed(self):
+        import server
+        from starlette.formparsers import MultiPartParser
+        poster = template_poster("upi://pay?pa=realshop@ybl&pn=Real%20Shop")
+        seen = {}
+        analyze_async = server.agent.analyze_async
+
+        async def capture(**kwargs):
+            seen.update(kwargs)
+            with open(kwargs["image_path"], "rb") as f:
+                seen["data"] = f.read()
+            return await analyze_async(**kwargs)
+
+        previous, server.UPLOAD_SPOOL_THRESHOLD = server.UPLOAD_SPOOL_THRESHOLD, 1024
+        server.agent.analyze_async = capture
+        try:
+            result = self.request("/analyze", {"type": "upi_qr"}, {"file": ("poster.png", poster, "image/png")}).json()
+        finally:
+            server.UPLOAD_SPOOL_THRESHOLD = previous
+        self.assertEqual(result["tier"], "llm")
+        self.assertIn("realshop@ybl", json.dumps(self.server.requests[-1]["body"])) # Decoded from the spooled file
+        # The agent read the parser's own temp file, which is gone afterwards
+        self.assertEqual(seen["data"], poster)
+        self.assertTrue(seen["image_path"].endswith(".png"))
+        self.assertFalse(os.path.exists(seen["image_path"]))
+        self.assertEqual(MultiPartParser.spool_max_size, 1024 * 1024) # Starlette's default is untouched
+
+    def test_analyze_records_stage_latencies_in_metrics(self):
+        stages = ("cache_lookup", "rules", "gemini")
+        before = {stage: STAGE_LATENCY.count(stage=stage) for stage in stages}
+        result = self.request("/analyze", {"text": "Is this gold loan scheme at my branch real?", "type": "loan"}).json()
+        self.assertEqual(result["tier"], "llm")
+
+        async def scrape():
+            transport = httpx.ASGITransport(app=self.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                return await client.get("/metrics")
+        exposition = asyncio.run(scrape()).text
+        for stage in stages:
+            self.assertIn(f'fsn_stage_latency_seconds_count{{stage="{stage}"}} {before[stage] + 1}', exposition)
+
+    def test_analyze_stream_event_order_cache_and_error(self):
+        form = {"text": "Is this personal loan offer from my bank genuine?", "type": "loan"}
+        events = self.stream_events(form)
+        names = [name for name, _ in events]
+        self.assertEqual([n for i, n in enumerate(names) if i == 0 or n != names[i - 1]],
+                         ["local", "partial", "result", "audio", "done"])
+        self.assertEqual(names.count("partial"), self.server.stream_chunks)
+        partial_text = "".join(data["text"] for name, data in events if name == "partial")
+        result = dict(events)["result"]
+        self.assertEqual(json.loads(partial_text)["risk_level"], result["risk_level"])
+        self.assertEqual(result["tier"], "llm")
+
+        # Cache hit: no local verdict and no Gemini call
+        self.assertEqual([name for name, _ in self.stream_events(form)], ["result", "audio", "done"])
+        self.assertEqual(len(self.server.requests), 1)
+
+        self.server.statuses = [400]
+        events = self.stream_events({"text": "What does this insurance exclusion mean?", "type": "insurance"})
+        self.assertEqual([name for name, _ in events], ["local", "error", "done"])
+        self.assertIn("error", dict(events)["error"])
+
+        # An upload without text gives the rules nothing to judge: no local verdict
+        self.server.statuses = []
+        events = self.stream_events({"type": "loan"}, {"file": ("offer.png", template_poster("not a upi payload"), "image/png")})
+        self.assertNotIn("local", [name for name, _ in events])
+        self.assertEqual(dict(events)["result"]["tier"], "llm")
+
+    def test_live_call_websocket_updates_transcribes_and_ends(self):
+        from starlette.testclient import TestClient
+        with TestClient(self.app) as client, client.websocket_connect("/ws/call?mime_type=audio/wav") as ws:
+            ws.send_json({"text": "Hello, I am calling from the CBI police"})
+            update = ws.receive_json()
+            self.assertEqual(update["event"], "update")
+            self.assertEqual(update["score"], 80)
+
+            ws.send_bytes(b"RIFF fake audio clip")
+            transcript = ws.receive_json()
+            self.assertEqual(transcript["event"], "transcript")
+            self.assertIn("risk_level", transcript["text"]) # The fake server answers with its JSON result
+            self.assertIn(":generateContent", self.server.requests[-1]["path"])
+
+            ws.send_json({"text": "please share the OTP"})
+            self.assertGreater(ws.receive_json()["score"], 80) # OTP sharing adds to the score
+            ws.send_json({"type": "end"})
+            result = ws.receive_json()
+            self.assertEqual(result["event"], "result")
+            self.assertEqual(result["risk_level"], "SCAM")
+
 if __name__ == '__main__':
     unittest.main()
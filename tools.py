@@ -1,82 +1,134 @@
-import re
+from matcher import RuleEngine
 
-def rule_based_risk_analyzer(text: str, category: str = "unknown") -> dict:
-    """
-    Analyzes text for specific risk indicators based on category.
-    Returns a dictionary with risk_level, score, and reasons.
-    """
-    text = text.lower()
-    reasons = []
-    score = 0
-    
-    # UPI Fraud Indicators
-    if category == "upi" or "upi" in text or "paytm" in text or "gpay" in text or "phonepe" in text:
-        if "pin" in text and ("receive" in text or "get" in text or "won" in text):
-            reasons.append("Asks for UPI PIN to receive money (High Risk)")
-            score += 90
-        if "kyc" in text and ("update" in text or "expire" in text or "block" in text):
-            reasons.append("Urgent KYC update request (Common Phishing)")
-            score += 80
-        if re.search(r"bit\.ly|tinyurl", text):
-            reasons.append("Contains suspicious shortened link")
-            score += 60
-        if "lottery" in text or "winner" in text:
-            reasons.append("Lottery/Prize claim (Common Scam)")
-            score += 85
+# Terms that switch on a category even when the caller did not hint it
+CATEGORY_TRIGGERS = {
+    "upi": ["upi", "paytm", "gpay", "phonepe"],
+    "loan": ["loan", "credit"],
+    "insurance": ["policy"],
+    "sensitive": None,  # Always checked
+}
 
-    # Loan Risk Indicators
-    if category == "loan" or "loan" in text or "credit" in text:
-        # Check for high interest rates (simple regex, can be improved)
-        interest_match = re.search(r"(\d{1,2})%", text)
-        if interest_match:
-            rate = int(interest_match.group(1))
-            if rate > 24:
-                reasons.append(f"Very high interest rate detected: {rate}%")
-                score += 70
-        
-        if "processing fee" in text and ("advance" in text or "before" in text):
-            reasons.append("Demands advance processing fee (Illegal/Scam)")
-            score += 95
-        
-        if "no cibil" in text or "no documents" in text:
-            reasons.append("Too good to be true (No CIBIL/Docs check)")
-            score += 50
+# Sensitive Data Indicators (Privacy Protection)
+SENSITIVE_KEYWORDS = ["aadhaar", "pan card", "voter id", "driving license", "passport", "otp", "cvv", "password"]
+SHARING_TERMS = ["send", "share", "upload", "photo", "verify"]
 
+RISK_RULES = [
+    # UPI Fraud Indicators
+    {
+        "category": "upi",
+        "all_of": [["pin"], ["receive", "get", "won"]],
+        "score": 90,
+        "reason": "Asks for UPI PIN to receive money (High Risk)",
+    },
+    {
+        "category": "upi",
+        "all_of": [["kyc"], ["update", "expire", "block"]],
+        "score": 80,
+        "reason": "Urgent KYC update request (Common Phishing)",
+    },
+    {
+        "category": "upi",
+        "all_of": [["bit.ly", "tinyurl"]],
+        "score": 60,
+        "reason": "Contains suspicious shortened link",
+    },
+    {
+        "category": "upi",
+        "all_of": [["lottery", "winner"]],
+        "score": 85,
+        "reason": "Lottery/Prize claim (Common Scam)",
+    },
+    # Loan Risk Indicators
+    {
+        "category": "loan",
+        "all_of": [["%"]],
+        "pattern": r"(\d{1,2})%",
+        "min_value": 24,
+        "score": 70,
+        "reason": "Very high interest rate detected: {value}%",
+    },
+    {
+        "category": "loan",
+        "all_of": [["processing fee"], ["advance", "before"]],
+        "score": 95,
+        "reason": "Demands advance processing fee (Illegal/Scam)",
+    },
+    {
+        "category": "loan",
+        "all_of": [["no cibil", "no documents"]],
+        "score": 50,
+        "reason": "Too good to be true (No CIBIL/Docs check)",
+    },
     # Insurance Risk Indicators
-    if category == "insurance" or "policy" in text:
-        if "waiting period" in text:
-            reasons.append("Contains waiting period clause")
-            score += 20
-        if "exclusion" in text or "not cover" in text:
-            reasons.append("Contains exclusion clauses")
-            score += 30
-        if "pre-existing" in text:
-            reasons.append("Mentions pre-existing disease limitations")
-            score += 25
+    {
+        "category": "insurance",
+        "all_of": [["waiting period"]],
+        "score": 20,
+        "reason": "Contains waiting period clause",
+    },
+    {
+        "category": "insurance",
+        "all_of": [["exclusion", "not cover"]],
+        "score": 30,
+        "reason": "Contains exclusion clauses",
+    },
+    {
+        "category": "insurance",
+        "all_of": [["pre-existing"]],
+        "score": 25,
+        "reason": "Mentions pre-existing disease limitations",
+    },
+]
 
-    # Sensitive Data Indicators (Privacy Protection)
-    sensitive_keywords = ["aadhaar", "pan card", "voter id", "driving license", "passport", "otp", "cvv", "password"]
-    for keyword in sensitive_keywords:
-        if keyword in text:
-            if "send" in text or "share" in text or "upload" in text or "photo" in text or "verify" in text:
-                reasons.append(f"Requests sharing of sensitive document/info: {keyword.upper()} (High Privacy Risk)")
-                score += 85
-            else:
-                reasons.append(f"Mentions sensitive document: {keyword.upper()}")
-                score += 10
+for keyword in SENSITIVE_KEYWORDS:
+    RISK_RULES.append({
+        "category": "sensitive",
+        "all_of": [[keyword], SHARING_TERMS],
+        "score": 85,
+        "reason": f"Requests sharing of sensitive document/info: {keyword.upper()} (High Privacy Risk)",
+    })
+    RISK_RULES.append({
+        "category": "sensitive",
+        "all_of": [[keyword]],
+        "none_of": SHARING_TERMS,
+        "score": 10,
+        "reason": f"Mentions sensitive document: {keyword.upper()}",
+    })
 
-    # Determine Risk Level
+# Compiled once at import; every call is a single scan over the text
+risk_engine = RuleEngine(RISK_RULES, CATEGORY_TRIGGERS)
+
+def score_to_risk_level(score: int) -> str:
+    """
+    Maps a cumulative rule score to a risk level.
+    """
     if score >= 80:
-        risk_level = "SCAM"
+        return "SCAM"
     elif score >= 50:
-        risk_level = "SUSPICIOUS"
+        return "SUSPICIOUS"
     elif score >= 20:
-        risk_level = "CONFUSING"
-    else:
-        risk_level = "SAFE"
+        return "CONFUSING"
+    return "SAFE"
+
+def reason_category(reason: str) -> str:
+    """
+    Maps a rule reason back to the rule table category it came from.
+    Returns None for reasons not produced by this rule table.
+    """
+    for rule in RISK_RULES:
+        if reason.startswith(rule["reason"].split("{")[0]):
+            return rule["category"]
+    return None
+
+def rule_based_risk_analyzer(text: str, category: str = "unknown") -> dict:
+    """
+    Analyzes text for specific risk indicators based on category.
+    Returns a dictionary with risk_level, score, and reasons.
+    """
+    score, reasons = risk_engine.match(text.lower(), category)
 
     return {
-        "risk_level": risk_level,
+        "risk_level": score_to_risk_level(score),
         "score": min(score, 100),
         "reasons": reasons
     }
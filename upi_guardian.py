@@ -1,9 +1,20 @@
-import cv2
-from qreader import QReader
+import os
+import threading
+from metrics import timed, QR_DECODE_STAGE
 import time
 
-# Initialize QReader
-qreader = QReader()
+# OpenCV and the QReader model are loaded on first use (or by warm_up), so
+# importing this module for VPA checks stays cheap
+_qreader = None
+_qreader_lock = threading.Lock()
+
+# Longest image side used by the fast OpenCV stage
+QR_FAST_MAX_SIDE = int(os.getenv("QR_FAST_MAX_SIDE", "1024"))
+QR_FAST_PATH_ENABLED = os.getenv("QR_FAST_PATH_ENABLED", "1") == "1"
+
+# Offline-built reputation store of reported VPAs and verified merchants (see reputation.py)
+VPA_REPUTATION_PATH = os.getenv("VPA_REPUTATION_PATH")
+VPA_REPUTATION_RELOAD_SEC = float(os.getenv("VPA_REPUTATION_RELOAD_SEC", "30"))
 
 # Mock Blocklist
 UPI_BLOCKLIST = [
@@ -12,22 +23,151 @@ UPI_BLOCKLIST = [
     "urgent.kyc@paytm"
 ]
 
-def decode_qr_code(image_path: str) -> str:
+# Decode stages tried in order; QReader is only the fallback
+QR_STAGES = ["wechat", "opencv", "qreader"]
+_stage_counts = {stage: 0 for stage in QR_STAGES + ["miss"]}
+_stage_lock = threading.Lock()
+_local = threading.local() # OpenCV detectors are not shared across threads
+
+def get_qreader():
+    """
+    Returns the shared QReader, loading its detection model on first use.
+    """
+    global _qreader
+    if _qreader is None:
+        with _qreader_lock:
+            if _qreader is None:
+                from qreader import QReader
+                _qreader = QReader()
+    return _qreader
+
+def warm_up():
+    """
+    Loads OpenCV, the fast detectors and the QReader model ahead of the first scan.
+    """
+    _fast_detectors()
+    get_qreader()
+
+def _record_stage(stage: str):
+    if stage is None:
+        return # Fast stages only missed; the caller decides on the fallback
+    with _stage_lock:
+        _stage_counts[stage] += 1
+    QR_DECODE_STAGE.inc(stage=stage)
+
+def qr_stage_stats() -> dict:
     """
-    Decodes a QR code image and returns the data (UPI string).
+    Returns how often each decode stage produced the answer.
     """
+    with _stage_lock:
+        counts = dict(_stage_counts)
+    total = sum(counts.values())
+    return {
+        "decodes": total,
+        "counts": counts,
+        "hit_rates": {stage: round(count / total, 4) if total else 0.0 for stage, count in counts.items()},
+    }
+
+def _fast_detectors() -> list:
+    import cv2
+    detectors = getattr(_local, "detectors", None)
+    if detectors is None:
+        detectors = []
+        if hasattr(cv2, "wechat_qrcode"): # Only in opencv-contrib builds
+            wechat = cv2.wechat_qrcode.WeChatQRCode()
+            detectors.append(("wechat", lambda img: next(iter(wechat.detectAndDecode(img)[0]), "")))
+        opencv = cv2.QRCodeDetector()
+        detectors.append(("opencv", lambda img: opencv.detectAndDecode(img)[0]))
+        _local.detectors = detectors
+    return detectors
+
+def _downscaled_gray(img, max_side: int = QR_FAST_MAX_SIDE):
+    import cv2
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if img.ndim == 3 else img
+    height, width = gray.shape[:2]
+    scale = max_side / max(height, width)
+    if scale < 1:
+        gray = cv2.resize(gray, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+    return gray
+
+def decode_qr_fast(img):
+    """
+    Cheap decode on a downscaled grayscale copy.
+    Returns (data, stage) or (None, None) if no fast detector could read it.
+    """
+    import cv2
+    gray = _downscaled_gray(img)
+    for stage, detect in _fast_detectors():
+        try:
+            data = detect(gray)
+        except cv2.error:
+            data = None
+        if data:
+            return data, stage
+    return None, None
+
+def decode_qr_qreader(img):
+    """
+    Deep QReader detector on the full-resolution RGB image.
+    """
+    import cv2
+    decoded_text = get_qreader().detect_and_decode(image=cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+    if decoded_text and len(decoded_text) > 0:
+        return decoded_text[0] # Return first QR code found
+    return None
+
+def decode_qr_stages(img, fast_path: bool = QR_FAST_PATH_ENABLED, fallback: bool = True):
+    """
+    Staged decode of a BGR image: fast OpenCV stages first, QReader as fallback.
+    Returns (data, stage); stage is "miss" when nothing could be decoded, and
+    None when only the fast stages ran (fallback=False) and missed.
+    """
+    if fast_path:
+        with timed("qr_fast"):
+            data, stage = decode_qr_fast(img)
+        if data:
+            return data, stage
+        if not fallback:
+            return None, None
+
+    with timed("qr_qreader"):
+        data = decode_qr_qreader(img)
+    return data, "qreader" if data else "miss"
+
+def decode_qr_image(img, fast_path: bool = QR_FAST_PATH_ENABLED, fallback: bool = True):
+    data, stage = decode_qr_stages(img, fast_path, fallback)
+    _record_stage(stage)
+    return data
+
+def load_image(image):
+    """
+    Reads a BGR image from a file path or decodes it straight from bytes.
+    Returns None if the data is not a readable image.
+    """
+    import cv2
+    import numpy as np
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return cv2.imdecode(np.frombuffer(image, dtype=np.uint8), cv2.IMREAD_COLOR)
+    return cv2.imread(image)
+
+def decode_qr_code(image, fast_path: bool = QR_FAST_PATH_ENABLED, fallback: bool = True) -> str:
+    """
+    Decodes a QR code image (file path or encoded bytes) and returns the data (UPI string).
+    With fallback=False only the fast stages run and QReader is skipped.
+    Runs in the QR process pool when one is started (see qr_pool.py).
+    """
+    from qr_pool import get_pool
+    pool = get_pool()
+    if pool is not None:
+        return pool.decode(image, fast_path=fast_path, fallback=fallback)
     try:
         # Read the image
-        img = cv2.imread(image_path)
+        with timed("qr_image_load"):
+            img = load_image(image)
         if img is None:
             return None
             
-        # Detect and decode
-        decoded_text = qreader.detect_and_decode(image=cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
-        
-        if decoded_text and len(decoded_text) > 0:
-            return decoded_text[0] # Return first QR code found
-        return None
+        return decode_qr_image(img, fast_path=fast_path, fallback=fallback)
     except Exception as e:
         print(f"Error decoding QR: {e}")
         return None
@@ -48,14 +188,24 @@ def parse_upi_string(upi_string: str) -> dict:
             
     return details
 
-def verify_vpa_mock_api(vpa: str) -> dict:
+_reputation_store = None
+_reputation_lock = threading.Lock()
+
+def get_reputation_store():
     """
-    Simulates a Bank API call to verify a VPA.
+    Opens the memory-mapped reputation store configured by VPA_REPUTATION_PATH.
+    Returns None when no store is configured.
     """
-    # Simulate network latency
-    # time.sleep(0.5) 
-    
-    if vpa in UPI_BLOCKLIST:
+    global _reputation_store
+    if _reputation_store is None and VPA_REPUTATION_PATH and os.path.exists(VPA_REPUTATION_PATH):
+        with _reputation_lock:
+            if _reputation_store is None:
+                from reputation import ReputationStore
+                _reputation_store = ReputationStore(VPA_REPUTATION_PATH, reload_interval=VPA_REPUTATION_RELOAD_SEC)
+    return _reputation_store
+
+def _vpa_verdict(vpa: str, reputation: dict = None) -> dict:
+    if vpa in UPI_BLOCKLIST or (reputation and reputation["blocked"]):
         return {
             "status": "BLOCKED",
             "risk_level": "SCAM",
@@ -63,7 +213,10 @@ def verify_vpa_mock_api(vpa: str) -> dict:
             "message": "This UPI ID has been reported for fraud."
         }
     
-    if "shop" in vpa or "merchant" in vpa:
+    # With a merchant registry loaded, only registered VPAs count as verified;
+    # the name heuristic is just the fallback for running without one.
+    verified = reputation["merchant"] if reputation is not None else ("shop" in vpa or "merchant" in vpa)
+    if verified:
         return {
             "status": "VERIFIED",
             "risk_level": "SAFE",
@@ -78,18 +231,86 @@ def verify_vpa_mock_api(vpa: str) -> dict:
         "message": "Verify the name before paying."
     }
 
-def scan_and_verify_upi(image_path: str) -> dict:
+def verify_vpa_mock_api(vpa: str) -> dict:
     """
-    Orchestrates the UPI scanning and verification process.
+    Simulates a Bank API call to verify a VPA.
+    Backed by the reputation store when one is configured.
+    """
+    # Simulate network latency
+    # time.sleep(0.5) 
+    store = get_reputation_store()
+    return _vpa_verdict(vpa, store.lookup(vpa) if store else None)
+
+def verify_vpas(vpas: list) -> list:
+    """
+    Verifies many VPAs with a single vectorized reputation store lookup.
+    """
+    store = get_reputation_store()
+    if store is None:
+        return [_vpa_verdict(vpa) for vpa in vpas]
+    return [_vpa_verdict(vpa, reputation) for vpa, reputation in zip(vpas, store.lookup_many(vpas))]
+
+def decode_qr_codes(images: list, fast_path: bool = QR_FAST_PATH_ENABLED) -> list:
+    """
+    Decodes many QR images; spread over the QR process pool when one is started.
+    """
+    from qr_pool import get_pool
+    pool = get_pool()
+    if pool is not None:
+        return pool.decode_many(images, fast_path=fast_path)
+    return [decode_qr_code(image, fast_path=fast_path) for image in images]
+
+def _upi_details(upi_string: str):
+    """
+    Returns (details, error) for a decoded QR payload.
     """
-    upi_string = decode_qr_code(image_path)
-    
     if not upi_string:
-        return {"error": "No QR code found or could not decode."}
-        
+        return None, {"error": "No QR code found or could not decode."}
     details = parse_upi_string(upi_string)
     if not details or "pa" not in details: # 'pa' is the parameter for Payee Address (VPA)
-        return {"error": "Invalid UPI QR code."}
+        return None, {"error": "Invalid UPI QR code."}
+    return details, None
+
+def _decode_with_phash(image, phash=None):
+    """
+    Decodes a QR image, skipping the QReader fallback when a near-duplicate
+    image (see phash_index.py) already defeated every stage.
+    The payload is always decoded from this image: same-template posters
+    with different QR codes are near-duplicates too, so a stored payload
+    is never substituted.
+    """
+    from phash_index import get_phash_index, image_dhash, PHASH_LOOKUPS
+    index = get_phash_index()
+    if index is None:
+        return decode_qr_code(image)
+    if phash is None:
+        phash = image_dhash(image)
+    if phash is None:
+        return decode_qr_code(image)
+    known_miss = index.lookup(phash, "qr_miss") is not None
+    PHASH_LOOKUPS.inc(scope="qr_miss", result="hit" if known_miss else "miss")
+    upi_string = decode_qr_code(image, fallback=not known_miss)
+    if known_miss and not upi_string:
+        _record_stage("miss")
+    elif not upi_string:
+        index.add(phash, "qr_miss", True)
+    return upi_string
+
+def scan_and_verify_upi(image, phash=None) -> dict:
+    """
+    Orchestrates the UPI scanning and verification process.
+    Accepts a file path or the encoded image bytes, and optionally its
+    perceptual hash if the caller already computed it.
+    """
+    from qr_pool import QRPoolBusy
+    try:
+        upi_string = _decode_with_phash(image, phash)
+    except QRPoolBusy as e:
+        return {"error": str(e)}
+
+    details, error = _upi_details(upi_string)
+    if error:
+        return error
         
     vpa = details["pa"]
     verification = verify_vpa_mock_api(vpa)
@@ -99,3 +320,25 @@ def scan_and_verify_upi(image_path: str) -> dict:
         "extracted_details": details,
         "verification_result": verification
     }
+
+def scan_and_verify_upi_batch(images: list) -> list:
+    """
+    Scans many QR images (e.g. a merchant onboarding upload) and verifies all
+    decoded VPAs with one reputation lookup. Results are in input order.
+    """
+    upi_strings = decode_qr_codes(images)
+    parsed = [_upi_details(upi_string) for upi_string in upi_strings]
+    vpas = [details["pa"] for details, error in parsed if not error]
+    verifications = iter(verify_vpas(vpas))
+
+    results = []
+    for upi_string, (details, error) in zip(upi_strings, parsed):
+        if error:
+            results.append(error)
+            continue
+        results.append({
+            "upi_string": upi_string,
+            "extracted_details": details,
+            "verification_result": next(verifications)
+        })
+    return results